@@ -0,0 +1,134 @@
+import numpy as np
+from SALib.sample.latin import sample as lhs
+from SurrogateSobol import GPSurrogate
+
+
+def select_batch(surrogate, candidates, batch_size, criterion = "variance", integration_points = None):
+
+    """
+    Batch of simulations chosen greedily among candidate points from a fitted GPSurrogate. The first point of the
+    batch maximizes the criterion. The posterior covariance is then updated as if that point had been simulated,
+    and the next point is chosen the same way. The update does not depend on the outputs, so the points of a batch
+    are spread out and can be simulated in parallel.
+    criterion: "variance" (largest predictive variance) or "imse" (largest reduction of the predictive variance
+               integrated over the integration points)
+    integration_points: points over which the variance is integrated ("imse"), the candidates by default
+    return: the points of the batch (rows of candidates)
+    """
+
+    if criterion not in ("variance", "imse"):
+        raise ValueError("Unknown criterion {}, 'variance' or 'imse' expected".format(criterion))
+
+    candidates = np.asarray(candidates, dtype = float)
+    noise = 1/surrogate.lambda_sim
+    cov = surrogate.covariance(candidates, candidates)
+    if criterion == "imse":
+        cov_int = cov if integration_points is None else surrogate.covariance(integration_points, candidates)
+
+    chosen = []
+    for _ in range(min(batch_size, len(candidates))):
+        var = np.maximum(np.diag(cov), 0)
+        if criterion == "variance":
+            score = var.copy()
+        else:
+            score = np.sum(cov_int**2, axis = 0)/(var + noise)
+        score[chosen] = -np.inf
+        k = int(np.argmax(score))
+        chosen.append(k)
+
+        # Covariances given a simulation at the candidate k, whatever its output
+        denom = max(cov[k, k] + noise, 1e-12)
+        if criterion == "imse" and integration_points is not None:
+            cov_int = cov_int - np.outer(cov_int[:, k], cov[:, k])/denom
+        cov = cov - np.outer(cov[:, k], cov[:, k])/denom
+        if criterion == "imse" and integration_points is None:
+            cov_int = cov
+
+    return candidates[chosen]
+
+
+class AdaptiveDesign:
+
+    """
+    Adaptive design of the simulations of one scalar output. An initial Latin hypercube sample is simulated and a
+    GPSurrogate is fitted on it. Then, while the leave-one-out Q2 of the emulator is below the target, batches
+    chosen by select_batch among Latin hypercube candidates are simulated and the emulator is fitted again. The
+    simulations are run by the caller, so that the batches of several designs (e.g. all the months of a campaign)
+    can share the same workers.
+    """
+
+    def __init__(self, problem, initial_size, batch_size, max_size, target_q2 = 0.95, criterion = "variance",
+                 num_candidates = 2000, num_processors = None, seed = None):
+
+        """
+        problem: SALib problem of the parameters
+        initial_size: number of samples of the initial design
+        batch_size: number of samples added at each step (a multiple of the number of processes)
+        max_size: maximum number of samples of the design
+        target_q2: leave-one-out Q2 of the emulator at which the design stops
+        criterion: criterion of select_batch
+        num_candidates: number of Latin hypercube candidates of each batch
+        """
+
+        self.problem = problem
+        self.initial_size = initial_size
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.target_q2 = target_q2
+        self.criterion = criterion
+        self.num_candidates = num_candidates
+        self.num_processors = num_processors
+        self.seed = 2024 if seed is None else seed
+
+        self.X = np.zeros((0, problem['num_vars']))
+        self.y = np.zeros(0)
+        self.surrogate = None
+        self.cv = None
+        self.history = []
+
+        # Bounds of the emulator inputs: bounds of the uniform parameters, range of a large sample for the others
+        reference = lhs(problem, num_candidates, seed = self.seed)
+        self.lower = [b[0] if dist == 'unif' else reference[:, k].min()
+                      for k, (b, dist) in enumerate(zip(problem['bounds'], problem['dists']))]
+        self.upper = [b[1] if dist == 'unif' else reference[:, k].max()
+                      for k, (b, dist) in enumerate(zip(problem['bounds'], problem['dists']))]
+
+
+    def initial(self):
+
+        """
+        Samples of the initial design
+        """
+
+        return lhs(self.problem, self.initial_size, seed = self.seed + 1)
+
+
+    def update(self, X, y):
+
+        """
+        Add simulated samples X and their outputs y to the design and fit the emulator again
+        """
+
+        self.X = np.vstack([self.X, X])
+        self.y = np.concatenate([self.y, np.asarray(y, dtype = float).ravel()])
+        self.surrogate = GPSurrogate(self.X, self.y, self.lower, self.upper,
+                                     num_processors = self.num_processors, seed = self.seed)
+        self.cv = self.surrogate.cross_validation()
+        self.history.append({'samples': len(self.y), 'q2': self.cv['q2'], 'rmse': self.cv['rmse']})
+
+
+    def converged(self):
+        return self.cv is not None and self.cv['q2'] >= self.target_q2
+
+
+    def next_batch(self):
+
+        """
+        Samples of the next batch, None once the design has converged or reached its maximum size
+        """
+
+        if self.converged() or len(self.y) >= self.max_size:
+            return None
+        candidates = lhs(self.problem, self.num_candidates, seed = self.seed + 1 + len(self.history))
+        return select_batch(self.surrogate, candidates, min(self.batch_size, self.max_size - len(self.y)),
+                            self.criterion)
@@ -13,6 +13,15 @@ os.environ["VECLIB_MAXIMUM_THREADS"] = "1"
 os.environ["NUMEXPR_NUM_THREADS"] = "1"
 
 import EppyUtility
+from SimulationCache import SimulationCache
+from SeriesReader import SQLiteReader
+from WorkerPool import WorkerPool
+from JobScheduler import JobScheduler
+from RunPeriod import RunPeriodSlicer
+from AdaptiveDesign import AdaptiveDesign
+from ResultsStore import ResultsStore
+from functools import partial
+import calendar
 
 def main():
     
@@ -52,10 +61,23 @@ def main():
     months = ["January", "February", "March", "April", "May", "June",
               "July", "August", "September", "October", "November", "December"]
     
+    # Adaptive design: each month starts with N samples, batches of batch_size samples being then added where the
+    # GP emulator of the month is the most uncertain until its leave-one-out Q2 reaches target_q2 (or max_size)
+    adaptive = False
+    batch_size = 8
+    target_q2 = 0.95
+    criterion = "variance"
+    
     # Sapmling method
-    method = input("LHS (1) or Sobol (0) sampling method: ")
+    method = input("LHS (1) or Sobol (0) sampling method: ") if not adaptive else None
     
-    if method != 0:
+    if adaptive:
+        
+        # Number of points of the initial design and maximum number of points of each month of each year
+        N = int(input("Size of the initial sample for each month of each year: "))
+        max_size = int(input("Maximum size of the sample for each month of each year: "))
+        
+    elif method != 0:
         
         # Number of points to simulate for each month of each year
         N = int(input("Size of the sample for each month of each year: "))
@@ -78,45 +100,165 @@ def main():
         X = sbl(problem, sample_size, seed)
         
     
-    # Save the sample X
-    X_df = pd.DataFrame(data = X, columns = problem["names"], index = [f"Y{i}M{j}S{k}" for  i in years for j in range(1, len(months)+1) for k in range(1, N+1)])
-    
-    with open(os.path.join(results_folder, 'Samples.csv'), "w") as csv_file:
-        X_df.to_csv(csv_file, index = True)
+    if not adaptive:
         
-    X = X.reshape((len(years), len(months), N, len(names)))
+        # Save the sample X
+        X_df = pd.DataFrame(data = X, columns = problem["names"], index = [f"Y{i}M{j}S{k}" for  i in years for j in range(1, len(months)+1) for k in range(1, N+1)])
+        
+        with open(os.path.join(results_folder, 'Samples.csv'), "w") as csv_file:
+            X_df.to_csv(csv_file, index = True)
+            
+        X = X.reshape((len(years), len(months), N, len(names)))
     
     # Number of processes to run simultaneously
     num_processors = 8
+    
+    # Cache of the E+ outputs, so that the samples already simulated in a previous campaign are skipped
+    cache = SimulationCache(os.path.join(results_folder, "Cache"))
+    
+    # Outputs read in the summary report ("html") or, without any html parsing, monthly electricity meter [J]
+    # read in the SQLite output of the runs ("sqlite"), whose hourly series can be requested the same way
+    backend = "html"
+    reader = SQLiteReader([("Electricity:Facility", "Monthly")])
+    
+    # Each sample of month j only simulates month j, after a lead-in of a few days for the thermal mass
+    slicing = True
+    lead_in = 7
+    
+    # Number of samples of each month of the first year run both over the whole year and sliced, to measure
+    # the accuracy lost by the slicing before the campaign (0 for no validation)
+    validation_size = 0
+    
+    # EnergyPlus executable launched directly on the rendered *.idf files
+    energyplus = EppyUtility.default_energyplus("9-4-0")
+    
+    # Samples and outputs of all the years and months in one columnar store, one campaign per year, the runs of a
+    # month being appended as soon as they are known
+    store = ResultsStore(os.path.join(results_folder, "Results.h5"))
+    for year in years:
+        store.start(f"SimulationData-{year}", names, ["Y"], overwrite = True, problem = problem, seed = seed,
+                    adaptive = adaptive, slicing = slicing, lead_in = lead_in, backend = backend)
+    
+    # Workers started once and shared by all the years and months of the campaign
+    pool = WorkerPool(num_processors).start()
+    
+    # All the samples of all the months of all the years in one queue, so that the workers never wait for the
+    # slowest runs of a month before starting the next one
+    scheduler = JobScheduler(pool)
+    
+    # Outputs of each year, filled month by month as the evaluations finish
+    Y = {year: np.full((N, len(months)), np.nan) for year in years}
+    
+    def month_output(Y_month, j):
+        
+        # Output of the month (the monthly meter of a sliced run ends with the month, after the lead-in days of
+        # the previous month)
+        return Y_month[:, -1 if slicing else j] if backend == "sqlite" else Y_month.ravel()
+    
+    def save_month(Y_month, year, j):
+        
+        # Store the month and save the outputs of the year known so far in a *.csv file
+        Y[year][:, j] = month_output(Y_month, j)
+        store.append(f"SimulationData-{year}", X[years.index(year), j], Y[year][:, j], month = j+1,
+                     sample = np.arange(1, N+1))
+        df = pd.DataFrame(Y[year], columns = months)
+        with open(os.path.join(results_folder, f"SimulationData-{year}.csv"), "w") as csv_file:
+            df.to_csv(csv_file, index = False)
+    
+    # Adaptive designs and evaluation settings of each (year, month)
+    designs = {}
+    evaluations = {}
+    
+    def save_design(year):
+        
+        # Save the samples and the outputs of all the months of the year simulated so far in a *.csv file
+        frames = [pd.DataFrame(designs[(i, j)].X, columns = names).assign(Month = months[j], Y = designs[(i, j)].y)
+                  for (i, j) in sorted(designs) if years[i] == year]
+        with open(os.path.join(results_folder, f"AdaptiveData-{year}.csv"), "w") as csv_file:
+            pd.concat(frames, ignore_index = True).to_csv(csv_file, index = False)
       
     for i in range(len(years)):
         
         # Files to use to run EnergyPlus
         epw_file = f"C:/Users/Cesi/Documents/CalibrationMediumOffice/Boulder/USA_CO_Denver-Intl-AP.725650_AMY_{years[i]}.epw"
         idf_file = f"C:/Users/Cesi/Documents//CalibrationMediumOffice/Boulder/Simulations/MediumOfficeIDFMonthly-{years[i]}-SelPar.idf"
-        eval_folder = os.path.join(results_folder, f"Evaluations{years[i]}")  
         
         # Instance of EplusPy class
-        Eplus = EppyUtility.EplusPy(idd_file, epw_file, idf_file)
-        
-        # Array that will contain the outputs
-        Y = np.zeros((N, len(months)))
+        Eplus = EppyUtility.EplusPy(idd_file, epw_file, idf_file, cache = cache, pool = pool, energyplus = energyplus)
         
         for j in range(len(months)):
+            
+            # Runs restricted to the month, the number of days simulated giving the expected duration of a run
+            if slicing:
+                run_period = RunPeriodSlicer(j+1, years[i], lead_in)
+                begin, end = run_period.period()
+                cost = (end - begin).days + 1
+            else:
+                run_period = None
+                cost = 366 if calendar.isleap(years[i]) else 365
+            Eplus_month = Eplus.sliced(run_period)
+            
+            # Folder of the evaluations of the month, the runs of all the months being mixed in the workers
+            eval_folder = os.path.join(results_folder, f"Evaluations{years[i]}", months[j])
+            os.makedirs(os.path.dirname(eval_folder), exist_ok = True)
+            
+            if backend == "sqlite":
+                outputs = reader
+            else:
+                # Monthly electricity consumption in our idf configuration: row of the month in the first monthly
+                # table of the summary report
+                outputs = [[("Custom Monthly Report", 0), months[j], 1]]
+            
+            if adaptive:
+                designs[(i, j)] = AdaptiveDesign(problem, N, batch_size, max_size, target_q2, criterion,
+                                                 num_processors = num_processors, seed = seed + 12*i + j)
+                evaluations[(i, j)] = (Eplus_month, eval_folder, outputs, cost)
+                continue
+            
+            if slicing and validation_size > 0 and i == 0:
+                report = Eplus.validate_run_period(names, X[i,j][:validation_size], eval_folder + "-validation",
+                                                   [[("Custom Monthly Report", 0), months[j], 1]], num_processors, run_period)
+                print("{} {}: relative error of the sliced runs up to {:.2%} (mean {:.2%}), {:.1f} times faster.".format(
+                      months[j], years[i], report['max_rel_error'].max(), report['mean_rel_error'].mean(), report['speedup']))
+            
+            scheduler.add(Eplus_month, names, X[i,j], eval_folder, outputs, cost = cost,
+                          on_done = partial(save_month, year = years[i], j = j))
+    
+    if adaptive:
         
-            # Run the model
-            Eplus.run_models(names, X[i,j], eval_folder, num_processors) 
+        # Batches of all the months run together, the emulators of the months being fitted between the batches
+        batches = {key: design.initial() for key, design in designs.items()}
+        while batches:
+            keys = list(batches)
+            for key in keys:
+                Eplus_month, eval_folder, outputs, cost = evaluations[key]
+                scheduler.add(Eplus_month, names, batches[key], eval_folder, outputs, cost = cost)
             
-            # Indice for monthly electricity consumption in our idf configuration
-            output_indice = np.array([[0, j+1, 1]])
+            for key, Y_batch in zip(keys, scheduler.run()):
+                y_batch = month_output(Y_batch, key[1])
+                designs[key].update(batches[key], y_batch)
+                store.append(f"SimulationData-{years[key[0]]}", batches[key], y_batch, month = key[1]+1,
+                             batch = len(designs[key].history))
+            for i in sorted({key[0] for key in keys}):
+                save_design(years[i])
             
-            # Get the output
-            Y[:, j] = Eplus.read_Eplus_results(N, eval_folder, output_indice, num_processors).ravel()
+            batches = {}
+            for key in keys:
+                design = designs[key]
+                print("{} {}: {} samples, leave-one-out Q2 {:.4f}.".format(months[key[1]], years[key[0]],
+                                                                          len(design.y), design.cv['q2']))
+                X_next = design.next_batch()
+                if X_next is not None:
+                    batches[key] = X_next
+        
+        print("{} simulations instead of {} for a fixed sample of the maximum size.".format(
+              sum(len(design.y) for design in designs.values()), max_size*len(designs)))
+    else:
+        # Run the whole campaign
+        scheduler.run()
     
-        # Save the results in a *.csv file
-        df = pd.DataFrame(Y, columns = months)
-        with open(os.path.join(results_folder, f"SimulationData-{years[i]}.csv"), "w") as csv_file:
-            df.to_csv(csv_file, index = False)   
+    pool.close()
+    pool.report()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,105 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from functools import partial
+from WorkerPool import WorkerPool
+
+
+# Number of information lines (LOCATION, DESIGN CONDITIONS, ..., DATA PERIODS) before the hourly data
+HEADER_LINES = 8
+
+# Fields of the calendar of each record: Year, Month, Day, Hour (1 to 24)
+CALENDAR_COLUMNS = [0, 1, 2, 3]
+
+
+def _cache_file(epw_file, columns, cache_folder):
+
+    # Binary file of the parsed columns of a version of the weather file (path, size, modification time)
+    stat = os.stat(epw_file)
+    key = "{}|{}|{}|{}".format(os.path.abspath(epw_file), stat.st_size, stat.st_mtime, list(columns))
+    return os.path.join(cache_folder, hashlib.sha256(key.encode()).hexdigest() + '.npy')
+
+
+def header_lines(epw_file):
+
+    """
+    Number of header lines of an *.epw file: HEADER_LINES when its first line is the LOCATION line, 0 for a file
+    whose header was removed by hand
+    """
+
+    with open(epw_file, 'r', errors = 'replace') as file:
+        return HEADER_LINES if file.readline().lstrip('\ufeff').startswith('LOCATION') else 0
+
+
+def _parse(epw_file, columns):
+
+    # Calendar and requested columns of the records, the header if any being skipped and the other fields not parsed
+    usecols = CALENDAR_COLUMNS + [c for c in columns if c not in CALENDAR_COLUMNS]
+    data = pd.read_csv(epw_file, header = None, skiprows = header_lines(epw_file), usecols = usecols,
+                       dtype = {c: np.float64 for c in usecols}, engine = 'c')
+    return data[CALENDAR_COLUMNS + list(columns)].to_numpy(dtype = np.float64)
+
+
+def read_epw(epw_file, columns, year = None, cache_folder = None):
+
+    """
+    Hourly data of an *.epw file, the 8 header lines being skipped when the file has them (see header_lines)
+    columns: indices of the fields read (e.g. 6 for the dry bulb temperature)
+    year: year of the calendar of the records (Year field of the first record by default)
+    cache_folder: folder of the parsed files, saved as binary arrays and then memory-mapped instead of parsed again
+    return: data frame of the columns, indexed by the timestamp of the beginning of each hour
+    """
+
+    columns = list(columns)
+    if cache_folder is None:
+        values = _parse(epw_file, columns)
+    else:
+        os.makedirs(cache_folder, exist_ok = True)
+        cache_file = _cache_file(epw_file, columns, cache_folder)
+        if not os.path.exists(cache_file):
+            # Written under another name and renamed, so that a concurrent reader never sees a partial file
+            tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+            with open(tmp_file, 'wb') as file:
+                np.save(file, _parse(epw_file, columns))
+            os.replace(tmp_file, cache_file)
+        values = np.load(cache_file, mmap_mode = 'r')
+
+    year = int(values[0, 0]) if year is None else year
+    days = pd.to_datetime(pd.DataFrame({'year': np.full(len(values), year), 'month': values[:, 1].astype(int),
+                                        'day': values[:, 2].astype(int)}))
+    index = pd.DatetimeIndex(days) + pd.to_timedelta(values[:, 3] - 1, unit = 'h')
+    return pd.DataFrame(values[:, len(CALENDAR_COLUMNS):], index = index.rename('time'), columns = columns)
+
+
+def aggregate(data, freq = 'M', statistics = ('mean',)):
+
+    """
+    Statistics of hourly data over the periods of the calendar
+    freq: 'D' (days), 'W' (weeks ending on Sunday) or 'M' (months)
+    return: data frame indexed by the periods, with one column per (field, statistic)
+    """
+
+    return data.groupby(data.index.to_period(freq)).agg(list(statistics))
+
+
+def _extract(epw_file, columns, frequencies, statistics, cache_folder):
+    data = read_epw(epw_file, columns, cache_folder = cache_folder)
+    return {freq: aggregate(data, freq, statistics) for freq in frequencies}
+
+
+def extract_years(epw_files, columns, frequencies = ('M',), statistics = ('mean',), cache_folder = None,
+                  num_processors = None, pool = None):
+
+    """
+    Statistics of several *.epw files (e.g. one per year) read in parallel
+    pool: shared WorkerPool (a pool of num_processors workers closed at the end by default)
+    return: list of dictionaries {frequency: statistics (see aggregate)}, in the order of the files
+    """
+
+    extract = partial(_extract, columns = list(columns), frequencies = list(frequencies),
+                      statistics = list(statistics), cache_folder = cache_folder)
+    if pool is not None:
+        return pool.map(extract, epw_files, chunksize = 1)
+    with WorkerPool(min(num_processors or os.cpu_count(), len(epw_files))) as workers:
+        return workers.map(extract, epw_files, chunksize = 1)
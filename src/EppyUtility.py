@@ -1,12 +1,326 @@
 import os
+import sys
+import copy
 import shutil
+import warnings
+import subprocess
 import numpy as np
-from eppy.results.readhtml import titletable
-from eppy.runner.run_functions import runIDFs
-from eppy.modeleditor import IDF
-from jinja2 import Environment, FileSystemLoader
+from uuid import uuid4
+from time import time, sleep, perf_counter
+from contextlib import nullcontext
+from eppy.runner.run_functions import run
+from jinja2 import Environment, FileSystemLoader, meta
 from functools import partial
-from multiprocessing import Pool
+from TableExtractor import TableExtractor, cell_specs
+from SeriesReader import SeriesReader
+from WorkerPool import WorkerPool
+from RunManifest import campaign_key
+from TemplateCompiler import CompiledTemplate
+from RunPeriod import compare_outputs
+
+
+def load_template(idf_template_file):
+    
+    """
+    Jinja2 template of an IDF template file
+    """
+    
+    environment = Environment(loader = FileSystemLoader(os.path.join(os.path.split(idf_template_file)[0], '')))
+    return environment.get_template(os.path.split(idf_template_file)[1])
+
+
+def compile_template(idf_template_file):
+    
+    """
+    Template of an IDF template file compiled into static segments and parameter slots, or Jinja2 template
+    when the file uses other Jinja2 constructs than {{ name }} slots
+    """
+    
+    try:
+        return CompiledTemplate.from_file(idf_template_file)
+    except ValueError:
+        return load_template(idf_template_file)
+
+
+def template_names(template):
+    
+    """
+    Names of the parameters used by a template (CompiledTemplate or Jinja2 template)
+    """
+    
+    if isinstance(template, CompiledTemplate):
+        return template.names
+    source = template.environment.loader.get_source(template.environment, template.name)[0]
+    return meta.find_undeclared_variables(template.environment.parse(source))
+
+
+def write_model(idf_file, template, params):
+    
+    """
+    Write the *.idf file of one sample, the segments of a compiled template being written without joining them
+    """
+    
+    with open(idf_file, mode = "w", encoding = "utf-8") as idf:
+        if isinstance(template, CompiledTemplate):
+            idf.writelines(template.parts(params))
+        else:
+            idf.write(template.render(params))
+    return idf_file
+
+
+def eplaunch_options(idf_file, ep_version):
+    
+    """
+    Make options for run, so that it runs like EPLaunch on Windows
+    """
+    
+    options = {'ep_version': ep_version, # run needs the version number
+               'output_prefix': os.path.basename(idf_file).split('.')[0],
+               'output_suffix': 'D',
+               'output_directory': os.path.dirname(idf_file),
+               'readvars': True,
+               'expandobjects': True}
+    
+    return options
+
+
+def default_energyplus(ep_version):
+    
+    """
+    Path of the EnergyPlus executable of the standard installation of a version (e.g. '9-4-0')
+    """
+    
+    if sys.platform.startswith('win'):
+        return f"C:/EnergyPlusV{ep_version}/energyplus.exe"
+    if sys.platform == 'darwin':
+        return f"/Applications/EnergyPlus-{ep_version}/energyplus"
+    return f"/usr/local/EnergyPlus-{ep_version}/energyplus"
+
+
+def launch_energyplus(idf_file, epw_file, options, energyplus):
+    
+    """
+    Run the EnergyPlus executable directly on an *.idf file with the options of eplaunch_options, without
+    going through eppy (ExpandObjects and ReadVarsESO being run by EnergyPlus itself when requested)
+    energyplus: path of the EnergyPlus executable (or of any executable with the same command line)
+    """
+    
+    output_directory = os.path.abspath(options['output_directory'] or '.')
+    command = [energyplus, '--weather', os.path.abspath(epw_file), '--output-directory', output_directory,
+               '--output-prefix', options['output_prefix'], '--output-suffix', options['output_suffix']]
+    if options.get('readvars'):
+        command.append('--readvars')
+    if options.get('expandobjects'):
+        command.append('--expandobjects')
+    command.append(os.path.abspath(idf_file))
+    
+    process = subprocess.run(command, cwd = output_directory, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError("EnergyPlus failed on {} (exit code {}), see its *.err file: {}".format(
+                           idf_file, process.returncode, process.stderr.decode(errors = 'replace').strip()[-1000:]))
+
+
+def read_summary_report(html_file, outputs_indices, extractor = None):
+    
+    """
+    read a html file and return the searched output(s) in the summary report
+    extractor: TableExtractor of the campaign, whose locator index is built on the first report read
+    """
+    
+    # Only the tables of the wanted output(s) are parsed, [table, row, column] in the summary report
+    if extractor is None:
+        extractor = TableExtractor(outputs_indices)
+    
+    return extractor.extract(html_file)
+
+
+def read_outputs(output_prefix, outputs, extractor = None):
+    
+    """
+    Output(s) of a run: cells [table, row, column] of its summary report, or series of a SeriesReader
+    output_prefix: path of the outputs of the run without extension (e.g. eval_folder/run-{i})
+    """
+    
+    if isinstance(outputs, SeriesReader):
+        return outputs.read(output_prefix)
+    return read_summary_report(output_prefix + '-table.htm', outputs, extractor)
+
+
+def _store(Y, i, Y_i, sample_size):
+    
+    # Array of the outputs, allocated at the first result since the length of the series is only known then
+    if Y is None:
+        Y = np.full((sample_size, np.shape(Y_i)[-1]), np.nan)
+    Y[i] = Y_i
+    return Y
+
+
+def _notify(on_result, Y, indices):
+    
+    # Outputs of the samples known at once (e.g. found in the cache) handed to the callback of the evaluation
+    if on_result is not None:
+        for i in indices:
+            on_result(i, Y[i])
+
+
+# Caches of a worker process, from the least to the most recently used entry, only the WORKER_CACHE_SIZE most
+# recently used entries being kept since a long-lived pool sees many campaigns: templates by *.idf template file,
+# configurations of the streaming evaluations by token (one per evaluation), set at their first sample
+_TEMPLATES = {}
+_PIPELINE = {}
+WORKER_CACHE_SIZE = 4
+
+
+def _recent(cache, key, make):
+    
+    """
+    Value of key in a cache of the worker process, made by make() when it is not there, moved to the most recently
+    used end of the cache, the least recently used entries being evicted beyond WORKER_CACHE_SIZE
+    """
+    
+    value = cache.pop(key, None)
+    if value is None:
+        value = make()
+        while len(cache) >= WORKER_CACHE_SIZE:
+            del cache[next(iter(cache))]
+    cache[key] = value
+    return value
+
+
+def _template(idf_template_file):
+    return _recent(_TEMPLATES, idf_template_file, partial(compile_template, idf_template_file))
+
+
+def _render_model(params, idf_template_file, reader = None, run_period = None):
+    
+    """
+    Render the content of the *.idf file of one sample (dictionary of parameters) inside a worker process
+    run_period: RunPeriodSlicer restricting the run to one month
+    """
+    
+    content = _template(idf_template_file).render(params)
+    if run_period is not None:
+        content = run_period.prepare(content)
+    return content if reader is None else reader.prepare(content)
+
+
+def _stage_model(task, idf_template_file, eval_folder, run_period = None):
+    
+    """
+    Render and write the *.idf file run-{i}.idf of one sample inside a worker process
+    task: index of the sample and its dictionary of parameters
+    """
+    
+    i, params = task
+    idf_file = os.path.join(eval_folder, f"run-{i}.idf")
+    if run_period is None:
+        return write_model(idf_file, _template(idf_template_file), params)
+    with open(idf_file, mode = "w", encoding = "utf-8") as idf:
+        idf.write(_render_model(params, idf_template_file, run_period = run_period))
+    return idf_file
+
+
+def _run_idf(idf_file, epw_file, ep_version, energyplus = None):
+    
+    """
+    Run one *.idf file inside a worker process, its outputs being written next to it
+    energyplus: EnergyPlus executable launched directly (run of eppy by default)
+    """
+    
+    if energyplus is None:
+        run(idf_file, epw_file, verbose = 'q', **eplaunch_options(idf_file, ep_version))
+    else:
+        launch_energyplus(idf_file, epw_file, eplaunch_options(idf_file, ep_version), energyplus)
+    return idf_file
+
+
+def _init_pipeline(config):
+    setup = dict(config)
+    setup['template'] = _template(config['idf_template_file'])
+    if not isinstance(config['outputs_indices'], SeriesReader):
+        setup['extractor'] = TableExtractor(config['outputs_indices'])
+    return setup
+
+
+def _pipeline_config(config):
+    
+    """
+    Configuration of an evaluation set up in the worker process at its first sample (see _recent)
+    """
+    
+    return _recent(_PIPELINE, config['token'], partial(_init_pipeline, config))
+
+
+def _pipeline_sample(task, config):
+    
+    """
+    Render, run and read one sample, then delete its scratch folder, all inside the worker process
+    task: index of the sample and either its rendered *.idf content or its dictionary of parameters
+    config: configuration of the evaluation, set up in the worker at its first sample of the evaluation
+    """
+    
+    i, payload = task
+    config = _pipeline_config(config)
+    
+    # Scratch folder of the sample, in the staging folder of the evaluation (e.g. on a tmpfs) if there is one
+    scratch_folder = os.path.join(config['staging_folder'] or config['eval_folder'], f"run-{i}")
+    os.makedirs(scratch_folder, exist_ok = True)
+    idf_file = os.path.join(scratch_folder, f"run-{i}.idf")
+    if isinstance(payload, str):
+        with open(idf_file, mode = "w", encoding = "utf-8") as idf:
+            idf.write(payload)
+    elif isinstance(config['outputs_indices'], SeriesReader) or config['run_period'] is not None:
+        reader = config['outputs_indices'] if isinstance(config['outputs_indices'], SeriesReader) else None
+        with open(idf_file, mode = "w", encoding = "utf-8") as idf:
+            idf.write(_render_model(payload, config['idf_template_file'], reader, config['run_period']))
+    else:
+        write_model(idf_file, config['template'], payload)
+    
+    # Running the simulation directly on the *.idf file and extracting the targeted output(s)
+    _run_idf(idf_file, config['epw_file'], config['ep_version'], config['energyplus'])
+    Y = read_outputs(os.path.join(scratch_folder, f"run-{i}"), config['outputs_indices'], config.get('extractor'))
+    
+    if not config['keep_outputs']:
+        shutil.rmtree(scratch_folder, ignore_errors = True)
+    elif config['staging_folder']:
+        shutil.move(scratch_folder, os.path.join(config['eval_folder'], f"run-{i}"))
+    
+    # Lengths of the series read in the worker, for the reader of the main process
+    lengths = getattr(config['outputs_indices'], 'lengths', None)
+    
+    return i, Y, lengths
+
+
+def _attempt_sample(task, config):
+    
+    """
+    Run one sample like _pipeline_sample, its failure being returned instead of raised so that the other samples go on
+    return: index of the sample, its output(s), lengths of the series, duration of the attempt and error (None if done)
+    """
+    
+    start = perf_counter()
+    try:
+        i, Y, lengths = _pipeline_sample(task, config)
+    except Exception as error:
+        return task[0], None, None, perf_counter() - start, repr(error)
+    return i, Y, lengths, perf_counter() - start, None
+
+
+def clear_staging(config):
+    
+    """
+    Remove the staging folder of a streaming evaluation once its samples are done, unless it keeps failed samples
+    """
+    
+    if config['staging_folder']:
+        try:
+            os.rmdir(config['staging_folder'])
+        except OSError:
+            pass
+
+
+def _read_series(output_prefix, reader):
+    return reader.read(output_prefix), reader.lengths
 
 
 class EplusPy:
@@ -14,12 +328,33 @@ class EplusPy:
     """
     Class Eppy in which methods are defined to run all the samples in E+ using eppy library
     """
-    def __init__(self, idd_file, epw_file, idf_template_file):
+    def __init__(self, idd_file, epw_file, idf_template_file, ep_version = '9-4-0', cache = None, pool = None, backend = None,
+                 energyplus = None, staging_folder = None, run_period = None):
             
         # Setting all the necessary paths to run the model
         self.idd_file = idd_file
         self.epw_file = epw_file  
         self.idf_template_file = idf_template_file
+        self.ep_version = ep_version
+        
+        # EnergyPlus executable launched directly on the rendered files (e.g. default_energyplus(ep_version)),
+        # eppy run being used when there is none
+        self.energyplus = energyplus
+        
+        # Optional SimulationCache used by evaluate to skip the simulations already done
+        self.cache = cache
+        
+        # Optional WorkerPool shared with the other evaluations of the campaign
+        self.pool = pool
+        
+        # Optional execution backend of run_models and evaluate (e.g. QueueBackend running the models on several nodes)
+        self.backend = backend
+        
+        # Optional folder of the scratch folders of the streaming evaluations (e.g. /dev/shm, a tmpfs in memory)
+        self.staging_folder = staging_folder
+        
+        # Optional RunPeriodSlicer restricting the runs to one month (see sliced)
+        self.run_period = run_period
         
         
     def make_eplaunch_options(self, idf):
@@ -27,14 +362,31 @@ class EplusPy:
         """
         Make options for run, so that it runs like EPLaunch on Windows
         """
-        options = {'ep_version': '9-4-0', # runIDFs needs the version number
-                   'output_prefix': os.path.basename(idf.idfname).split('.')[0],
-                   'output_suffix': 'D',
-                   'output_directory': os.path.dirname(idf.idfname),
-                   'readvars': True,
-                   'expandobjects': True}
+        return eplaunch_options(idf.idfname, self.ep_version)
+    
+    
+    def sliced(self, run_period):
+        
+        """
+        Copy of the instance (same files, cache and workers) whose runs are restricted by a RunPeriodSlicer,
+        None giving back the full runs
+        """
+        
+        eplus = copy.copy(self)
+        eplus.run_period = run_period
+        return eplus
+    
+    
+    def get_pool(self, num_processors):
         
-        return options
+        """
+        Context manager of the workers of a call: the shared WorkerPool, left running at the end of the call,
+        or a WorkerPool of num_processors workers closed at the end of the call
+        """
+        
+        if self.pool is not None:
+            return nullcontext(self.pool)
+        return WorkerPool(num_processors)
 
 
     def get_idd_file(self):
@@ -49,96 +401,400 @@ class EplusPy:
         return self.idf_template_file
         
     
+    def get_template(self):
+        
+        """
+        Template of the IDF template file, compiled once per process (see compile_template)
+        """
+        
+        return _template(self.get_idf_template_file())
+    
+    
+    def check_parameters(self, param_names):
+        
+        """
+        Check that every parameter appears in the IDF template, a misspelled parameter being otherwise never varied
+        """
+        
+        missing = [name for name in param_names if name not in template_names(self.get_template())]
+        if missing:
+            raise ValueError("The parameter(s) {} do not appear in the template {}".format(missing, self.get_idf_template_file()))
+    
+    
+    def render_models(self, param_names, X, reader = None, pool = None):
+        
+        """
+        Render the content of the *.idf file of each point of the sample X
+        reader: SeriesReader whose output objects are added to the *.idf files
+        pool: WorkerPool in which the models are rendered (in the main process by default)
+        """
+        
+        self.check_parameters(param_names)
+        
+        # Creation of a dictionary with the values to update in the *.idf files for each sample
+        params = [dict(zip(param_names, values)) for values in X]
+        render = partial(_render_model, idf_template_file = self.get_idf_template_file(), reader = reader,
+                         run_period = self.run_period)
+        if pool is None:
+            return [render(values) for values in params]
+        return pool.map(render, params)
+    
+    
+    def stage_models(self, param_names, X, eval_folder, pool = None):
+        
+        """
+        Render and write the *.idf files run-{i}.idf of all the points of the sample X in the workers, by chunks,
+        so that the rendered contents are never sent back to the main process
+        pool: WorkerPool in which the models are rendered and written (in the main process by default)
+        """
+        
+        self.check_parameters(param_names)
+        tasks = [(i, dict(zip(param_names, values))) for i, values in enumerate(X)]
+        stage = partial(_stage_model, idf_template_file = self.get_idf_template_file(), eval_folder = eval_folder,
+                        run_period = self.run_period)
+        if pool is None:
+            return [stage(task) for task in tasks]
+        return pool.map(stage, tasks)
+    
+    
+    def write_models(self, contents, eval_folder, indices = None):
+        
+        """
+        Write the rendered *.idf files run-{i}.idf for the samples i in indices (all the samples by default)
+        """
+        
+        idfs_list = []
+        indices = range(len(contents)) if indices is None else indices
+        for i in indices:
+            idf_file = os.path.join(eval_folder, f"run-{i}.idf")
+            with open(idf_file, mode = "w", encoding = "utf-8") as idf:
+                idf.write(contents[i])
+            idfs_list.append(idf_file)
+        return idfs_list
+    
+    
+    def run_idfs(self, idfs_list, num_processors, pool = None):
+        
+        """
+        Launch the simulations of the *.idf files once they have all been created, one file per task since
+        the simulations are long, each one writing its outputs next to its *.idf file
+        pool: WorkerPool running the simulations (the shared pool or a pool of num_processors workers by default)
+        """
+        
+        run_idf = partial(_run_idf, epw_file = self.get_epw_file(), ep_version = self.ep_version, energyplus = self.energyplus)
+        with (nullcontext(pool) if pool is not None else self.get_pool(num_processors)) as pool:
+            pool.map(run_idf, idfs_list, chunksize = 1)
+    
+    
+    def reset_folder(self, eval_folder):
+        
+        """
+        Delete the outputs folder if it already exists and create a new one at the same path
+        """
+        
+        if os.path.exists(eval_folder) == True:
+            shutil.rmtree(eval_folder, ignore_errors = False)
+        os.mkdir(eval_folder)
+        
+    
     def run_models(self, param_names, X, eval_folder, num_processors):
         
         """ 
         Run energyPlus models at each point of the sample X
         params_names: names of the parameters
         eval_folder: path to the folder that wil contain the model evaluations
-        num_processors: number of processors
+        num_processors: number of processors (local runs, the backend of the instance running the models otherwise)
         """
 
-        idfs_list = []
+        self.reset_folder(eval_folder)
+        if self.backend is not None:
+            self.backend.run_models(self, param_names, X, eval_folder)
+            return
+        with self.get_pool(num_processors) as pool:
+            idfs_list = self.stage_models(param_names, X, eval_folder, pool)
+            self.run_idfs(idfs_list, num_processors, pool)
         
-        # The following commands allow us to delete the outputs folder if it already exists and to create a new one at the same path
-        if os.path.exists(eval_folder) == True:
-            shutil.rmtree(eval_folder, ignore_errors = False)
-        os.mkdir(eval_folder)
-
-        # Setting idd files path in IDF class
-        IDF.setiddname(self.get_idd_file())        
-   
-        # IDF template file
-        idf_template_file = self.get_idf_template_file()
-        environment = Environment(loader = FileSystemLoader(os.path.join(os.path.split(idf_template_file)[0], '')))
-        template = environment.get_template(os.path.split(idf_template_file)[1])
+    
+    def evaluate(self, param_names, X, eval_folder, outputs_indices, num_processors, streaming = False, keep_outputs = False,
+                 manifest = None, on_result = None):
+        
+        """
+        Run energyPlus models at each point of the sample X and return their output(s) (one row per sample),
+        the samples whose output(s) are already in the cache being neither simulated nor read again
+        outputs_indices: cells [table, row, column] of the output(s) in the summary report (table given by its title,
+                         see TableExtractor), or SeriesReader of
+                         the meters and output variables to read (series of each sample concatenated in its row)
+        streaming: render, run, read and delete each sample inside one worker (see evaluate_streaming)
+        manifest: RunManifest of the campaign, which is then resumable (see evaluate_resumable)
+        on_result: function called in the main process with the index and the output(s) of each sample as soon as
+                   they are known (found in the cache or the manifest, or read after the run)
+        With a backend (e.g. QueueBackend), the models rendered here are run by the backend and their outputs read
+        in the workers of the instance, streaming being then ignored and manifest not supported
+        """
+        
+        reader = outputs_indices if isinstance(outputs_indices, SeriesReader) else None
+        if reader is None:
+            outputs_indices = cell_specs(outputs_indices)
+        if manifest is not None:
+            if self.backend is not None:
+                raise ValueError("A resumable evaluation runs in the local workers, it cannot be run by a backend")
+            return self.evaluate_resumable(param_names, X, eval_folder, outputs_indices, num_processors, manifest,
+                                           keep_outputs = keep_outputs, on_result = on_result)
+        if streaming and self.backend is None:
+            return self.evaluate_streaming(param_names, X, eval_folder, outputs_indices, num_processors, keep_outputs,
+                                           on_result)
         
-        for i, values in enumerate(X):
+        # The rendering, the simulations (unless a backend runs them) and the reading of the results share the same workers
+        with self.get_pool(num_processors) as pool:
+            contents = self.render_models(param_names, X, reader, pool)
+            Y = None
             
-            # Creation of a dictionary with the values to update in the *.idf files             
-            param_dict = dict(zip(param_names, values))
-
-            # Updating the parameters in the *.idf files
-            filename = f"run-{i}.idf"
-            idf_file = os.path.join(eval_folder, filename)
-            content = template.render(param_dict)
+            # Outputs of the samples already simulated with the same IDF content, weather file, version and outputs
+            missing = list(range(len(X)))
+            if self.cache is not None:
+                keys = [self.cache.key(content, self.get_epw_file(), self.ep_version, outputs_indices,
+                                       self.energyplus) for content in contents]
+                missing = []
+                for i, key in enumerate(keys):
+                    cached = self.cache.get(key)
+                    if cached is None:
+                        missing.append(i)
+                    else:
+                        Y = _store(Y, i, cached, len(X))
+            _notify(on_result, Y, sorted(set(range(len(X))) - set(missing)))
+            
+            self.reset_folder(eval_folder)
+            if missing:
+                if self.backend is not None:
+                    self.backend.run_contents(self, contents, eval_folder, missing)
+                else:
+                    idfs_list = self.write_models(contents, eval_folder, missing)
+                    self.run_idfs(idfs_list, num_processors, pool)
+                Y_missing = self.read_Eplus_results(len(X), eval_folder, outputs_indices, num_processors,
+                                                    indices = missing, pool = pool)
+                Y = _store(Y, missing, Y_missing, len(X))
+                _notify(on_result, Y, missing)
                 
-            with open(idf_file, mode = "w", encoding = "utf-8") as idf:
-                idf.write(content)
-  
-            idfs_list.append(idf_file)
-
-        # Generator for generating idf objects of the class IDF
-        idf_objects = (IDF(idf, self.get_epw_file()) for idf in idfs_list)
-        runs = ((idf, self.make_eplaunch_options(idf)) for idf in idf_objects)
-
-        #  Launching the simulations once all the *.idf files for each sample have been already created
-        #  runIDFs needs the version number while idf.run does not need the second argument (options here)
-        runIDFs(runs, num_processors)
-
-    def read_html_tables(self, html_file, outputs_indices):
+                if self.cache is not None:
+                    for i in missing:
+                        self.cache.put(keys[i], Y[i])
+        
+        return Y
+    
+    
+    def streaming_jobs(self, param_names, X, eval_folder, outputs_indices, keep_outputs = False):
         
         """
-        read a html file and return the searched output(s) in the summary report
+        Jobs of a streaming evaluation, to be run by _pipeline_sample(task, config) in the workers
+        return: the configuration of the evaluation, the tasks (index, parameters or rendered *.idf content) of the
+                samples to simulate, the outputs of the samples found in the cache (None if no sample was found)
+                and the cache keys of the samples (None without cache)
+        """
+        
+        reader = outputs_indices if isinstance(outputs_indices, SeriesReader) else None
+        if reader is None:
+            outputs_indices = cell_specs(outputs_indices)
+        Y = None
+        keys = None
+        
+        # Without cache, the samples are rendered in the workers from their parameters
+        if self.cache is None:
+            self.check_parameters(param_names)
+            tasks = [(i, dict(zip(param_names, values))) for i, values in enumerate(X)]
+        else:
+            contents = self.render_models(param_names, X, reader, self.pool)
+            keys = [self.cache.key(content, self.get_epw_file(), self.ep_version, outputs_indices,
+                                   self.energyplus) for content in contents]
+            tasks = []
+            for i, key in enumerate(keys):
+                cached = self.cache.get(key)
+                if cached is None:
+                    tasks.append((i, contents[i]))
+                else:
+                    Y = _store(Y, i, cached, len(X))
+        
+        # The token identifies the evaluation so that each worker sets up its configuration once
+        token = uuid4().hex
+        staging_folder = os.path.join(self.staging_folder, token) if self.staging_folder else None
+        config = {'idf_template_file': self.get_idf_template_file(), 'epw_file': self.get_epw_file(),
+                  'ep_version': self.ep_version, 'energyplus': self.energyplus, 'eval_folder': eval_folder,
+                  'staging_folder': staging_folder, 'outputs_indices': outputs_indices, 'keep_outputs': keep_outputs,
+                  'run_period': self.run_period, 'token': token}
+        
+        return config, tasks, Y, keys
+    
+    
+    def evaluate_streaming(self, param_names, X, eval_folder, outputs_indices, num_processors, keep_outputs = False,
+                           on_result = None):
+        
+        """
+        Streaming version of evaluate: each sample is rendered, run, has its output(s) extracted and its scratch
+        folder deleted inside one worker, so that the disk usage stays proportional to the number of processors
+        and the reading of the results overlaps with the simulations. The outputs are stored in a preallocated
+        array as the runs finish.
+        keep_outputs: keep the scratch folder run-{i} of each sample
+        on_result: function called with the index and the output(s) of each sample as soon as they are known
+        """
+        
+        reader = outputs_indices if isinstance(outputs_indices, SeriesReader) else None
+        config, tasks, Y, keys = self.streaming_jobs(param_names, X, eval_folder, outputs_indices, keep_outputs)
+        _notify(on_result, Y, sorted(set(range(len(X))) - {task[0] for task in tasks}))
+        
+        self.reset_folder(eval_folder)
+        if not tasks:
+            return Y
+        
+        with self.get_pool(num_processors) as pool:
+            for i, Y_i, lengths in pool.imap(partial(_pipeline_sample, config = config), tasks, chunksize = 1):
+                Y = _store(Y, i, Y_i, len(X))
+                if reader is not None:
+                    reader.lengths = lengths
+                if self.cache is not None:
+                    self.cache.put(keys[i], Y_i)
+                if on_result is not None:
+                    on_result(i, Y_i)
+        
+        clear_staging(config)
+        return Y
+    
+    
+    def evaluate_resumable(self, param_names, X, eval_folder, outputs_indices, num_processors, manifest, retries = 2,
+                           backoff = 5.0, keep_outputs = False, on_result = None):
+        
+        """
+        Resumable version of evaluate_streaming: the status, output(s) and duration of each sample are recorded in
+        the manifest as the runs finish and the evaluation folder is never deleted, so that a campaign stopped by a
+        crash or a reboot is resumed by calling it again, only its missing and failed samples being run
+        manifest: RunManifest of the campaign
+        retries: number of retries of the failed samples, the scratch folder of a failed sample being kept
+        backoff: waiting time in seconds before the first retry, doubled at each retry (5 and 10 seconds by default)
+        Each retry is reported by a warning with the errors of the failed samples
+        on_result: function called with the index and the output(s) of each sample as soon as they are known
         """
         
-        # Get the number of output(s) to read in the file
-        outputs_number = outputs_indices.shape[0]
+        reader = outputs_indices if isinstance(outputs_indices, SeriesReader) else None
+        manifest.start(campaign_key(param_names, X, self.get_idf_template_file(), self.get_epw_file(), self.ep_version,
+                                    outputs_indices))
+        config, tasks, Y, keys = self.streaming_jobs(param_names, X, eval_folder, outputs_indices, keep_outputs)
         
-        # Open the file in reading mode
-        html_read = open(html_file, 'r').read()
+        # Samples done in a previous run of the campaign
+        done = manifest.done()
+        for i, Y_i in done.items():
+            Y = _store(Y, i, Y_i, len(X))
+        if reader is not None and done:
+            reader.lengths = manifest.lengths()
         
-        # Define the wanted output(s)
-        Y = np.zeros(outputs_number)
+        # Samples found in the cache, recorded so that the partial results of the campaign are complete
+        pending = {i for i, payload in tasks}
+        for i in range(len(X)):
+            if i not in pending and i not in done:
+                manifest.record(i, 'done', Y[i], duration = 0.0, lengths = getattr(reader, 'lengths', None))
         
-        # Get the tables of the html file
-        tables = titletable(html_read)
+        tasks = [task for task in tasks if task[0] not in done]
+        _notify(on_result, Y, sorted(set(range(len(X))) - {task[0] for task in tasks}))
+        os.makedirs(eval_folder, exist_ok = True)
         
-        # Get the output(s) from the html file
-        for i in range(outputs_number):
-            Y[i] = tables[int(outputs_indices[i,0])][1][int(outputs_indices[i,1])][int(outputs_indices[i,2])]
+        with self.get_pool(num_processors) as pool:
+            for attempt in range(retries + 1):
+                if not tasks:
+                    break
+                if attempt > 0:
+                    errors = {task[0]: manifest.records[task[0]].get('error') for task in tasks}
+                    warnings.warn("Retrying {} failed simulation(s) in {} seconds (attempt {} of {}): {}".format(
+                                  len(tasks), backoff*2**(attempt - 1), attempt + 1, retries + 1, errors))
+                    sleep(backoff*2**(attempt - 1))
+                
+                failed = set()
+                for i, Y_i, lengths, duration, error in pool.imap(partial(_attempt_sample, config = config), tasks, chunksize = 1):
+                    if error is not None:
+                        manifest.record(i, 'failed', duration = duration, error = error)
+                        failed.add(i)
+                        continue
+                    Y = _store(Y, i, Y_i, len(X))
+                    if reader is not None:
+                        reader.lengths = lengths
+                    if self.cache is not None:
+                        self.cache.put(keys[i], Y_i)
+                    manifest.record(i, 'done', Y_i, duration = duration, lengths = lengths)
+                    if on_result is not None:
+                        on_result(i, Y_i)
+                tasks = [task for task in tasks if task[0] in failed]
         
+        clear_staging(config)
+        if tasks:
+            raise RuntimeError("{} simulation(s) failed after {} attempts, see the manifest {}: samples {}".format(
+                               len(tasks), retries + 1, manifest.manifest_file, [task[0] for task in tasks]))
         return Y
     
-    def read_Eplus_results(self, sample_size, eval_folder, outputs_indices, num_processors):
+
+    def validate_run_period(self, param_names, X, eval_folder, outputs_indices, num_processors, run_period):
         
         """
-        Profiting the parallel processing through Pool to read all the html summary reports
-        first filling out a list of all the html files and then share it by pool between processors
+        Validation of a RunPeriodSlicer: the samples X are run over the whole year and over the sliced period,
+        without cache, and the output(s) of both runs are compared (see compare_outputs)
+        outputs_indices: output(s) of the month, the same in both runs (e.g. its cell of a monthly summary table)
+        return: dictionary of the errors of the sliced runs and of their speedup, with the outputs of both runs
         """
         
+        os.makedirs(eval_folder, exist_ok = True)
+        report = {}
+        durations = {}
+        for name, eplus in (('full', self.sliced(None)), ('sliced', self.sliced(run_period))):
+            eplus.cache = None
+            start_time = time()
+            report['Y_' + name] = eplus.evaluate(param_names, X, os.path.join(eval_folder, name), outputs_indices,
+                                                 num_processors, streaming = True)
+            durations[name] = time() - start_time
+        
+        report.update(compare_outputs(report['Y_full'], report['Y_sliced'], durations['full'], durations['sliced']))
+        return report
+    
+    
+    def read_html_tables(self, html_file, outputs_indices, extractor = None):
+        
+        """
+        read a html file and return the searched output(s) in the summary report
+        extractor: TableExtractor of the campaign, to keep its locator index from one report to the next
+        """
+        
+        return read_summary_report(html_file, outputs_indices, extractor)
+    
+    def read_Eplus_results(self, sample_size, eval_folder, outputs_indices, num_processors, indices = None, pool = None):
+        
+        """
+        Profiting the parallel processing through a WorkerPool to read all the html summary reports
+        first filling out a list of all the html files and then share it by chunks between processors
+        indices: samples whose summary reports are read (all the sample_size samples by default)
+        pool: WorkerPool reading the results (the shared pool or a pool of num_processors workers by default)
+        """
+        
+        pool = nullcontext(pool) if pool is not None else self.get_pool(num_processors)
+        
+        # Series of the runs read by a SeriesReader, the lengths of the series being sent back to the main process
+        if isinstance(outputs_indices, SeriesReader):
+            prefixes = [os.path.join(eval_folder, 'run-{}'.format(i)) for i in (range(sample_size) if indices is None else indices)]
+            with pool as workers:
+                results = workers.map(partial(_read_series, reader = outputs_indices), prefixes)
+            if results:
+                outputs_indices.lengths = results[0][1]
+            return np.array([Y_i for Y_i, lengths in results])
+        
         # Get the list of all summary report files
         master_list = []
-        for i in range(sample_size):
+        for i in (range(sample_size) if indices is None else indices):
             master_list.append(os.path.join(eval_folder, 'run-{}-table.htm'.format(i)))
         
-        # Initializing the parallelization
-        pool = Pool(processes = num_processors)
+        # Locator index of the tables built once on the first summary report and shared by all the processes
+        extractor = TableExtractor(outputs_indices)
+        if master_list:
+            with open(master_list[0], 'r', errors = 'replace') as html:
+                extractor.build_index(html)
         
-        # Define a partial function on which apply the parallelization
-        read_html = partial(self.read_html_tables, outputs_indices = outputs_indices)
+        # Define a partial of a module-level function on which apply the parallelization
+        read_html = partial(read_summary_report, outputs_indices = outputs_indices, extractor = extractor)
         
         # Store the wanted output(s) after parallelization 
-        Y = np.array(pool.map(read_html, master_list))
+        with pool as workers:
+            Y = np.array(workers.map(read_html, master_list))
         
         return Y
\ No newline at end of file
@@ -7,9 +7,8 @@ Created on Mon Jun 17 10:33:48 2024
 
 def main():
     
-    import pandas as pd
-    import numpy as np
     import os
+    from EPWReader import extract_years
     
     # Folder with the final results
     results_folder = "C:/Users/Cesi/Documents/CalibrationMediumOffice/Boulder/Observations"
@@ -28,36 +27,29 @@ def main():
     col_indices = input("Column indices of the wanted data columns: ").split()
     col_indices = list(map(int, col_indices))
     
-    # Extract and save wanted data for each selected year
+    # Statistics of the hourly data saved for each year besides the monthly averages, by day, week and month
+    frequencies = {"D": "Daily", "W": "Weekly", "M": "Monthly"}
+    statistics = ["mean", "min", "max"]
+    
+    # Parsed columns of the *.epw files, memory-mapped when the same files are extracted again
+    cache_folder = os.path.join(results_folder, "EPWCache")
+    
+    # The 8 header lines of the *.epw files are skipped when they are there (files stripped by hand being read as they
+    # are), the years being read in parallel
+    epw_files = [f"C:/Users/Cesi/Documents/CalibrationMediumOffice/Boulder/Observations/EPW_{year}.epw" for year in years]
+    results = extract_years(epw_files, col_indices, list(frequencies), statistics, cache_folder = cache_folder)
+    
+    # Save wanted data for each selected year
     for i in range(len(years)):
         
-        # The first 8 lines of the *.epw file are information, not data
-        # They need to be removed before execution
-        epw_file = f"C:/Users/Cesi/Documents/CalibrationMediumOffice/Boulder/Observations/EPW_{years[i]}.epw"
-        df_epw = pd.read_csv(epw_file, header = None)
-        
-        # Extract wanted data
-        data = df_epw.iloc[:,col_indices]
-        
-        # Days number for each month
-        days = [31,28,31,30,31,30,31,31,30,31,30,31]
-            
-        # Check if it is a leap year to possibly change the number of days for february
-        if years[i]%4 == 0 and years[i]%4000 != 0 or years[i]%400 == 0:
-            days[1] = 29
-            
-        # Cumulative sum of all days multiplied by 24 to get all hours
-        days.insert(0, 0)
-        cs_days = np.cumsum(days)*24
-            
-        avg_data = np.zeros((months[i], len(col_indices)))
-        for j in range(months[i]):
-            avg_data[j,:] = data.iloc[cs_days[j]:cs_days[j+1],:].mean()
-        avg_data = pd.DataFrame(avg_data)
-        
-        # Save wanted data
+        # Averages of the first months of the year, the calendar of the year giving the length of February
+        avg_data = results[i]["M"].xs("mean", axis = 1, level = 1).iloc[:months[i]]
         with open(os.path.join(results_folder, f"ObservedDataAvg-{years[i]}.csv"), "w") as file:
             avg_data.to_csv(file, index = False, header = False)
+        
+        for freq, name in frequencies.items():
+            with open(os.path.join(results_folder, f"ObservedData{name}-{years[i]}.csv"), "w") as file:
+                results[i][freq].to_csv(file, index = True)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,108 @@
+import numpy as np
+from EppyUtility import _pipeline_sample, _store, clear_staging
+from SeriesReader import SeriesReader
+
+
+def _run_job(job):
+
+    # Run one sample of one evaluation in a worker, its result being tagged with the index of the evaluation
+    e, task, config = job
+    return (e,) + _pipeline_sample(task, config)
+
+
+class JobScheduler:
+
+    """
+    Scheduler of the samples of several evaluations (e.g. all the months of all the years of a campaign, each with
+    its own *.epw and *.idf files) flattened into a single queue of jobs run by a shared WorkerPool, so that no
+    evaluation waits for the slowest runs of the previous one. The jobs are dispatched one at a time, longest
+    expected first, and the outputs of an evaluation are handed to its callback as soon as its last sample is done.
+    """
+
+    def __init__(self, pool):
+
+        """
+        pool: WorkerPool running the jobs of all the evaluations
+        """
+
+        self.pool = pool
+        self.evaluations = []
+
+
+    def add(self, eplus, param_names, X, eval_folder, outputs_indices, cost = 1.0, on_done = None, keep_outputs = False):
+
+        """
+        Queue the samples X of an evaluation of eplus (EplusPy), the samples found in its cache not being simulated
+        eval_folder: folder of the scratch folders of the samples, proper to the evaluation
+        cost: expected duration of the simulations (one value for all the samples or one value per sample)
+        on_done: function called with the outputs of the evaluation (one row per sample) once they are all known
+        return: index of the evaluation in the outputs of run
+        """
+
+        config, tasks, Y, keys = eplus.streaming_jobs(param_names, X, eval_folder, outputs_indices, keep_outputs)
+        eplus.reset_folder(eval_folder)
+
+        self.evaluations.append({'eplus': eplus, 'config': config, 'tasks': tasks, 'Y': Y, 'keys': keys,
+                                 'sample_size': len(X), 'remaining': len(tasks),
+                                 'cost': np.broadcast_to(np.asarray(cost, dtype = float), (len(X),)),
+                                 'on_done': on_done})
+        return len(self.evaluations) - 1
+
+
+    def jobs(self):
+
+        """
+        Jobs (evaluation, task, configuration) of all the queued evaluations, sorted by decreasing expected duration
+        so that the longest simulations do not end up alone on the workers at the end of the campaign
+        """
+
+        jobs = []
+        costs = []
+        for e, evaluation in enumerate(self.evaluations):
+            for task in evaluation['tasks']:
+                jobs.append((e, task, evaluation['config']))
+                costs.append(evaluation['cost'][task[0]])
+
+        # Stable sort: the jobs of equal cost keep the order in which they were queued
+        order = np.argsort(-np.asarray(costs), kind = 'stable')
+        return [jobs[k] for k in order]
+
+
+    def _done(self, evaluation):
+        clear_staging(evaluation['config'])
+        if evaluation['on_done'] is not None:
+            evaluation['on_done'](evaluation['Y'])
+
+
+    def run(self):
+
+        """
+        Run the jobs of all the queued evaluations, the workers pulling a new job as soon as they finish one,
+        and return the outputs of the evaluations in the order in which they were added
+        """
+
+        # Evaluations entirely found in the cache
+        for evaluation in self.evaluations:
+            if evaluation['remaining'] == 0:
+                self._done(evaluation)
+
+        for e, i, Y_i, lengths in self.pool.imap(_run_job, self.jobs(), chunksize = 1):
+            evaluation = self.evaluations[e]
+            evaluation['Y'] = _store(evaluation['Y'], i, Y_i, evaluation['sample_size'])
+
+            # Lengths of the series read in the worker, for the reader of the main process
+            reader = evaluation['config']['outputs_indices']
+            if isinstance(reader, SeriesReader):
+                reader.lengths = lengths
+
+            cache = evaluation['eplus'].cache
+            if cache is not None:
+                cache.put(evaluation['keys'][i], Y_i)
+
+            evaluation['remaining'] -= 1
+            if evaluation['remaining'] == 0:
+                self._done(evaluation)
+
+        results = [evaluation['Y'] for evaluation in self.evaluations]
+        self.evaluations = []
+        return results
@@ -5,214 +5,1170 @@ Created on Mon Jun  3 14:38:22 2024
 @author: Cesi
 """
 
+import os
+import copy
+import shutil
+import tempfile
+import warnings
 import numpy as np
 import scipy as sp
+from multiprocessing import Pool, shared_memory
 
-def cov_exp(beta, l, x1, x2 = None):
-    if x2 is None:
-        x2 = np.copy(x1)
+def cov_exp(beta, l, x1, x2 = None, block_size = 2048, dtype = np.float64):
+    
+    # Matrice de covariance exponentielle carrée exp(-sum_k beta_k*(x1_k-x2_k)^2)/l
+    # construite par blocs de lignes à partir des distances pondérées (produit matriciel BLAS)
+    symmetric = x2 is None
+    x1 = np.asarray(x1, dtype = dtype)
+    x2 = x1 if symmetric else np.asarray(x2, dtype = dtype)
     n1, p = x1.shape
     n2 = len(x2)
-    cov = np.zeros((n1, n2))
-    for i in range(n1):
-        for j in range(n2):
-            cov[i,j] = np.exp(-np.dot(beta, (x1[i]-x2[j])**2))/l
+    beta = np.broadcast_to(np.asarray(beta, dtype = dtype), (p,))
+    
+    # Normes pondérées des points de x2 et points de x2 pondérés par beta
+    x2_beta = x2*beta
+    norm2 = np.einsum("ij,ij->i", x2_beta, x2)
+    
+    cov = np.empty((n1, n2), dtype = dtype)
+    for start in range(0, n1, block_size):
+        stop = min(start+block_size, n1)
+        x1_block = x1[start:stop]
+        norm1 = np.einsum("ij,ij->i", x1_block*beta, x1_block)
+        
+        # sum_k beta_k*(a_k-b_k)^2 = |a|_beta^2 + |b|_beta^2 - 2 <a, b>_beta
+        dist = np.dot(x1_block, x2_beta.T)
+        dist *= -2
+        dist += norm1[:, None]
+        dist += norm2[None, :]
+        np.maximum(dist, 0, out = dist)
+        
+        # Distance nulle exacte sur la diagonale de la matrice de covariance de x1
+        if symmetric:
+            idx = np.arange(start, stop)
+            dist[idx-start, idx] = 0
+            
+        np.exp(-dist, out = dist)
+        dist /= l
+        cov[start:stop] = dist
     return cov
 
-def y_pred(posterior, x_star, xf, xc, tc, z):
+class DistanceCache:
     
-    n = len(xf)
-    n_star = len(x_star)
+    """
+    Distances carrées par dimension du modèle de Kennedy & O'Hagan qui ne dépendent pas du tirage à posteriori :
+    colonnes x de (xf, xc) entre elles et avec x_star, colonnes tc des simulations entre elles.
+    Seules les colonnes faisant intervenir tf sont recalculées pour chaque tirage.
+    max_memory: taille (octets) au-delà de laquelle les tenseurs sont stockés dans des fichiers np.memmap de mmap_dir
+    """
     
-    # Variables de calibration à posteriori
-    tf = np.tile(posterior["tf"], (n, 1))
-    tf_star = np.tile(posterior["tf"], (n_star, 1))
-
-    beta_eta = posterior["beta_eta"]
-    beta_delta = posterior["beta_delta"]
-    lambda_eta = posterior["lambda_eta"]
-    lambda_delta = posterior["lambda_delta"]
-    lambda_eps = posterior["lambda_eps"]
+    def __init__(self, xf, xc, tc, x_star = None, max_memory = None, mmap_dir = None, dtype = np.float64):
+        
+        self.xf = np.asarray(xf, dtype = float)
+        self.xc = np.asarray(xc, dtype = float)
+        self.tc = np.asarray(tc, dtype = float)
+        self.x_star = None if x_star is None else np.asarray(x_star, dtype = float)
+        self.n = len(self.xf)
+        self.m = len(self.xc)
+        self.p = self.xf.shape[1]
+        self.q = self.tc.shape[1]
+        self.dtype = np.dtype(dtype)
+        
+        # Stockage en mémoire ou dans des fichiers projetés en mémoire selon la taille totale
+        self.max_memory = max_memory
+        self.use_mmap = max_memory is not None and self.required_memory() > max_memory
+        self.mmap_dir = None
+        self._own_dir = False
+        if self.use_mmap:
+            self._own_dir = mmap_dir is None
+            self.mmap_dir = tempfile.mkdtemp(prefix = "koh-distances-") if mmap_dir is None else mmap_dir
+            os.makedirs(self.mmap_dir, exist_ok = True)
+            
+        x = np.concatenate((self.xf, self.xc))
+        self.blocks = {}
+        self.blocks["train_x"] = self._squared_differences("train_x", x, x)
+        self.blocks["train_t"] = self._squared_differences("train_t", self.tc, self.tc)
+        if self.x_star is not None:
+            self.blocks["star_x"] = self._squared_differences("star_x", x, self.x_star)
+            self.blocks["star_star_x"] = self._squared_differences("star_star_x", self.x_star, self.x_star)
+            
+    def _shapes(self):
+        N = self.n+self.m
+        shapes = {"train_x": (self.p, N, N), "train_t": (self.q, self.m, self.m)}
+        if self.x_star is not None:
+            n_star = len(self.x_star)
+            shapes["star_x"] = (self.p, N, n_star)
+            shapes["star_star_x"] = (self.p, n_star, n_star)
+        return shapes
+        
+    def required_memory(self):
+        
+        """
+        Mémoire (octets) nécessaire pour l'ensemble des tenseurs de distances
+        """
+        
+        return sum(int(np.prod(shape))*self.dtype.itemsize for shape in self._shapes().values())
+    
+    def memory_usage(self):
+        
+        """
+        Mémoire (octets) de chaque tenseur et indication de son stockage ("memory" ou "mmap")
+        """
+        
+        storage = "mmap" if self.use_mmap else "memory"
+        return {name: (block.nbytes, storage) for name, block in self.blocks.items()}
+    
+    def _squared_differences(self, name, a, b):
+        
+        # Tenseur (d, len(a), len(b)) des différences carrées pour chaque dimension
+        shape = (a.shape[1], len(a), len(b))
+        if self.use_mmap:
+            D = np.lib.format.open_memmap(os.path.join(self.mmap_dir, f"{name}.npy"), mode = "w+",
+                                          dtype = self.dtype, shape = shape)
+        else:
+            D = np.empty(shape, dtype = self.dtype)
+        for k in range(shape[0]):
+            np.subtract.outer(a[:, k], b[:, k], out = D[k], dtype = self.dtype)
+            np.square(D[k], out = D[k])
+        if self.use_mmap:
+            D.flush()
+        return D
+    
+    def has_star(self, x_star):
+        return self.x_star is not None and np.shape(x_star) == self.x_star.shape and np.array_equal(x_star, self.x_star)
+    
+    @staticmethod
+    def _weighted(beta, D):
+        
+        # Somme pondérée sum_k beta_k*D[k] sans tenseur intermédiaire
+        beta = np.broadcast_to(np.asarray(beta, dtype = float), (len(D),))
+        out = np.zeros(D.shape[1:])
+        for k in range(len(D)):
+            out += beta[k]*D[k]
+        return out
+    
+    def _tf_distances(self, beta_eta, tf):
+        
+        # Distances pondérées entre tf et les colonnes tc de chaque simulation (seule partie dépendant de tf)
+        beta_t = np.broadcast_to(np.asarray(beta_eta, dtype = float), (self.p+self.q,))[self.p:]
+        return np.dot((np.atleast_1d(tf)[None, :]-self.tc)**2, beta_t)
+    
+    def cov_eta(self, beta_eta, lambda_eta, tf):
+        
+        """
+        Covariance de eta entre les points de (xf, tf) et (xc, tc)
+        """
+        
+        n = self.n
+        beta_eta = np.broadcast_to(np.asarray(beta_eta, dtype = float), (self.p+self.q,))
+        D = self._weighted(beta_eta[:self.p], self.blocks["train_x"])
+        w = self._tf_distances(beta_eta, tf)
+        D[:n, n:] += w[None, :]
+        D[n:, :n] += w[:, None]
+        D[n:, n:] += self._weighted(beta_eta[self.p:], self.blocks["train_t"])
+        return np.exp(-D)/lambda_eta
+    
+    def cov_delta(self, beta_delta, lambda_delta):
+        
+        """
+        Covariance de delta entre les points de xf
+        """
+        
+        n = self.n
+        return np.exp(-self._weighted(beta_delta, self.blocks["train_x"][:, :n, :n]))/lambda_delta
+    
+    def cross_eta(self, beta_eta, lambda_eta, tf, rows = slice(None)):
+        
+        """
+        Covariance de eta entre les points de (xf, tf), (xc, tc) et (x_star[rows], tf)
+        rows: tranche des points de x_star (tous par défaut), pour un calcul par blocs
+        """
+        
+        beta_eta = np.broadcast_to(np.asarray(beta_eta, dtype = float), (self.p+self.q,))
+        D = self._weighted(beta_eta[:self.p], self.blocks["star_x"][:, :, rows])
+        D[self.n:] += self._tf_distances(beta_eta, tf)[:, None]
+        return np.exp(-D)/lambda_eta
+    
+    def cross_delta(self, beta_delta, lambda_delta, rows = slice(None)):
+        
+        """
+        Covariance de delta entre les points de xf et x_star[rows]
+        """
+        
+        return np.exp(-self._weighted(beta_delta, self.blocks["star_x"][:, :self.n, rows]))/lambda_delta
+    
+    def prior_eta(self, beta_eta, lambda_eta, rows = slice(None)):
+        
+        """
+        Covariance de eta entre les points (x_star[rows], tf)
+        """
+        
+        beta_eta = np.broadcast_to(np.asarray(beta_eta, dtype = float), (self.p+self.q,))
+        return np.exp(-self._weighted(beta_eta[:self.p], self.blocks["star_star_x"][:, rows, rows]))/lambda_eta
+    
+    def prior_delta(self, beta_delta, lambda_delta, rows = slice(None)):
+        
+        """
+        Covariance de delta entre les points de x_star[rows]
+        """
+        
+        return np.exp(-self._weighted(beta_delta, self.blocks["star_star_x"][:, rows, rows]))/lambda_delta
+    
+    def close(self):
+        
+        """
+        Libération des tenseurs et suppression des fichiers temporaires projetés en mémoire
+        """
+        
+        self.blocks = {}
+        if self._own_dir and self.mmap_dir is not None:
+            shutil.rmtree(self.mmap_dir, ignore_errors = True)
+            self.mmap_dir = None
+            
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+        
+    def __getstate__(self):
+        
+        # Les tenseurs projetés en mémoire sont rouverts en lecture à partir de leur fichier
+        state = self.__dict__.copy()
+        if self.use_mmap:
+            state["blocks"] = {name: block.filename for name, block in self.blocks.items()}
+            state["_own_dir"] = False
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.use_mmap:
+            self.blocks = {name: np.load(path, mmap_mode = "r") for name, path in self.blocks.items()}
 
-    # Combinaison des données observées et simulées
-    XTfc = np.concatenate((np.concatenate((xf, xc)), np.concatenate((tf, tc))), axis = 1)
+TARGETS = ("y", "eta", "delta", "eta_delta")
 
-    # Combinaison des points à prédire x_star et des variables incertaines à posteriori
-    XT_star = np.concatenate((x_star, tf_star), axis = 1)
+class PosteriorPredictor:
+    
+    """
+    Prédicteur à posteriori du modèle de Kennedy & O'Hagan pour un tirage donné :
+    sig_z, sa décomposition de Cholesky et K = sig_z^-1 z sont calculés une seule fois
+    puis réutilisés pour prédire y*, eta*, delta* et eta*+delta*
+    """
+    
+    def __init__(self, posterior, xf, xc, tc, z, cache = None):
+        
+        self.cache = cache
+        self.xf = np.asarray(xf, dtype = float)
+        self.xc = np.asarray(xc, dtype = float)
+        self.tc = np.asarray(tc, dtype = float)
+        self.z = np.asarray(z, dtype = float)
+        self.n = len(self.xf)
+        self.m = len(self.xc)
+        
+        # Variables de calibration à posteriori
+        self.tf = np.atleast_1d(np.asarray(posterior["tf"], dtype = float))
+        self.beta_eta = posterior["beta_eta"]
+        self.lambda_eta = posterior["lambda_eta"]
+        
+        # Sans delta (ou sans erreur) la précision correspondante est infinie ; lambda_sim est la précision
+        # facultative d'un nugget sur les simulations (émulateur ajusté sur les seules simulations)
+        self.beta_delta = posterior.get("beta_delta", 0.0)
+        self.lambda_delta = posterior.get("lambda_delta", np.inf)
+        self.lambda_eps = posterior.get("lambda_eps", np.inf)
+        self.lambda_sim = posterior.get("lambda_sim", np.inf)
+        
+        # Combinaison des données observées et simulées
+        tf = np.tile(self.tf, (self.n, 1))
+        self.XTfc = np.concatenate((np.concatenate((self.xf, self.xc)), np.concatenate((tf, self.tc))), axis = 1)
+        
+        self._factor()
+        
+    def _sig_z(self):
+        
+        # Matrice de covariance de z
+        n = self.n
+        if self.cache is not None:
+            sig_z = self.cache.cov_eta(self.beta_eta, self.lambda_eta, self.tf)
+            sig_z[:n, :n] += self.cache.cov_delta(self.beta_delta, self.lambda_delta)
+        else:
+            sig_z = cov_exp(beta = self.beta_eta, l = self.lambda_eta, x1 = self.XTfc)
+            sig_z[:n, :n] += cov_exp(beta = self.beta_delta, l = self.lambda_delta, x1 = self.xf)
+        sig_z[:n, :n] += np.eye(n)/self.lambda_eps
+        sig_z[n:, n:] += np.eye(self.m)/self.lambda_sim
+        return sig_z
+    
+    def _factor(self):
+        
+        # Decomposition de Cholesky de la matrice de covariance de z (avec un jitter croissant si elle n'est pas
+        # définie positive à la précision machine) et K = sig_z^-1 z
+        self.chol = (cholesky_jitter(self._sig_z()), True)
+        self.K = self._solve(self.z)
+        
+    def _solve(self, b):
+        return sp.linalg.cho_solve(self.chol, b)
+    
+    def _xt_star(self, x_star):
+        
+        # Combinaison des points à prédire x_star et des variables incertaines à posteriori
+        tf_star = np.tile(self.tf, (len(x_star), 1))
+        return np.concatenate((x_star, tf_star), axis = 1)
+    
+    def _cached(self, x_star):
+        return self.cache is not None and self.cache.has_star(x_star)
+    
+    # Covariances des points x_star[rows] : les blocs du cache de distances portant sur x_star entier sont
+    # découpés suivant rows, les autres points sont extraits de x_star
+    def _cross_eta(self, x_star, rows = slice(None)):
+        if self._cached(x_star):
+            return self.cache.cross_eta(self.beta_eta, self.lambda_eta, self.tf, rows)
+        return cov_exp(beta = self.beta_eta, l = self.lambda_eta, x1 = self.XTfc, x2 = self._xt_star(x_star[rows]))
+    
+    def _cross_delta(self, x_star, rows = slice(None)):
+        L = np.zeros((self.n+self.m, len(x_star[rows])))
+        if self._cached(x_star):
+            L[:self.n] = self.cache.cross_delta(self.beta_delta, self.lambda_delta, rows)
+        else:
+            L[:self.n] = cov_exp(beta = self.beta_delta, l = self.lambda_delta, x1 = self.xf, x2 = x_star[rows])
+        return L
+    
+    def _prior_eta(self, x_star, rows = slice(None)):
+        if self._cached(x_star):
+            return self.cache.prior_eta(self.beta_eta, self.lambda_eta, rows)
+        return cov_exp(beta = self.beta_eta, l = self.lambda_eta, x1 = self._xt_star(x_star[rows]))
+    
+    def _prior_delta(self, x_star, rows = slice(None)):
+        if self._cached(x_star):
+            return self.cache.prior_delta(self.beta_delta, self.lambda_delta, rows)
+        return cov_exp(beta = self.beta_delta, l = self.lambda_delta, x1 = x_star[rows])
+    
+    @staticmethod
+    def _targets(targets):
+        targets = [targets] if isinstance(targets, str) else list(targets)
+        unknown = set(targets)-set(TARGETS)
+        if unknown:
+            raise ValueError(f"Unknown prediction target(s): {sorted(unknown)}")
+        return targets
+    
+    def _moments(self, x_star, targets, diag = False, rows = slice(None)):
+        
+        # Moyennes et covariances (ou variances seules si diag) conditionnelles à z des cibles aux points x_star[rows]
+        n_star = len(x_star[rows])
+        use_eta = any(t != "delta" for t in targets)
+        use_delta = any(t != "eta" for t in targets)
+        
+        # Produit L1^T sig_z^-1 L2 complet ou réduit à sa diagonale
+        if diag:
+            product = lambda L, S: np.einsum("ij,ij->j", L, S)
+        else:
+            product = lambda L, S: np.dot(L.T, S)
+        
+        # Covariances croisées entre z et les points à prédire et leurs produits avec sig_z^-1
+        # Par linéarité, les termes de y* et eta*+delta* se déduisent de ceux de eta* et delta*
+        if use_eta:
+            L_eta = self._cross_eta(x_star, rows)
+            S_eta = self._solve(L_eta)
+            mu_eta = np.dot(L_eta.T, self.K)
+            M_eta = product(L_eta, S_eta)
+            sig_eta_star = np.full(n_star, 1/self.lambda_eta) if diag else self._prior_eta(x_star, rows)
+        if use_delta:
+            L_delta = self._cross_delta(x_star, rows)
+            S_delta = self._solve(L_delta)
+            mu_delta = np.dot(L_delta.T, self.K)
+            M_delta = product(L_delta, S_delta)
+            sig_delta_star = np.full(n_star, 1/self.lambda_delta) if diag else self._prior_delta(x_star, rows)
+        if use_eta and use_delta:
+            M_cross = product(L_eta, S_delta)
+            M_cross = 2*M_cross if diag else M_cross+M_cross.T
+            
+        results = {}
+        for target in targets:
+            if target == "eta":
+                results[target] = (mu_eta, sig_eta_star-M_eta)
+            elif target == "delta":
+                results[target] = (mu_delta, sig_delta_star-M_delta)
+            else:
+                cov = sig_eta_star+sig_delta_star-M_eta-M_delta-M_cross
+                if target == "y":
+                    cov += (1 if diag else np.eye(n_star))/self.lambda_eps
+                results[target] = (mu_eta+mu_delta, cov)
+        return results
+    
+    def mean_cov(self, x_star, targets = TARGETS):
+        
+        """
+        Moyennes et covariances conditionnelles à z des cibles demandées parmi
+        "y", "eta", "delta" et "eta_delta" : dictionnaire {cible: (moyenne, covariance)}
+        """
+        
+        return self._moments(np.asarray(x_star, dtype = float), self._targets(targets))
+    
+    def mean_var(self, x_star, targets = TARGETS, chunk_size = 1000):
+        
+        """
+        Moyennes et variances marginales conditionnelles à z des cibles demandées, calculées par blocs
+        de chunk_size points de x_star sans former la covariance n_star x n_star : dictionnaire {cible: (moyenne, variance)}
+        """
+        
+        x_star = np.asarray(x_star, dtype = float)
+        targets = self._targets(targets)
+        n_star = len(x_star)
+        results = {target: (np.empty(n_star), np.empty(n_star)) for target in targets}
+        
+        # x_star est passé entier avec la tranche du bloc, pour que les blocs du cache de distances soient découpés
+        chunk_size = max(1, chunk_size)
+        for start in range(0, n_star, chunk_size):
+            stop = min(start+chunk_size, n_star)
+            for target, (mu, var) in self._moments(x_star, targets, diag = True, rows = slice(start, stop)).items():
+                results[target][0][start:stop] = mu
+                results[target][1][start:stop] = np.maximum(var, 0)
+        return results
+    
+    def sample(self, x_star, targets = TARGETS, size = None, rng = None, mode = "joint"):
+        
+        """
+        Tirages des cibles demandées suivant leurs lois conditionnelles à z : dictionnaire {cible: tirage(s)}
+        rng: générateur numpy (np.random.Generator), l'état global de np.random par défaut
+        mode: "joint" pour un tirage à partir de la décomposition de Cholesky de la covariance conditionnelle
+              (avec jitter si nécessaire), "svd" pour np.random.multivariate_normal
+        """
+        
+        if mode not in ("joint", "svd"):
+            raise ValueError(f"Unknown sampling mode: {mode}")
+        rng = np.random if rng is None else rng
+        moments = self.mean_cov(x_star, targets)
+        if mode == "svd":
+            return {target: rng.multivariate_normal(mean = mu, cov = cov, size = size)
+                    for target, (mu, cov) in moments.items()}
+        
+        draws = {}
+        for target, (mu, cov) in moments.items():
+            chol = cholesky_jitter(cov)
+            shape = () if size is None else tuple(np.atleast_1d(size))
+            draws[target] = mu+np.dot(rng.standard_normal(shape+(len(mu),)), chol.T)
+        return draws
 
-    # Matrice de covariance de z
-    sig_eta = cov_exp(beta = beta_eta, l = lambda_eta, x1 = XTfc)
-    sig_delta = cov_exp(beta = beta_delta, l = lambda_delta, x1 = xf)
-    sigma_eps = np.eye(n)/lambda_eps
-    sig_z = np.copy(sig_eta)
-    sig_z[:n, :n] += sig_delta+sigma_eps
+def cholesky_jitter(cov, jitter = 1e-10, max_tries = 8):
+    
+    """
+    Décomposition de Cholesky (triangulaire inférieure) d'une covariance éventuellement non définie positive
+    à la précision machine : jitter*moyenne(diag), multiplié par 10 à chaque échec, est ajouté à la diagonale
+    """
+    
+    try:
+        return np.linalg.cholesky(cov)
+    except np.linalg.LinAlgError:
+        pass
+    scale = np.mean(np.diag(cov)) if len(cov) > 0 else 1
+    scale = scale if scale > 0 else 1
+    for k in range(max_tries):
+        try:
+            return np.linalg.cholesky(cov+np.eye(len(cov))*scale*jitter*10**k)
+        except np.linalg.LinAlgError:
+            continue
+    raise np.linalg.LinAlgError("Covariance matrix is not positive definite, even with jitter")
 
-    # Decomposition de Cholesky de la matrice de covariance de z
-    chol, low = sp.linalg.cho_factor(sig_z, lower = True)
+def _kmeans(X, k, rng, n_iter = 10, block_size = 4096):
+    
+    # Centres de k-means (algorithme de Lloyd) initialisés sur un sous-ensemble aléatoire des points
+    centers = X[rng.choice(len(X), size = k, replace = False)].copy()
+    for _ in range(n_iter):
+        labels = np.empty(len(X), dtype = int)
+        for start in range(0, len(X), block_size):
+            block = X[start:start+block_size]
+            dist = (block**2).sum(axis = 1)[:, None]-2*np.dot(block, centers.T)+(centers**2).sum(axis = 1)[None, :]
+            labels[start:start+block_size] = np.argmin(dist, axis = 1)
+        counts = np.bincount(labels, minlength = k)
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, X)
+        
+        # Les centres sans point gardent leur position précédente
+        filled = counts > 0
+        centers[filled] = sums[filled]/counts[filled, None]
+    return centers
 
-    # Calcul de la moyenne et de la covariance de y_star sachant z
+class SparsePredictor(PosteriorPredictor):
     
-    K = sp.linalg.cho_solve((chol, low), z)
+    """
+    Approximation de PosteriorPredictor par points inducteurs pour les grands jeux de simulations :
+    la covariance de eta est remplacée par Q = K_zu K_uu^-1 K_uz, corrigée sur la diagonale (method = "fitc")
+    ou non (method = "nystrom"), et sig_z^-1 est appliquée par la formule de Woodbury en O((n+m)u^2+n^3).
+    inducing: "kmeans" ou "random" parmi les points (xf, tf) et (xc, tc), ou tableau des points inducteurs
+    """
     
-    L = cov_exp(beta = beta_eta, l = lambda_eta, x1 = XTfc, x2 = XT_star)
-    L[:n, :n_star] += cov_exp(beta = beta_delta, l = lambda_delta, x1 = xf, x2 = x_star)
+    def __init__(self, posterior, xf, xc, tc, z, num_inducing = 500, inducing = "kmeans",
+                 method = "fitc", jitter = 1e-6, seed = None):
+        
+        if method not in ("fitc", "nystrom"):
+            raise ValueError(f"Unknown sparse approximation: {method}")
+        self.num_inducing = num_inducing
+        self.inducing = inducing
+        self.method = method
+        self.jitter = jitter
+        self.rng = np.random.default_rng(seed)
+        super().__init__(posterior, xf, xc, tc, z)
+        
+    def _inducing_points(self):
+        
+        # Points inducteurs dans l'espace des entrées (x, t) de eta
+        if not isinstance(self.inducing, str):
+            return np.asarray(self.inducing, dtype = float)
+        N = len(self.XTfc)
+        if self.num_inducing >= N:
+            return self.XTfc
+        if self.inducing == "random":
+            return self.XTfc[self.rng.choice(N, size = self.num_inducing, replace = False)]
+        if self.inducing == "kmeans":
+            
+            # Regroupement dans la métrique du noyau : coordonnées multipliées par sqrt(beta_eta)
+            scale = np.sqrt(np.broadcast_to(np.asarray(self.beta_eta, dtype = float), (self.XTfc.shape[1],)))
+            scale = np.where(scale > 0, scale, 1)
+            return _kmeans(self.XTfc*scale, self.num_inducing, self.rng)/scale
+        raise ValueError(f"Unknown inducing points selection: {self.inducing}")
+        
+    def _factor(self):
+        
+        n = self.n
+        self.U = self._inducing_points()
+        
+        # Décomposition de Cholesky de K_uu et facteur V = L_uu^-1 K_uz tel que Q = V^T V
+        K_uu = cov_exp(beta = self.beta_eta, l = self.lambda_eta, x1 = self.U)
+        K_uu[np.diag_indices_from(K_uu)] += self.jitter/self.lambda_eta
+        self.L_uu = cholesky_jitter(K_uu)
+        K_uz = cov_exp(beta = self.beta_eta, l = self.lambda_eta, x1 = self.U, x2 = self.XTfc)
+        self.V = sp.linalg.solve_triangular(self.L_uu, K_uz, lower = True)
+        
+        # Partie bloc-diagonale de sig_z : bloc dense des observations (delta et erreur) et diagonale des simulations
+        diag = np.full(n+self.m, self.jitter/self.lambda_eta)
+        diag[n:] += 1/self.lambda_sim
+        if self.method == "fitc":
+            diag += np.maximum(1/self.lambda_eta-np.einsum("ij,ij->j", self.V, self.V), 0)
+        sig_f = cov_exp(beta = self.beta_delta, l = self.lambda_delta, x1 = self.xf)
+        sig_f[np.diag_indices_from(sig_f)] += 1/self.lambda_eps+diag[:n]
+        self.chol_f = (cholesky_jitter(sig_f), True) if n > 0 else None
+        self.diag_c = diag[n:]
+        
+        # Matrice de capacité A = I + V Lambda^-1 V^T de la formule de Woodbury
+        A = np.eye(len(self.U))+np.dot(self.V, self._solve_lambda(self.V.T))
+        self.chol_A = sp.linalg.cho_factor(A, lower = True)
+        self.K = self._solve(self.z)
+        
+    def _solve_lambda(self, b):
+        
+        # Produit Lambda^-1 b pour la partie bloc-diagonale
+        out = np.empty(b.shape)
+        if self.n > 0:
+            out[:self.n] = sp.linalg.cho_solve(self.chol_f, b[:self.n])
+        out[self.n:] = b[self.n:]/(self.diag_c[:, None] if b.ndim == 2 else self.diag_c)
+        return out
     
-    M_y = np.dot(L.T, sp.linalg.cho_solve((chol, low), L))
-    mu_y_star = np.dot(L.T, K)
+    def _solve(self, b):
+        
+        # (Lambda + V^T V)^-1 b = Lambda^-1 b - Lambda^-1 V^T A^-1 V Lambda^-1 b
+        lb = self._solve_lambda(b)
+        return lb-self._solve_lambda(np.dot(self.V.T, sp.linalg.cho_solve(self.chol_A, np.dot(self.V, lb))))
     
-    sig_eta_star = cov_exp(beta = beta_eta, l = lambda_eta, x1 = XT_star)
-    sig_delta_star = cov_exp(beta = beta_delta, l = lambda_delta, x1 = x_star)
-    cov_y_star = sig_eta_star+sig_delta_star+np.eye(n_star)/lambda_eps
+    def _cross_eta(self, x_star, rows = slice(None)):
+        
+        # Covariance croisée approchée Q_z* = V^T L_uu^-1 K_u*, cohérente avec l'approximation de sig_z
+        K_us = cov_exp(beta = self.beta_eta, l = self.lambda_eta, x1 = self.U, x2 = self._xt_star(x_star[rows]))
+        return np.dot(self.V.T, sp.linalg.solve_triangular(self.L_uu, K_us, lower = True))
 
-    cov_y_star -= M_y
+def sparse_check(posterior, x_star, xf, xc, tc, z, targets = TARGETS, subsample = 2000, seed = None, **options):
+    
+    """
+    Écart entre SparsePredictor et la prédiction exacte sur un sous-échantillon de subsample simulations
+    (toutes les observations sont gardées) : pour chaque cible, écart quadratique moyen et maximal des moyennes,
+    écart quadratique moyen des moyennes rapporté à l'écart-type exact et rapport moyen des écarts-types
+    """
+    
+    xf = np.asarray(xf, dtype = float)
+    xc = np.asarray(xc, dtype = float)
+    tc = np.asarray(tc, dtype = float)
+    z = np.asarray(z, dtype = float)
+    n, m = len(xf), len(xc)
+    
+    # Sous-échantillon des simulations sur lequel la prédiction exacte reste abordable
+    rng = np.random.default_rng(seed)
+    idx = np.sort(rng.choice(m, size = subsample, replace = False)) if subsample < m else np.arange(m)
+    z_sub = np.concatenate((z[:n], z[n:][idx]))
+    
+    exact = PosteriorPredictor(posterior, xf, xc[idx], tc[idx], z_sub).mean_cov(x_star, targets)
+    # La graine n'est transmise qu'une fois à SparsePredictor (options de sparse pouvant déjà la contenir)
+    options.setdefault("seed", seed)
+    sparse = SparsePredictor(posterior, xf, xc[idx], tc[idx], z_sub, **options).mean_cov(x_star, targets)
+    
+    report = {}
+    for target in exact:
+        mu_e, cov_e = exact[target]
+        mu_s, cov_s = sparse[target]
+        sd_e = np.sqrt(np.maximum(np.diag(cov_e), 1e-300))
+        sd_s = np.sqrt(np.maximum(np.diag(cov_s), 0))
+        report[target] = {"mean_rmse": float(np.sqrt(np.mean((mu_s-mu_e)**2))),
+                          "mean_max": float(np.max(np.abs(mu_s-mu_e))),
+                          "standardized_rmse": float(np.sqrt(np.mean(((mu_s-mu_e)/sd_e)**2))),
+                          "std_ratio": float(np.mean(sd_s/sd_e))}
+    return report
 
-    y_star_std = np.random.multivariate_normal(mean = mu_y_star, cov = cov_y_star)
+def cholesky_update(L, x):
+    
+    """
+    Mise à jour de rang 1 sur place du facteur de Cholesky triangulaire inférieur L : L L^T + x x^T
+    """
+    
+    x = np.array(x, dtype = float)
+    for k in range(len(x)):
+        r = np.hypot(L[k, k], x[k])
+        c = r/L[k, k]
+        s = x[k]/L[k, k]
+        L[k, k] = r
+        L[k+1:, k] = (L[k+1:, k]+s*x[k+1:])/c
+        x[k+1:] = c*x[k+1:]-s*L[k+1:, k]
+    return L
 
-    return y_star_std
+class IncrementalPredictor(PosteriorPredictor):
+    
+    """
+    PosteriorPredictor à hyperparamètres fixés dont le facteur de Cholesky de sig_z est prolongé par blocs
+    lorsque des observations ou des simulations sont ajoutées (O(N^2 k) pour k lignes) et mis à jour lorsque
+    des lignes sont retirées, au lieu d'être recalculé en O(N^3). Les lignes sont gardées dans leur ordre
+    d'arrivée et repérées par un identifiant renvoyé à leur ajout.
+    """
+    
+    def __init__(self, posterior, xf, xc, tc, z):
+        
+        super().__init__(posterior, xf, xc, tc, z)
+        self.p = self.xf.shape[1]
+        self.field = np.concatenate((np.ones(self.n, dtype = bool), np.zeros(self.m, dtype = bool)))
+        self.ids = np.arange(self.n+self.m)
+        self._next_id = self.n+self.m
+        self.chol = (np.tril(self.chol[0]), True)
+        
+    def _cov_rows(self, XA, fA, XB, fB, same = False):
+        
+        # Bloc de sig_z entre deux ensembles de lignes (x, t) repérées comme observations (fA, fB) ou simulations
+        C = cov_exp(beta = self.beta_eta, l = self.lambda_eta, x1 = XA, x2 = XB)
+        if fA.any() and fB.any():
+            C[np.ix_(fA, fB)] += cov_exp(beta = self.beta_delta, l = self.lambda_delta,
+                                         x1 = XA[fA, :self.p], x2 = XB[fB, :self.p])
+        if same:
+            C[np.diag_indices_from(C)] += np.where(fA, 1/self.lambda_eps, 1/self.lambda_sim)
+        return C
+    
+    def _append(self, X_new, field_new, z_new):
+        
+        # Prolongement du facteur : L_new = [[L, 0], [B^T, D]] avec B = L^-1 C_on et D D^T = C_nn - B^T B
+        L = self.chol[0]
+        C_on = self._cov_rows(self.XTfc, self.field, X_new, field_new)
+        C_nn = self._cov_rows(X_new, field_new, X_new, field_new, same = True)
+        B = sp.linalg.solve_triangular(L, C_on, lower = True)
+        D = np.linalg.cholesky(C_nn-np.dot(B.T, B))
+        
+        N, k = len(L), len(X_new)
+        L_new = np.zeros((N+k, N+k))
+        L_new[:N, :N] = L
+        L_new[N:, :N] = B.T
+        L_new[N:, N:] = D
+        self.chol = (L_new, True)
+        
+        ids = np.arange(self._next_id, self._next_id+k)
+        self._next_id += k
+        self.XTfc = np.concatenate((self.XTfc, X_new))
+        self.field = np.concatenate((self.field, field_new))
+        self.z = np.concatenate((self.z, z_new))
+        self.ids = np.concatenate((self.ids, ids))
+        self._update_data()
+        return ids
+    
+    def _update_data(self):
+        
+        # Données dérivées de l'ordre interne des lignes et K = sig_z^-1 z
+        self.xf = self.XTfc[self.field, :self.p]
+        self.n = int(self.field.sum())
+        self.m = len(self.field)-self.n
+        self.K = self._solve(self.z)
+        
+    def add_observations(self, xf_new, z_new):
+        
+        """
+        Ajout de nouvelles observations (xf, z) : retourne les identifiants des lignes ajoutées
+        """
+        
+        xf_new = np.asarray(xf_new, dtype = float)
+        X_new = np.concatenate((xf_new, np.tile(self.tf, (len(xf_new), 1))), axis = 1)
+        return self._append(X_new, np.ones(len(xf_new), dtype = bool), np.asarray(z_new, dtype = float))
+    
+    def add_simulations(self, xc_new, tc_new, eta_new):
+        
+        """
+        Ajout de nouvelles simulations (xc, tc, eta) : retourne les identifiants des lignes ajoutées
+        """
+        
+        X_new = np.concatenate((np.asarray(xc_new, dtype = float), np.asarray(tc_new, dtype = float)), axis = 1)
+        return self._append(X_new, np.zeros(len(X_new), dtype = bool), np.asarray(eta_new, dtype = float))
+    
+    def remove(self, ids):
+        
+        """
+        Retrait des lignes d'identifiants ids : pour chaque ligne retirée, le bloc de Cholesky qui la suit
+        reçoit une mise à jour de rang 1 par la colonne correspondante (L33 L33^T + l32 l32^T)
+        """
+        
+        positions = np.flatnonzero(np.isin(self.ids, ids))
+        if len(positions) != len(np.unique(ids)):
+            raise KeyError("Unknown row identifier(s)")
+        
+        L = self.chol[0].copy()
+        keep = np.ones(len(L), dtype = bool)
+        
+        # Retrait de la dernière à la première ligne pour que les positions restent valables
+        for i in positions[::-1]:
+            cholesky_update(L[i+1:, i+1:], L[i+1:, i])
+            L = np.delete(np.delete(L, i, axis = 0), i, axis = 1)
+            keep[i] = False
+        self.chol = (L, True)
+        self.XTfc = self.XTfc[keep]
+        self.field = self.field[keep]
+        self.z = self.z[keep]
+        self.ids = self.ids[keep]
+        self._update_data()
+        
+    def remove_oldest(self, k, observations = True):
+        
+        """
+        Retrait des k plus anciennes observations (ou simulations si observations est False)
+        """
+        
+        mask = self.field if observations else ~self.field
+        self.remove(self.ids[mask][:k])
+        
+    def refactor(self):
+        
+        """
+        Nouvelle décomposition complète de sig_z (par exemple pour limiter l'accumulation des erreurs d'arrondi)
+        """
+        
+        sig_z = self._cov_rows(self.XTfc, self.field, self.XTfc, self.field, same = True)
+        self.chol = (np.linalg.cholesky(sig_z), True)
+        self.K = self._solve(self.z)
+        
+    def _cross_delta(self, x_star, rows = slice(None)):
+        L = np.zeros((len(self.field), len(x_star[rows])))
+        L[self.field] = cov_exp(beta = self.beta_delta, l = self.lambda_delta, x1 = self.xf, x2 = x_star[rows])
+        return L
 
-def eta_delta_pred(posterior, x_star, xf, xc, tc, z):
+def posterior_pred(posterior, x_star, xf, xc, tc, z, targets = TARGETS, mode = "joint"):
     
-    n = len(xf)
-    n_star = len(x_star)
+    # Tirages conjoints de plusieurs cibles avec une seule décomposition de Cholesky
+    return PosteriorPredictor(posterior, xf, xc, tc, z).sample(x_star, targets, mode = mode)
+
+def _pred(target, posterior, x_star, xf, xc, tc, z, mode, chunk_size):
     
-    # Variables de calibration à posteriori
-    tf = np.tile(posterior["tf"], (n, 1))
-    tf_star = np.tile(posterior["tf"], (n_star, 1))
+    # Tirage de la cible (mode "joint" ou "svd") ou moyennes et variances marginales par blocs (mode "marginal")
+    predictor = PosteriorPredictor(posterior, xf, xc, tc, z)
+    if mode == "marginal":
+        return predictor.mean_var(x_star, target, chunk_size = chunk_size)[target]
+    return predictor.sample(x_star, target, mode = mode)[target]
 
-    beta_eta = posterior["beta_eta"]
-    beta_delta = posterior["beta_delta"]
-    lambda_eta = posterior["lambda_eta"]
-    lambda_delta = posterior["lambda_delta"]
-    lambda_eps = posterior["lambda_eps"]
+def y_pred(posterior, x_star, xf, xc, tc, z, mode = "joint", chunk_size = 1000):
+    return _pred("y", posterior, x_star, xf, xc, tc, z, mode, chunk_size)
 
-    # Combinaison des données observées et simulées
-    XTfc = np.concatenate((np.concatenate((xf, xc)), np.concatenate((tf, tc))), axis = 1)
+def eta_delta_pred(posterior, x_star, xf, xc, tc, z, mode = "joint", chunk_size = 1000):
+    return _pred("eta_delta", posterior, x_star, xf, xc, tc, z, mode, chunk_size)
 
-    # Combinaison des points à prédire x_star et des variables incertaines à posteriori
-    XT_star = np.concatenate((x_star, tf_star), axis = 1)
+def eta_pred(posterior, x_star, xf, xc, tc, z, mode = "joint", chunk_size = 1000):
+    return _pred("eta", posterior, x_star, xf, xc, tc, z, mode, chunk_size)
 
-    # Matrice de covariance de z
-    sig_eta = cov_exp(beta = beta_eta, l = lambda_eta, x1 = XTfc)
-    sig_delta = cov_exp(beta = beta_delta, l = lambda_delta, x1 = xf)
-    sigma_eps = np.eye(n)/lambda_eps
-    sig_z = np.copy(sig_eta)
-    sig_z[:n, :n] += sig_delta+sigma_eps
+def delta_pred(posterior, x_star, xf, xc, tc, z, mode = "joint", chunk_size = 1000):
+    return _pred("delta", posterior, x_star, xf, xc, tc, z, mode, chunk_size)
 
-    # Decomposition de Cholesky de la matrice de covariance de z
-    chol, low = sp.linalg.cho_factor(sig_z, lower = True)
+POSTERIOR_VARS = ("tf", "beta_eta", "beta_delta", "lambda_eta", "lambda_delta", "lambda_eps", "lambda_sim")
+REQUIRED_VARS = ("tf", "beta_eta", "lambda_eta")
 
-    # Calcul de la moyenne et de la covariance de y_star sachant z
-    
-    K = sp.linalg.cho_solve((chol, low), z)
-    
-    L = cov_exp(beta = beta_eta, l = lambda_eta, x1 = XTfc, x2 = XT_star)
-    L[:n, :n_star] += cov_exp(beta = beta_delta, l = lambda_delta, x1 = xf, x2 = x_star)
+def posterior_draws(posterior, var_names = POSTERIOR_VARS):
     
-    M_y = np.dot(L.T, sp.linalg.cho_solve((chol, low), L))
-    mu_y_star = np.dot(L.T, K)
+    """
+    Conversion d'un posterior ArviZ (InferenceData ou Dataset avec les dimensions chain et draw)
+    ou d'un dictionnaire de tableaux empilés en dictionnaire {variable: tableau (n_draws, ...)}
+    """
     
-    sig_eta_star = cov_exp(beta = beta_eta, l = lambda_eta, x1 = XT_star)
-    sig_delta_star = cov_exp(beta = beta_delta, l = lambda_delta, x1 = x_star)
-    cov_y_star = sig_eta_star+sig_delta_star
+    if hasattr(posterior, "posterior"):
+        posterior = posterior.posterior
+        
+    draws = {}
+    for name in var_names:
+        if name not in posterior:
+            continue
+        values = np.asarray(posterior[name].values if hasattr(posterior, "data_vars") else posterior[name], dtype = float)
+        
+        # Les chaînes sont mises bout à bout pour un Dataset ArviZ
+        if hasattr(posterior, "data_vars"):
+            values = values.reshape((-1,)+values.shape[2:])
+        draws[name] = values
+        
+    missing = [name for name in REQUIRED_VARS if name not in draws]
+    if missing:
+        raise KeyError(f"Missing posterior variable(s): {missing}")
+    if len({len(values) for values in draws.values()}) != 1:
+        raise ValueError("All posterior variables must have the same number of draws")
+    return draws
 
-    cov_y_star -= M_y
+# Tableaux partagés (xf, xc, tc, z, x_star et tenseurs "cache/..." d'un cache de distances en mémoire)
+# attachés par chaque processus du pool
+_SHARED = {}
+_OPTIONS = {}
+
+def _attach_shared(specs, cache = None, sparse = None, mode = "joint"):
+    
+    # Lecture sans copie des tableaux placés en mémoire partagée par le processus principal
+    for name, (shm_name, shape, dtype) in specs.items():
+        try:
+            shm = shared_memory.SharedMemory(name = shm_name, track = False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name = shm_name)
+        _SHARED[name] = (shm, np.ndarray(shape, dtype = dtype, buffer = shm.buf))
+        
+    # Le cache de distances en mémoire est transmis sans ses tenseurs, lus dans les blocs partagés
+    if cache is not None and not cache.use_mmap:
+        cache.blocks = {name[len("cache/"):]: array for name, (shm, array) in _SHARED.items() if name.startswith("cache/")}
+    _OPTIONS.update(cache = cache, sparse = sparse, mode = mode)
 
-    y_star_std = np.random.multivariate_normal(mean = mu_y_star, cov = cov_y_star)
+def _predictor(draw, xf, xc, tc, z, cache = None, sparse = None):
+    
+    # Prédicteur exact (avec éventuellement le cache de distances) ou approché par points inducteurs
+    if sparse is not None:
+        return SparsePredictor(draw, xf, xc, tc, z, **sparse)
+    return PosteriorPredictor(draw, xf, xc, tc, z, cache = cache)
 
-    return y_star_std
+def _predict_draw(task):
+    
+    # Prédiction pour un tirage à posteriori à partir des tableaux partagés
+    index, draw, target, seed = task
+    data = {name: array for name, (shm, array) in _SHARED.items()}
+    options = dict(_OPTIONS)
+    mode = options.pop("mode")
+    try:
+        predictor = _predictor(draw, data["xf"], data["xc"], data["tc"], data["z"], **options)
+        return index, predictor.sample(data["x_star"], target, rng = np.random.default_rng(seed), mode = mode)[target]
+    except np.linalg.LinAlgError:
+        # Covariance non définie positive même avec jitter : le tirage est écarté, pas tout le lot
+        return index, None
 
-def eta_pred(posterior, x_star, xf, xc, tc, z):
+def predict_draws(posterior, x_star, xf, xc, tc, z, target = "y", num_processors = None,
+                  chunksize = None, seed = None, out = None, cache = None, sparse = None, mode = "joint",
+                  return_skipped = False):
+    
+    """
+    Tirages prédictifs de la cible pour tous les tirages à posteriori (InferenceData ArviZ ou
+    dictionnaire de tableaux empilés), répartis sur un pool de processus qui lisent xf, xc, tc, z
+    et x_star en mémoire partagée. Retourne un tableau (n_draws, n_star), éventuellement écrit dans out
+    cache: DistanceCache des données, dont les tenseurs sont placés dans les mêmes blocs de mémoire partagée que les données
+           plutôt que copiés dans chaque processus (ou rouverts depuis leurs fichiers s'ils sont projetés en mémoire)
+    sparse: options de SparsePredictor (dictionnaire) pour utiliser l'approximation par points inducteurs
+    mode: mode de tirage de PosteriorPredictor.sample ("joint" ou "svd")
+    Les tirages dont la covariance n'est pas définie positive, même avec jitter, sont écartés : leurs lignes
+    de out valent NaN, leurs indices sont signalés par un avertissement et retournés avec out si return_skipped
+    """
+    
+    if target not in TARGETS:
+        raise ValueError(f"Unknown prediction target: {target}")
+        
+    draws = posterior_draws(posterior)
+    n_draws = len(draws["tf"])
+    arrays = {"xf": xf, "xc": xc, "tc": tc, "z": z, "x_star": x_star}
+    arrays = {name: np.ascontiguousarray(array, dtype = float) for name, array in arrays.items()}
+    
+    if out is None:
+        out = np.empty((n_draws, len(arrays["x_star"])))
+        
+    # Une graine indépendante par tirage, pour des résultats indépendants du nombre de processus
+    seeds = np.random.SeedSequence(seed).spawn(n_draws)
+    tasks = ((i, {name: values[i] for name, values in draws.items()}, target, seeds[i]) for i in range(n_draws))
     
-    n = len(xf)
-    n_star = len(x_star)
+    skipped = []
+    if num_processors == 1:
+        for i, draw, _, s in tasks:
+            try:
+                predictor = _predictor(draw, arrays["xf"], arrays["xc"], arrays["tc"], arrays["z"], cache = cache, sparse = sparse)
+                out[i] = predictor.sample(arrays["x_star"], target, rng = np.random.default_rng(s), mode = mode)[target]
+            except np.linalg.LinAlgError:
+                out[i] = np.nan
+                skipped.append(i)
+        return _skipped(out, skipped, return_skipped)
     
-    # Variables de calibration à posteriori
-    tf = np.tile(posterior["tf"], (n, 1))
-    tf_star = np.tile(posterior["tf"], (n_star, 1))
+    # Copie unique des tableaux en mémoire partagée, tenseurs du cache de distances compris s'il est en mémoire
+    shared = dict(arrays)
+    if cache is not None and not cache.use_mmap:
+        shared.update(("cache/"+name, block) for name, block in cache.blocks.items())
+        cache = copy.copy(cache)
+        cache.blocks = {}
+    blocks = []
+    try:
+        specs = {}
+        for name, array in shared.items():
+            shm = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+            blocks.append(shm)
+            np.ndarray(array.shape, dtype = array.dtype, buffer = shm.buf)[...] = array
+            specs[name] = (shm.name, array.shape, array.dtype.str)
+            
+        num_processors = num_processors or os.cpu_count()
+        if chunksize is None:
+            chunksize = max(1, n_draws//(4*num_processors))
+            
+        # Les tirages sont rangés dans out au fur et à mesure qu'ils arrivent
+        with Pool(processes = num_processors, initializer = _attach_shared, initargs = (specs, cache, sparse, mode)) as pool:
+            for i, values in pool.imap_unordered(_predict_draw, tasks, chunksize = chunksize):
+                if values is None:
+                    out[i] = np.nan
+                    skipped.append(i)
+                else:
+                    out[i] = values
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+    return _skipped(out, skipped, return_skipped)
 
-    beta_eta = posterior["beta_eta"]
-    beta_delta = posterior["beta_delta"]
-    lambda_eta = posterior["lambda_eta"]
-    lambda_delta = posterior["lambda_delta"]
-    lambda_eps = posterior["lambda_eps"]
+def _skipped(out, skipped, return_skipped):
+    
+    # Signalement des tirages écartés
+    skipped = sorted(skipped)
+    if skipped:
+        warnings.warn(f"{len(skipped)} posterior draws skipped (covariance not positive definite): {skipped}")
+    return (out, skipped) if return_skipped else out
 
-    # Combinaison des données observées et simulées
-    XTfc = np.concatenate((np.concatenate((xf, xc)), np.concatenate((tf, tc))), axis = 1)
+# Lois a priori par défaut : Beta(a, b) sur rho = exp(-beta/4) et Gamma(a, b) (b taux) sur les précisions
+DEFAULT_PRIORS = {"rho_eta": (2, 0.5), "lambda_eta": (5, 5), "rho_delta": (1, 0.4), "lambda_delta": (10, 0.3),
+                  "lambda_eps": (10, 0.03), "lambda_sim": (1, 1e-4)}
 
-    # Combinaison des points à prédire x_star et des variables incertaines à posteriori
-    XT_star = np.concatenate((x_star, tf_star), axis = 1)
+def _layout(n, p, q, nugget, fixed):
+    
+    # Paramètres optimisés (nom, taille) : émulateur seul si aucune observation, modèle complet sinon
+    names = ["beta_eta", "lambda_eta"]
+    if n > 0:
+        names = ["tf"]+names+["beta_delta", "lambda_delta", "lambda_eps"]
+    if nugget:
+        names.append("lambda_sim")
+    sizes = {"tf": q, "beta_eta": p+q, "beta_delta": p}
+    return [(name, sizes.get(name, 1)) for name in names if name not in fixed]
 
-    # Matrice de covariance de z
-    sig_eta = cov_exp(beta = beta_eta, l = lambda_eta, x1 = XTfc)
-    sig_delta = cov_exp(beta = beta_delta, l = lambda_delta, x1 = xf)
-    sigma_eps = np.eye(n)/lambda_eps
-    sig_z = np.copy(sig_eta)
-    sig_z[:n, :n] += sig_delta+sigma_eps
+def _unpack(theta, layout, fixed):
+    
+    # Paramètres naturels et dérivées par rapport aux paramètres non contraints :
+    # tf = expit(u), beta = -4 log(expit(u)), lambda = exp(u)
+    params = dict(fixed)
+    derivatives = {}
+    start = 0
+    for name, size in layout:
+        u = theta[start:start+size]
+        start += size
+        if name == "tf":
+            value = sp.special.expit(u)
+            derivatives[name] = value*(1-value)
+        elif name.startswith("beta"):
+            value = 4*np.logaddexp(0, -u)
+            derivatives[name] = -4*sp.special.expit(-u)
+        else:
+            value = np.exp(u)
+            derivatives[name] = value
+            value = float(value[0])
+        params[name] = value
+    return params, derivatives
 
-    # Decomposition de Cholesky de la matrice de covariance de z
-    chol, low = sp.linalg.cho_factor(sig_z, lower = True)
+def _weighted_squared_sums(A, X):
+    
+    # sum_ij A_ij (X_ik-X_jk)^2 pour chaque colonne k, A symétrique
+    return 2*np.dot((X**2).T, A.sum(axis = 1))-2*np.einsum("ik,ik->k", X, np.dot(A, X))
 
-    # Calcul de la moyenne et de la covariance de y_star sachant z
+def log_marginal_likelihood(params, xf, xc, tc, z, gradient = False):
     
-    K = sp.linalg.cho_solve((chol, low), z)
+    """
+    Log-vraisemblance marginale de z sous le modèle de Kennedy & O'Hagan (émulateur seul si xf est vide)
+    et, si gradient, son gradient analytique par rapport à chaque paramètre de params
+    """
     
-    L = cov_exp(beta = beta_eta, l = lambda_eta, x1 = XTfc, x2 = XT_star)
+    n, m = len(xf), len(xc)
+    tf = np.atleast_1d(np.asarray(params.get("tf", np.zeros(tc.shape[1])), dtype = float))
+    X = np.concatenate((np.concatenate((xf, xc)), np.concatenate((np.tile(tf, (n, 1)), tc))), axis = 1)
+    lambda_eps = params.get("lambda_eps", np.inf)
+    lambda_sim = params.get("lambda_sim", np.inf)
     
-    M_eta = np.dot(L.T, sp.linalg.cho_solve((chol, low), L))
-    mu_eta_star = np.dot(L.T, K)
+    # Matrice de covariance de z
+    K_eta = cov_exp(beta = params["beta_eta"], l = params["lambda_eta"], x1 = X)
+    sig_z = np.copy(K_eta)
+    if n > 0:
+        K_delta = cov_exp(beta = params["beta_delta"], l = params["lambda_delta"], x1 = xf)
+        sig_z[:n, :n] += K_delta+np.eye(n)/lambda_eps
+    sig_z[n:, n:] += np.eye(m)/lambda_sim
     
-    sig_eta_star = cov_exp(beta = beta_eta, l = lambda_eta, x1 = XT_star)
-    cov_eta_star = sig_eta_star
-
-    cov_eta_star -= M_eta
-
-    eta_star_std = np.random.multivariate_normal(mean = mu_eta_star, cov = cov_eta_star)
-
-    return eta_star_std
+    chol = sp.linalg.cho_factor(sig_z, lower = True)
+    alpha = sp.linalg.cho_solve(chol, z)
+    value = -0.5*np.dot(z, alpha)-np.sum(np.log(np.diag(chol[0])))-0.5*(n+m)*np.log(2*np.pi)
+    if not gradient:
+        return value
+    
+    # d log L = 1/2 tr(W d sig_z) avec W = alpha alpha^T - sig_z^-1
+    W = np.outer(alpha, alpha)-sp.linalg.cho_solve(chol, np.eye(n+m))
+    WK = W*K_eta
+    beta_eta = np.broadcast_to(np.asarray(params["beta_eta"], dtype = float), (X.shape[1],))
+    grad = {"beta_eta": -0.5*_weighted_squared_sums(WK, X),
+            "lambda_eta": -0.5*WK.sum()/params["lambda_eta"],
+            "lambda_sim": -0.5*np.trace(W[n:, n:])/lambda_sim**2}
+    if n > 0:
+        
+        # tf n'intervient que dans les blocs observations/simulations
+        p = xf.shape[1]
+        c = WK[:n, n:].sum(axis = 0)
+        grad["tf"] = -2*beta_eta[p:]*np.dot(c, tf[None, :]-tc)
+        WK_delta = W[:n, :n]*K_delta
+        grad["beta_delta"] = -0.5*_weighted_squared_sums(WK_delta, xf)
+        grad["lambda_delta"] = -0.5*WK_delta.sum()/params["lambda_delta"]
+        grad["lambda_eps"] = -0.5*np.trace(W[:n, :n])/lambda_eps**2
+    return value, grad
 
-def delta_pred(posterior, x_star, xf, xc, tc, z):
+def _neg_log_posterior(theta, layout, fixed, data, priors):
     
-    m = len(xc)
-    n = len(xf)
-    n_star = len(x_star)
+    # Opposé de la log-densité à posteriori (jacobien compris) dans l'espace non contraint et son gradient
+    params, derivatives = _unpack(theta, layout, fixed)
+    try:
+        value, grad = log_marginal_likelihood(params, *data, gradient = True)
+    except np.linalg.LinAlgError:
+        return np.inf, np.zeros_like(theta)
     
-    # Variables de calibration à posteriori
-    tf = np.tile(posterior["tf"], (n, 1))
+    out = []
+    for name, size in layout:
+        g = np.atleast_1d(grad[name])*derivatives[name]
+        if priors is not None:
+            if name == "tf":
+                
+                # Loi uniforme sur [0, 1]
+                value += np.sum(np.log(derivatives[name]))
+                g = g+1-2*params[name]
+            elif name.startswith("beta"):
+                a, b = priors["rho"+name[4:]]
+                rho = np.exp(-params[name]/4)
+                value += np.sum(a*np.log(rho)+b*np.log1p(-rho))
+                g = g+a*(1-rho)-b*rho
+            else:
+                a, b = priors[name]
+                value += a*np.log(params[name])-b*params[name]
+                g = g+a-b*params[name]
+        out.append(g)
+    return -value, -np.concatenate(out)
 
-    beta_eta = posterior["beta_eta"]
-    beta_delta = posterior["beta_delta"]
-    lambda_eta = posterior["lambda_eta"]
-    lambda_delta = posterior["lambda_delta"]
-    lambda_eps = posterior["lambda_eps"]
+def _initial_point(layout, priors, rng):
+    
+    # Point de départ tiré dans les lois a priori (ou dans des intervalles raisonnables sans loi a priori)
+    theta = []
+    for name, size in layout:
+        if name == "tf":
+            theta.append(sp.special.logit(rng.uniform(0.1, 0.9, size)))
+        elif name.startswith("beta"):
+            rho = rng.beta(*priors["rho"+name[4:]], size) if priors is not None else rng.uniform(0.1, 0.9, size)
+            theta.append(sp.special.logit(np.clip(rho, 0.05, 0.95)))
+        else:
+            lam = rng.gamma(priors[name][0], 1/priors[name][1], size) if priors is not None else np.exp(rng.normal(0, 1, size))
+            theta.append(np.log(lam))
+    return np.concatenate(theta)
 
-    # Combinaison des données observées et simulées
-    XTfc = np.concatenate((np.concatenate((xf, xc)), np.concatenate((tf, tc))), axis = 1)
+def _fit_restart(task):
+    
+    # Une optimisation L-BFGS-B à partir d'un point de départ
+    theta0, layout, fixed, data, priors, options = task
+    result = sp.optimize.minimize(_neg_log_posterior, theta0, args = (layout, fixed, data, priors),
+                                  jac = True, method = "L-BFGS-B", options = options)
+    return result.x, result.fun, result.success
 
-    # Matrice de covariance de z
-    sig_eta = cov_exp(beta = beta_eta, l = lambda_eta, x1 = XTfc)
-    sig_delta = cov_exp(beta = beta_delta, l = lambda_delta, x1 = xf)
-    sigma_eps = np.eye(n)/lambda_eps
-    sig_z = np.copy(sig_eta)
-    sig_z[:n, :n] += sig_delta+sigma_eps
+def _hessian(theta, layout, fixed, data, priors, step = 1e-4):
+    
+    # Hessienne par différences centrées du gradient analytique
+    H = np.empty((len(theta), len(theta)))
+    for i in range(len(theta)):
+        e = np.zeros(len(theta))
+        e[i] = step
+        H[:, i] = (_neg_log_posterior(theta+e, layout, fixed, data, priors)[1]
+                   -_neg_log_posterior(theta-e, layout, fixed, data, priors)[1])/(2*step)
+    return (H+H.T)/2
 
-    # Decomposition de Cholesky de la matrice de covariance de z
-    chol, low = sp.linalg.cho_factor(sig_z, lower = True)
+def _positive_definite(params, xf, xc, tc, z):
+    
+    # La covariance de z des paramètres admet-elle une décomposition de Cholesky (sans jitter) ?
+    try:
+        return bool(np.isfinite(log_marginal_likelihood(params, xf, xc, tc, z)))
+    except np.linalg.LinAlgError:
+        return False
 
-    # Calcul de la moyenne et de la covariance de y_star sachant z
+def fit_map(xf, xc, tc, z, priors = DEFAULT_PRIORS, fixed = None, nugget = None, restarts = 8,
+            num_processors = None, laplace = False, n_draws = 1000, seed = None, options = None):
     
-    K = sp.linalg.cho_solve((chol, low), z)
+    """
+    Estimation du maximum a posteriori (ou du maximum de vraisemblance de type II si priors est None) des
+    hyperparamètres du modèle de Kennedy & O'Hagan par L-BFGS-B avec gradients analytiques et plusieurs
+    points de départ optimisés en parallèle. Sans observations (xf None ou vide) seul l'émulateur est ajusté
+    sur z = eta, avec le nugget lambda_sim (notebook Metamodel_GP).
+    fixed: valeurs gardées fixes, par exemple les hyperparamètres d'un émulateur déjà ajusté
+    tc: None pour un émulateur des seules entrées xc, sans variables de calibration
+    nugget: estimation de la précision lambda_sim d'un nugget sur les simulations (par défaut sans observations)
+    laplace: approximation de Laplace dans l'espace non contraint et n_draws tirages empilés ; les tirages dont
+             sig_z n'est pas définie positive sont rejetés et retirés
+    Retourne un dictionnaire avec "posterior" (directement utilisable par les fonctions de prédiction ; sans
+    observations "tf" est vide sans variables de calibration, et vaut NaN à fixer avant la prédiction sinon),
+    "log_posterior", "restarts" et, avec laplace, "covariance" et "draws" (utilisable par predict_draws)
+    """
     
-    L = cov_exp(beta = beta_delta, l = lambda_delta, x1 = xf, x2 = x_star)
-    L = np.concatenate((L, np.zeros((m, n_star))))
+    xc = np.asarray(xc, dtype = float)
+    tc = np.empty((len(xc), 0)) if tc is None else np.asarray(tc, dtype = float).reshape(len(xc), -1)
+    xf = np.empty((0, xc.shape[1])) if xf is None else np.asarray(xf, dtype = float)
+    z = np.asarray(z, dtype = float)
+    n, p, q = len(xf), xc.shape[1], tc.shape[1]
+    fixed = {} if fixed is None else dict(fixed)
+    nugget = n == 0 if nugget is None else nugget
+    layout = _layout(n, p, q, nugget, fixed)
+    data = (xf, xc, tc, z)
     
-    M_delta = np.dot(L.T, sp.linalg.cho_solve((chol, low), L))
-    mu_delta_star = np.dot(L.T, K)
+    # Points de départ indépendants, optimisés en parallèle
+    rng = np.random.default_rng(seed)
+    tasks = [(_initial_point(layout, priors, rng), layout, fixed, data, priors, options) for _ in range(restarts)]
+    if num_processors == 1 or restarts == 1:
+        results = [_fit_restart(task) for task in tasks]
+    else:
+        with Pool(processes = min(num_processors or os.cpu_count(), restarts)) as pool:
+            results = pool.map(_fit_restart, tasks)
+            
+    theta, value, success = min(results, key = lambda result: result[1])
+    if not np.isfinite(value):
+        raise RuntimeError("All optimizations of the GP hyperparameters failed")
+    posterior = _unpack(theta, layout, fixed)[0]
     
-    sig_delta_star = cov_exp(beta = beta_delta, l = lambda_delta, x1 = x_star)
-    cov_delta_star = sig_delta_star
-
-    cov_delta_star -= M_delta
-
-    delta_star_std = np.random.multivariate_normal(mean = mu_delta_star, cov = cov_delta_star)
-
-    return delta_star_std
\ No newline at end of file
+    # Sans observations, tf n'est pas estimé : vide pour un émulateur des seules entrées xc
+    posterior.setdefault("tf", np.full(q, np.nan))
+    fit = {"posterior": posterior, "log_posterior": -float(value), "success": success,
+           "restarts": [-float(result[1]) for result in results]}
+    
+    if laplace:
+        
+        # Approximation gaussienne autour du mode dans l'espace non contraint
+        H = _hessian(theta, layout, fixed, data, priors)
+        eigval, eigvec = np.linalg.eigh(H)
+        eigval = np.maximum(eigval, 1e-8*np.max(np.abs(eigval)))
+        cov = np.dot(eigvec/eigval, eigvec.T)
+        
+        # Tirages dont la covariance de z n'admet pas de décomposition de Cholesky rejetés et retirés
+        draws = []
+        rejected = 0
+        for _ in range(20):
+            for sample in rng.multivariate_normal(theta, cov, size = n_draws-len(draws)):
+                draw = _unpack(sample, layout, {})[0]
+                if _positive_definite(dict(fixed, **draw), xf, xc, tc, z):
+                    draws.append(draw)
+                else:
+                    rejected += 1
+            if len(draws) == n_draws:
+                break
+        else:
+            raise RuntimeError(f"Only {len(draws)} of {n_draws} Laplace draws have a positive definite covariance")
+        fit["covariance"] = cov
+        fit["rejected"] = rejected
+        fit["draws"] = {name: np.stack([draw[name] for draw in draws]) for name, _ in layout}
+        for name, value in dict(fixed, tf = posterior["tf"]).items():
+            if name not in fit["draws"]:
+                fit["draws"][name] = np.repeat(np.asarray(value, dtype = float)[None], n_draws, axis = 0)
+    return fit
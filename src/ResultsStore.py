@@ -0,0 +1,271 @@
+import os
+import json
+import h5py
+import numpy as np
+import pandas as pd
+from time import time
+
+
+class ResultsStore:
+
+    """
+    Columnar store of the results of the campaigns (HDF5 file): for each campaign, the inputs and the outputs of
+    the runs in two tables, the metadata of the runs (duration, year, month, ...) and the sensitivity indices.
+    The tables are chunked by column and extended as the runs end, so that a few columns of a large campaign are
+    read without reading the others (see read).
+    """
+
+    # Number of rows of the chunks of the tables
+    CHUNK_ROWS = 16384
+
+    def __init__(self, store_file):
+
+        """
+        store_file: path of the *.h5 file, created at the first campaign
+        """
+
+        self.store_file = store_file
+        folder = os.path.dirname(os.path.abspath(store_file))
+        os.makedirs(folder, exist_ok = True)
+
+
+    def _open(self, mode = 'r'):
+        return h5py.File(self.store_file, mode)
+
+
+    def campaigns(self):
+
+        """
+        Names of the campaigns of the store
+        """
+
+        if not os.path.exists(self.store_file):
+            return []
+        with self._open() as store:
+            return list(store.keys())
+
+
+    def start(self, campaign, input_names, output_names, overwrite = False, **metadata):
+
+        """
+        Create a campaign (kept as it is if it exists, unless overwrite)
+        input_names, output_names: names of the columns of the inputs and of the outputs
+        metadata: settings of the campaign (JSON serializable), e.g. number of samples, weather files
+        """
+
+        with self._open('a') as store:
+            if campaign in store:
+                if not overwrite:
+                    return
+                del store[campaign]
+            group = store.create_group(campaign)
+            group.attrs['input_names'] = json.dumps(list(input_names))
+            group.attrs['output_names'] = json.dumps(list(output_names))
+            group.attrs['metadata'] = json.dumps(dict(metadata, created = time()), default = str)
+            for table, names in (('inputs', input_names), ('outputs', output_names)):
+                group.create_dataset(table, shape = (0, len(names)), maxshape = (None, len(names)), dtype = 'f8',
+                                     chunks = (self.CHUNK_ROWS, 1), fillvalue = np.nan)
+            group.create_group('runs')
+            group.create_group('indices')
+
+
+    def append(self, campaign, X, Y, **runs):
+
+        """
+        Append runs to a campaign
+        X, Y: inputs and outputs of the runs (one row per run)
+        runs: metadata of the runs, one value per run or one value for all (e.g. duration = durations, month = 3)
+        return: index of the first run appended
+        """
+
+        X = np.atleast_2d(np.asarray(X, dtype = float))
+        Y = np.asarray(Y, dtype = float).reshape(len(X), -1)
+        with self._open('a') as store:
+            group = store[campaign]
+            start = group['inputs'].shape[0]
+            for table, values in (('inputs', X), ('outputs', Y)):
+                dataset = group[table]
+                if values.shape[1] != dataset.shape[1]:
+                    raise ValueError("The campaign {} has {} {} columns, {} given".format(
+                                     campaign, dataset.shape[1], table, values.shape[1]))
+                dataset.resize(start + len(values), axis = 0)
+                dataset[start:] = values
+
+            # Metadata of the runs, the runs appended before a new column being filled with NaN or ''
+            for name, values in runs.items():
+                values = np.broadcast_to(np.asarray(values), (len(X),))
+                string = values.dtype.kind in 'OUS'
+                if name not in group['runs']:
+                    group['runs'].create_dataset(name, shape = (start,), maxshape = (None,),
+                                                 dtype = h5py.string_dtype() if string else 'f8',
+                                                 chunks = (self.CHUNK_ROWS,), fillvalue = '' if string else np.nan)
+                dataset = group['runs'][name]
+                dataset.resize(start + len(X), axis = 0)
+                dataset[start:] = values.astype(str).astype(object) if string else values.astype(float)
+        return start
+
+
+    def write_indices(self, campaign, Si, label = 'sobol'):
+
+        """
+        Save the indices of an analysis of the campaign (dictionary of arrays, e.g. returned by analyze),
+        replacing the indices of the same label
+        """
+
+        with self._open('a') as store:
+            indices = store[campaign]['indices']
+            if label in indices:
+                del indices[label]
+            group = indices.create_group(label)
+            for key, value in Si.items():
+                value = np.asarray(value)
+                if value.dtype.kind in 'fiu' and value.ndim > 0:
+                    group.create_dataset(key, data = value.astype(float))
+
+
+    def metadata(self, campaign):
+        with self._open() as store:
+            return json.loads(store[campaign].attrs['metadata'])
+
+
+    def update_metadata(self, campaign, **metadata):
+
+        """
+        Add settings to the metadata of a campaign, e.g. its duration once it is over
+        """
+
+        with self._open('a') as store:
+            group = store[campaign]
+            group.attrs['metadata'] = json.dumps(dict(json.loads(group.attrs['metadata']), **metadata), default = str)
+
+
+    def appender(self, campaign, rows = 256, interval = 30.0):
+
+        """
+        RunAppender of a campaign, appending its runs as they finish
+        """
+
+        return RunAppender(self, campaign, rows, interval)
+
+
+    def columns(self, campaign):
+
+        """
+        Names of the columns of a campaign: inputs, outputs and metadata of the runs
+        """
+
+        with self._open() as store:
+            group = store[campaign]
+            return (json.loads(group.attrs['input_names']) + json.loads(group.attrs['output_names'])
+                    + list(group['runs'].keys()))
+
+
+    def read(self, campaign, columns = None, rows = None):
+
+        """
+        Columns of the runs of a campaign, only the chunks of the requested columns and rows being read
+        columns: names of the columns (all by default, see columns)
+        rows: slice or array of indices of the runs (all by default)
+        return: data frame with one row per run
+        """
+
+        rows = slice(None) if rows is None else rows
+        with self._open() as store:
+            group = store[campaign]
+            tables = {'inputs': json.loads(group.attrs['input_names']),
+                      'outputs': json.loads(group.attrs['output_names'])}
+            if columns is None:
+                columns = tables['inputs'] + tables['outputs'] + list(group['runs'].keys())
+            columns = list(columns)
+
+            data = {}
+            for name in columns:
+                if name in group['runs']:
+                    dataset = group['runs'][name]
+                    data[name] = dataset.asstr()[rows] if h5py.check_string_dtype(dataset.dtype) else dataset[rows]
+                    continue
+                for table, names in tables.items():
+                    if name in names:
+                        data[name] = group[table][rows, names.index(name)]
+                        break
+                else:
+                    raise KeyError("No column {} in the campaign {}".format(name, campaign))
+        return pd.DataFrame(data, columns = columns)
+
+
+    def indices(self, campaign, label = 'sobol'):
+
+        """
+        Indices of an analysis of the campaign, as returned by to_df of SALib: total, first and second order
+        data frames (the second one when the analysis has second order indices)
+        """
+
+        with self._open() as store:
+            group = store[campaign]['indices'][label]
+            Si = {key: group[key][()] for key in group}
+            names = json.loads(store[campaign].attrs['input_names'])
+
+        total = pd.DataFrame({'ST': Si['ST'], 'ST_conf': Si['ST_conf']}, index = names)
+        first = pd.DataFrame({'S1': Si['S1'], 'S1_conf': Si['S1_conf']}, index = names)
+        if 'S2' not in Si:
+            return total, first
+        pairs = [(j, k) for j in range(len(names)) for k in range(j+1, len(names))]
+        second = pd.DataFrame({'S2': [Si['S2'][j, k] for j, k in pairs], 'S2_conf': [Si['S2_conf'][j, k] for j, k in pairs]},
+                              index = [(names[j], names[k]) for j, k in pairs])
+        return total, first, second
+
+
+class RunAppender:
+
+    """
+    Buffer of the runs of a campaign appended to a ResultsStore as they finish, by groups of runs so that the file
+    is not opened for every run. The buffer is written every rows runs or interval seconds, and at the end of a
+    with block even when the campaign is interrupted, so that the runs done are kept in the store.
+    """
+
+    def __init__(self, store, campaign, rows = 256, interval = 30.0):
+
+        """
+        rows: number of runs written at once
+        interval: seconds after which the runs of the buffer are written, however many they are
+        """
+
+        self.store = store
+        self.campaign = campaign
+        self.rows = rows
+        self.interval = interval
+        self.buffer = []
+        self.last_write = time()
+
+
+    def add(self, x, y, **runs):
+
+        """
+        Add a run: its inputs x, its outputs y and its metadata (e.g. sample = i)
+        """
+
+        self.buffer.append((x, y, runs))
+        if len(self.buffer) >= self.rows or time() - self.last_write >= self.interval:
+            self.flush()
+
+
+    def flush(self):
+
+        """
+        Append the runs of the buffer to the store
+        """
+
+        if self.buffer:
+            X, Y, runs = zip(*self.buffer)
+            self.store.append(self.campaign, np.array(X), np.array(Y), **{name: [run[name] for run in runs]
+                                                                          for name in runs[0]})
+            self.buffer = []
+        self.last_write = time()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc):
+        self.flush()
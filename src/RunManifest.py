@@ -0,0 +1,189 @@
+import os
+import csv
+import json
+import hashlib
+import numpy as np
+from time import time
+
+
+def campaign_key(param_names, X, *settings):
+
+    """
+    Key of a campaign: hash of the names of the parameters, of the sample X and of the settings of the runs
+    (e.g. template and weather files, EnergyPlus version, requested outputs)
+    """
+
+    digest = hashlib.sha256()
+    digest.update(repr(list(param_names)).encode('utf-8'))
+    digest.update(np.ascontiguousarray(X, dtype = float).tobytes())
+    for setting in settings:
+        digest.update(repr(setting.tolist() if isinstance(setting, np.ndarray) else setting).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class RunManifest:
+
+    """
+    Persistent append-only manifest of a simulation campaign (JSON Lines file): one line per attempt of a sample
+    with its status, output(s), duration and error, written and synced to the disk as soon as the run ends, so that
+    a crash or a reboot loses at most the runs in progress and the campaign can be resumed from the manifest
+    """
+
+    def __init__(self, manifest_file):
+
+        """
+        manifest_file: path of the *.jsonl manifest, created at the first record and read again when it exists
+        """
+
+        self.manifest_file = manifest_file
+        self.campaign = None
+
+        # Whether the last line of the file was cut by a crash, the next record then starting on a new line
+        self.cut = False
+
+        # Last record and number of attempts of each sample, by index of the sample
+        self.records = {}
+        self.attempts = {}
+        self.load()
+
+
+    def load(self):
+
+        """
+        Read the records of the manifest, the last line being skipped if it was cut by a crash (the next record
+        being then written on a line of its own)
+        """
+
+        if not os.path.exists(self.manifest_file):
+            return
+        with open(self.manifest_file, 'r', encoding = 'utf-8') as manifest:
+            for line in manifest:
+                self.cut = not line.endswith('\n')
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if 'campaign' in record:
+                    self.campaign = record['campaign']
+                else:
+                    self._add(record)
+
+
+    def _add(self, record):
+        self.records[record['sample']] = record
+        self.attempts[record['sample']] = record['attempt']
+
+
+    def _append(self, record):
+        with open(self.manifest_file, 'a', encoding = 'utf-8') as manifest:
+            manifest.write(('\n' if self.cut else '') + json.dumps(record) + '\n')
+            manifest.flush()
+            os.fsync(manifest.fileno())
+        self.cut = False
+
+
+    def start(self, campaign):
+
+        """
+        Attach the manifest to a campaign (see campaign_key), a manifest holding the records of a single campaign
+        """
+
+        if self.campaign is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.manifest_file)), exist_ok = True)
+            self._append({'campaign': campaign, 'time': time()})
+            self.campaign = campaign
+        elif self.campaign != campaign:
+            raise ValueError("The manifest {} records another campaign (other sample or settings)".format(self.manifest_file))
+
+
+    def record(self, i, status, Y = None, duration = None, error = None, lengths = None):
+
+        """
+        Record an attempt of the sample i: status 'done' with its output(s) or 'failed' with its error
+        lengths: lengths of the series of a SeriesReader, needed to split the outputs of a resumed campaign
+        """
+
+        record = {'sample': int(i), 'status': status, 'attempt': self.attempts.get(int(i), 0) + 1,
+                  'time': time(), 'duration': duration}
+        if Y is not None:
+            record['Y'] = np.asarray(Y, dtype = float).ravel().tolist()
+        if error is not None:
+            record['error'] = error
+        if lengths is not None:
+            record['lengths'] = [int(length) for length in lengths]
+        self._append(record)
+        self._add(record)
+
+
+    def done(self):
+
+        """
+        Output(s) of the samples done, by index of the sample
+        """
+
+        return {i: np.array(record['Y']) for i, record in self.records.items() if record['status'] == 'done'}
+
+
+    def failed(self):
+
+        """
+        Indices of the samples whose last attempt failed
+        """
+
+        return sorted(i for i, record in self.records.items() if record['status'] == 'failed')
+
+
+    def lengths(self):
+
+        """
+        Lengths of the series recorded with the outputs, None if there is none
+        """
+
+        for record in self.records.values():
+            if 'lengths' in record:
+                return record['lengths']
+        return None
+
+
+    def outputs(self, sample_size):
+
+        """
+        Array of the outputs of the campaign (one row per sample), NaN for the samples not done yet
+        """
+
+        done = self.done()
+        width = max((len(Y_i) for Y_i in done.values()), default = 1)
+        Y = np.full((sample_size, width), np.nan)
+        for i, Y_i in done.items():
+            Y[i] = Y_i
+        return Y
+
+
+    def export(self, csv_file, sample_size):
+
+        """
+        Write the partial results of the campaign in a *.csv file: status, number of attempts, duration of the
+        last attempt and output(s) of each sample (empty for the samples not done yet)
+        """
+
+        Y = self.outputs(sample_size)
+        with open(csv_file, 'w', newline = '') as file:
+            writer = csv.writer(file)
+            writer.writerow(['sample', 'status', 'attempts', 'duration'] + ['Y{}'.format(k) for k in range(Y.shape[1])])
+            for i in range(sample_size):
+                record = self.records.get(i, {})
+                outputs = Y[i].tolist() if record.get('status') == 'done' else [''] * Y.shape[1]
+                writer.writerow([i, record.get('status', 'missing'), self.attempts.get(i, 0),
+                                 record.get('duration', '')] + outputs)
+
+
+    def report(self, sample_size):
+
+        """
+        Print the progress of the campaign
+        """
+
+        done = len(self.done())
+        failed = len(self.failed())
+        print("{} samples done, {} failed and {} not run yet out of {} ({}).".format(
+              done, failed, sample_size - done - failed, sample_size, self.manifest_file))
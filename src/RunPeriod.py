@@ -0,0 +1,170 @@
+import re
+import calendar
+import numpy as np
+from datetime import date, timedelta
+
+
+def object_pattern(name):
+    # First line of the IDF objects of a class, commented objects excluded
+    return re.compile(r'^[ \t]*{}[ \t]*,'.format(re.escape(name)), re.IGNORECASE | re.MULTILINE)
+
+
+def find_objects(content, name):
+
+    """
+    IDF objects of a class in the content of an *.idf file
+    return: list of (start, end, fields) of the objects, fields without their comments
+    """
+
+    objects = []
+    for match in object_pattern(name).finditer(content):
+        fields = []
+        field = []
+        k = match.end()
+        while True:
+            if k >= len(content):
+                raise ValueError("The {} object at character {} is not terminated by ';'".format(name, match.start()))
+            char = content[k]
+            if char == '!':
+                newline = content.find('\n', k)
+                k = len(content) if newline < 0 else newline
+                continue
+            if char in ',;':
+                fields.append(''.join(field).strip())
+                field = []
+                if char == ';':
+                    break
+            else:
+                field.append(char)
+            k += 1
+        objects.append((match.start(), k + 1, fields))
+    return objects
+
+
+def format_object(name, fields):
+    return '{},\n'.format(name) + ',\n'.join('    ' + field for field in fields) + ';'
+
+
+def set_fields(content, name, update):
+
+    """
+    Replace the single object of a class by the object whose fields are update(fields)
+    """
+
+    objects = find_objects(content, name)
+    if len(objects) != 1:
+        raise ValueError("The *.idf file must contain one {} object, {} found".format(name, len(objects)))
+    start, end, fields = objects[0]
+    return content[:start] + format_object(name, update(list(fields))) + content[end:]
+
+
+class RunPeriodSlicer:
+
+    """
+    Restrict the RunPeriod of the rendered *.idf files to one month of the weather file, preceded by a lead-in of a
+    few simulated days so that the thermal mass of the building is in the state it would have in an annual run.
+    The lead-in days are reported like the days of the month: the monthly values of the month (summary report rows,
+    monthly series) are the ones of the month, while the daily and hourly series start with the lead-in.
+    """
+
+    def __init__(self, month, year, lead_in = 7, warmup_days = None):
+
+        """
+        month: month simulated (1 to 12)
+        year: year of the weather file, setting the days of the week and the length of February
+        lead_in: number of days simulated before the month (cut at the 1st of January)
+        warmup_days: minimum number of warm-up days of the Building object (left unchanged by default)
+        """
+
+        self.month = month
+        self.year = year
+        self.lead_in = lead_in
+        self.warmup_days = warmup_days
+
+
+    def __repr__(self):
+        # Also used in the keys of the SimulationCache through the rendered *.idf files
+        return 'RunPeriodSlicer(month={}, year={}, lead_in={}, warmup_days={})'.format(
+               self.month, self.year, self.lead_in, self.warmup_days)
+
+
+    def period(self):
+
+        """
+        First and last days simulated
+        """
+
+        first = date(self.year, self.month, 1)
+        begin = max(first - timedelta(days = self.lead_in), date(self.year, 1, 1))
+        end = date(self.year, self.month, calendar.monthrange(self.year, self.month)[1])
+        return begin, end
+
+
+    def lead_in_days(self):
+
+        """
+        Number of lead-in days actually simulated before the month
+        """
+
+        begin, end = self.period()
+        return (date(self.year, self.month, 1) - begin).days
+
+
+    def _run_period(self, fields):
+        begin, end = self.period()
+        fields += [''] * (8 - len(fields))
+
+        # Begin Month, Begin Day, Begin Year, End Month, End Day, End Year, the day of the week of the first
+        # day being given by the year
+        fields[1:7] = [str(begin.month), str(begin.day), str(begin.year), str(end.month), str(end.day), str(end.year)]
+        fields[7] = ''
+        return fields
+
+
+    def _building(self, fields):
+        fields += [''] * (8 - len(fields))
+
+        # Minimum Number of Warmup Days, the maximum being raised to it if needed
+        fields[7] = str(self.warmup_days)
+        try:
+            if fields[6] and int(float(fields[6])) < self.warmup_days:
+                fields[6] = str(self.warmup_days)
+        except ValueError:
+            pass
+        return fields
+
+
+    def prepare(self, content):
+
+        """
+        Set the RunPeriod (and the warm-up days of the Building) of the content of an *.idf file
+        """
+
+        content = set_fields(content, 'RunPeriod', self._run_period)
+        if self.warmup_days is not None:
+            content = set_fields(content, 'Building', self._building)
+        return content
+
+
+def compare_outputs(Y_full, Y_sliced, duration_full = None, duration_sliced = None):
+
+    """
+    Accuracy of sliced runs against full-year runs of the same samples (one row per sample, same outputs)
+    return: dictionary of the absolute and relative errors (maximum and mean over the samples, by output)
+            and of the speedup of the sliced runs when their durations are given
+    """
+
+    Y_full = np.asarray(Y_full, dtype = float)
+    Y_sliced = np.asarray(Y_sliced, dtype = float)
+    if Y_full.shape != Y_sliced.shape:
+        raise ValueError("The full-year and sliced outputs have different shapes, {} and {}".format(Y_full.shape, Y_sliced.shape))
+
+    error = np.abs(Y_sliced - Y_full)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        relative = np.where(Y_full != 0, error/np.abs(Y_full), np.where(error == 0, 0.0, np.inf))
+
+    report = {'max_abs_error': error.max(axis = 0), 'mean_abs_error': error.mean(axis = 0),
+              'max_rel_error': relative.max(axis = 0), 'mean_rel_error': relative.mean(axis = 0)}
+    if duration_full is not None and duration_sliced:
+        report['speedup'] = duration_full/duration_sliced
+    return report
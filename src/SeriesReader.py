@@ -0,0 +1,259 @@
+import os
+import re
+import sqlite3
+import numpy as np
+from pathlib import Path
+from abc import ABC, abstractmethod
+
+
+# Reporting frequencies of the IDF Output:Variable / Output:Meter objects, with their names in the SQLite and
+# ESO outputs (spaces removed, lower case)
+FREQUENCIES = {'detailed': 'Detailed', 'hvacsystemtimestep': 'Detailed', 'eachcall': 'Detailed',
+               'timestep': 'Timestep', 'zonetimestep': 'Timestep',
+               'hourly': 'Hourly', 'daily': 'Daily', 'monthly': 'Monthly',
+               'runperiod': 'RunPeriod', 'environment': 'RunPeriod', 'annual': 'Annual'}
+
+# EnvironmentType of the weather file run periods in the EnvironmentPeriods table of the SQLite output
+RUN_PERIOD = 3
+
+# Output:Variable and Output:Meter objects already declared in an IDF file (comments removed)
+OUTPUT_OBJECT = re.compile(r'Output:(Variable|Meter)\s*,([^;]*);', re.IGNORECASE)
+COMMENT = re.compile(r'!.*')
+SQLITE_OBJECT = re.compile(r'^\s*Output:SQLite\s*,', re.IGNORECASE | re.MULTILINE)
+
+
+def frequency(name):
+
+    """
+    Reporting frequency of an IDF object, an SQLite dictionary or an ESO header, as named in the IDF objects
+    """
+
+    name = name.split('[')[0].replace(' ', '').lower()
+    if name not in FREQUENCIES:
+        raise ValueError('Unknown reporting frequency "{}"'.format(name))
+    return FREQUENCIES[name]
+
+
+class SeriesReader(ABC):
+
+    """
+    Reader of time series (meters and output variables) of the EnergyPlus runs: the requested series of a run
+    are returned as one flat numpy array (series after series), like the summary report cells of read_summary_report
+    """
+
+    def __init__(self, series):
+
+        """
+        series: list of (meter, frequency) for meters and of (key, variable, frequency) for output variables,
+                as in the Output:Meter and Output:Variable objects, e.g. ('Electricity:Facility', 'Monthly') or
+                ('ZONE 1', 'Zone Mean Air Temperature', 'Hourly'); key '*' concatenates all the keys of a variable
+        """
+
+        self.series = []
+        for serie in series:
+            if len(serie) == 2:
+                self.series.append(('', serie[0], frequency(serie[1])))
+            elif len(serie) == 3:
+                self.series.append((serie[0], serie[1], frequency(serie[2])))
+            else:
+                raise ValueError('A series is (meter, frequency) or (key, variable, frequency), got {}'.format(serie))
+
+        # Number of values of each series in the runs, known once a first run has been read
+        self.lengths = None
+
+
+    def __repr__(self):
+        # Also used in the keys of the SimulationCache
+        return '{}({})'.format(type(self).__name__, self.series)
+
+
+    def labels(self):
+
+        """
+        Label of each series, as the fields of its IDF object
+        """
+
+        return [','.join(serie[1:] if serie[0] == '' else serie) for serie in self.series]
+
+
+    def prepare(self, content):
+
+        """
+        Add to the content of an *.idf file the output objects needed to read the series, if not already declared
+        """
+
+        declared = set()
+        for kind, fields in OUTPUT_OBJECT.findall(COMMENT.sub('', content)):
+            fields = [field.strip().lower() for field in fields.split(',')]
+            if kind.lower() == 'meter' and len(fields) >= 2:
+                declared.add(('', fields[0], fields[1]))
+            elif kind.lower() == 'variable' and len(fields) >= 3:
+                declared.add((fields[0], fields[1], fields[2]))
+
+        objects = []
+        for key, name, freq in self.series:
+            if (key.lower(), name.lower(), freq.lower()) in declared:
+                continue
+            if key == '':
+                objects.append('Output:Meter,\n    {},\n    {};\n'.format(name, freq))
+            else:
+                objects.append('Output:Variable,\n    {},\n    {},\n    {};\n'.format(key, name, freq))
+        return content + ''.join('\n' + obj for obj in objects)
+
+
+    def read(self, output_prefix):
+
+        """
+        Values of the requested series of a run, as one flat numpy array
+        output_prefix: path of the outputs of the run without extension (e.g. eval_folder/run-{i})
+        """
+
+        values = self.read_series(output_prefix)
+        self.lengths = [len(value) for value in values]
+        return np.concatenate(values) if values else np.zeros(0)
+
+
+    def split(self, Y):
+
+        """
+        Dictionary label -> array (one row per run) of the series from the flat outputs Y of several runs
+        """
+
+        Y = np.atleast_2d(Y)
+        if self.lengths is None and len(self.series) == 1:
+            self.lengths = [Y.shape[1]]
+        if self.lengths is None:
+            raise ValueError('The lengths of the series are only known once a run has been read')
+        bounds = np.cumsum([0] + self.lengths)
+        return {label: Y[:, bounds[k]:bounds[k+1]] for k, label in enumerate(self.labels())}
+
+
+    def consolidate(self, Y, output_file, index = None):
+
+        """
+        Save the series of several runs in a single columnar *.npz file: one array (runs x time steps) per series
+        index: identifier of each run (e.g. its sample index), saved under the name 'index'
+        """
+
+        arrays = self.split(Y)
+        if index is not None:
+            arrays['index'] = np.asarray(index)
+        tmp_file = output_file + '.{}.tmp'.format(os.getpid())
+        with open(tmp_file, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(tmp_file, output_file)
+
+
+    def _match(self, dictionary):
+
+        # Identifiers of each series in a dictionary of (identifier, key, name, frequency) of the outputs
+        ids = []
+        for key, name, freq in self.series:
+            found = [k for k, k_key, k_name, k_freq in dictionary
+                     if k_name.lower() == name.lower() and k_freq == freq and
+                     (key == '*' or k_key.lower() == key.lower())]
+            if not found:
+                raise KeyError('No output {} at {} frequency in the run'.format(','.join(filter(None, (key, name))), freq))
+            ids.append(found)
+        return ids
+
+
+    @abstractmethod
+    def read_series(self, output_prefix):
+
+        """
+        Requested series of a run as a list of arrays, in the order of the series (see SQLiteReader, ESOReader)
+        """
+
+
+class SQLiteReader(SeriesReader):
+
+    """
+    Reader of the series in the SQLite output of the runs (output_prefix.sql), an Output:SQLite object being
+    added to the *.idf files by prepare. All the values of a run are read with one query.
+    """
+
+    def prepare(self, content):
+        content = super().prepare(content)
+        if SQLITE_OBJECT.search(COMMENT.sub('', content)) is None:
+            content += '\nOutput:SQLite,\n    Simple;\n'
+        return content
+
+
+    def read_series(self, output_prefix):
+
+        connection = sqlite3.connect(Path(os.path.abspath(output_prefix + '.sql')).as_uri() + '?mode=ro', uri = True)
+        try:
+            dictionary = [(index, key or '', name, frequency(freq)) for index, key, name, freq in connection.execute(
+                'SELECT ReportDataDictionaryIndex, KeyValue, Name, ReportingFrequency FROM ReportDataDictionary')]
+            ids = self._match(dictionary)
+            wanted = sorted(set(k for found in ids for k in found))
+
+            # Values of the weather file run period(s) only, without warm-up days and design days
+            rows = connection.execute(
+                'SELECT ReportData.ReportDataDictionaryIndex, ReportData.Value FROM ReportData '
+                'JOIN Time ON Time.TimeIndex = ReportData.TimeIndex '
+                'JOIN EnvironmentPeriods ON EnvironmentPeriods.EnvironmentPeriodIndex = Time.EnvironmentPeriodIndex '
+                'WHERE ReportData.ReportDataDictionaryIndex IN ({}) AND EnvironmentPeriods.EnvironmentType = ? '
+                'AND (Time.WarmupFlag IS NULL OR Time.WarmupFlag = 0) '
+                'ORDER BY ReportData.ReportDataDictionaryIndex, ReportData.TimeIndex'.format(','.join('?'*len(wanted))),
+                wanted + [RUN_PERIOD]).fetchall()
+        finally:
+            connection.close()
+
+        data = np.array(rows, dtype = float).reshape(-1, 2)
+        return [np.concatenate([data[data[:, 0] == k, 1] for k in found]) for found in ids]
+
+
+class ESOReader(SeriesReader):
+
+    """
+    Reader of the series in the ESO output of the runs (output_prefix.eso), for runs without SQLite output.
+    The values of one environment are kept, the last one (the weather file run period) by default.
+    """
+
+    def __init__(self, series, environment = -1):
+
+        """
+        environment: index or name of the environment (design days then run periods) whose values are read
+        """
+
+        super().__init__(series)
+        self.environment = environment
+
+
+    def read_series(self, output_prefix):
+
+        with open(output_prefix + '.eso', 'r', errors = 'replace') as eso:
+            lines = eso.read().splitlines()
+
+        # Data dictionary: "id,number of values,key,name [units] !frequency" ("id,number of values,name [units] !frequency"
+        # for meters), the identifiers 1 to 6 being the environment and time stamp lines
+        dictionary = []
+        k = 0
+        while k < len(lines) and not lines[k].startswith('End of Data Dictionary'):
+            fields = lines[k].split(',')
+            if len(fields) > 2 and fields[0].isdigit() and int(fields[0]) > 6 and '!' in lines[k]:
+                description, freq = lines[k].split('!', 1)
+                fields = description.split(',')
+                key = fields[2] if len(fields) > 3 else ''
+                dictionary.append((fields[0], key.strip(), fields[-1].split('[')[0].strip(), frequency(freq.split()[0])))
+            k += 1
+        ids = self._match(dictionary)
+        wanted = set(k for found in ids for k in found)
+
+        # First value of the wanted lines, environment by environment
+        environments = []
+        for line in lines[k+1:]:
+            head, _, tail = line.partition(',')
+            if head == '1':
+                environments.append((tail.split(',')[0].strip(), {k: [] for k in wanted}))
+            elif head in wanted and environments:
+                environments[-1][1][head].append(float(tail.split(',')[0]))
+
+        if isinstance(self.environment, str):
+            names = [name.lower() for name, values in environments]
+            values = environments[names.index(self.environment.lower())][1]
+        else:
+            values = environments[self.environment][1]
+        return [np.concatenate([np.array(values[k], dtype = float) for k in found]) for found in ids]
@@ -0,0 +1,174 @@
+import os
+import hashlib
+import numpy as np
+
+
+class SimulationCache:
+
+    """
+    Persistent on-disk cache of extracted EnergyPlus outputs, addressed by the content of the simulation:
+    hash of the rendered IDF, of the EPW file, of the EnergyPlus version and executable and of the requested outputs
+    """
+
+    def __init__(self, cache_folder, max_size = None, max_entries = None):
+
+        """
+        cache_folder: folder that contains the cached outputs (shared between campaigns)
+        max_size: maximum size of the cache in bytes, the least recently used entries being evicted beyond
+        max_entries: maximum number of entries of the cache
+        """
+
+        self.cache_folder = cache_folder
+        self.max_size = max_size
+        self.max_entries = max_entries
+        os.makedirs(self.cache_folder, exist_ok = True)
+
+        # Hashes of the weather files already read, by (path, size, modification time)
+        self.file_hashes = {}
+
+        # Current size and number of entries of the cache, updated at each insertion
+        entries = self._entries()
+        self.size = sum(entry[2] for entry in entries)
+        self.count = len(entries)
+        self.hits = 0
+        self.misses = 0
+
+
+    def file_hash(self, path):
+
+        """
+        Hash of the content of a file (weather file), computed once per version of the file
+        """
+
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+        if key not in self.file_hashes:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for block in iter(lambda: file.read(1 << 20), b''):
+                    digest.update(block)
+            self.file_hashes[key] = digest.hexdigest()
+        return self.file_hashes[key]
+
+
+    def key(self, idf_content, epw_file, ep_version, outputs, energyplus = None):
+
+        """
+        Key of a simulation: hash of the rendered IDF content, of the EPW file, of the EnergyPlus version,
+        of the requested outputs (e.g. outputs indices in the summary report) and of the path of the EnergyPlus
+        executable launched directly (None for the run of eppy), so that the runs of a stub or of another
+        installation are kept apart
+        """
+
+        digest = hashlib.sha256()
+        digest.update(idf_content.encode('utf-8') if isinstance(idf_content, str) else idf_content)
+        digest.update(self.file_hash(epw_file).encode('utf-8'))
+        digest.update(str(ep_version).encode('utf-8'))
+        digest.update(('eppy' if energyplus is None else os.path.abspath(energyplus)).encode('utf-8'))
+        digest.update(repr(outputs.tolist() if isinstance(outputs, np.ndarray) else outputs).encode('utf-8'))
+        return digest.hexdigest()
+
+
+    def _path(self, key):
+        return os.path.join(self.cache_folder, key[:2], key + '.npy')
+
+
+    def get(self, key):
+
+        """
+        Return the cached outputs of a simulation or None if they are not in the cache
+        """
+
+        path = self._path(key)
+        try:
+            Y = np.load(path)
+        except (FileNotFoundError, ValueError, OSError):
+            self.misses += 1
+            return None
+
+        # The modification time of an entry records its last use for the LRU eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return Y
+
+
+    def put(self, key, Y):
+
+        """
+        Store the outputs of a simulation, then evict the least recently used entries if needed
+        """
+
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        # Size of the entry replaced, if any, so that an overwritten key is counted once
+        try:
+            previous = os.path.getsize(path)
+        except OSError:
+            previous = None
+
+        # Writing in a temporary file then renaming it so that concurrent readers never see a partial entry
+        tmp_path = path + '.{}.tmp'.format(os.getpid())
+        with open(tmp_path, 'wb') as file:
+            np.save(file, np.asarray(Y, dtype = float))
+        os.replace(tmp_path, path)
+
+        self.size += os.path.getsize(path) - (previous or 0)
+        if previous is None:
+            self.count += 1
+        self.evict()
+
+
+    def _entries(self):
+
+        # List of (last use, path, size) of all the entries of the cache
+        entries = []
+        for folder in os.scandir(self.cache_folder):
+            if not folder.is_dir():
+                continue
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith('.npy'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+
+    def evict(self):
+
+        """
+        Remove the least recently used entries until the size and number of entries limits are respected
+        """
+
+        too_big = self.max_size is not None and self.size > self.max_size
+        too_many = self.max_entries is not None and self.count > self.max_entries
+        if not (too_big or too_many):
+            return
+
+        entries = sorted(self._entries())
+        self.size = sum(entry[2] for entry in entries)
+        self.count = len(entries)
+        for mtime, path, size in entries:
+            if (self.max_size is None or self.size <= self.max_size) and \
+               (self.max_entries is None or self.count <= self.max_entries):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
+            self.count -= 1
+
+
+    def clear(self):
+
+        """
+        Remove all the entries of the cache
+        """
+
+        for mtime, path, size in self._entries():
+            os.remove(path)
+        self.size = 0
+        self.count = 0
@@ -0,0 +1,200 @@
+import numpy as np
+import scipy as sp
+from types import MethodType
+from scipy.stats import qmc, norm
+from SALib.util import ResultDict
+from SALib.analyze.sobol import to_df
+from Predictions import cov_exp, cholesky_jitter, fit_map
+
+
+def sobol_estimates(Y, D, calc_second_order = True):
+
+    """
+    First order (Saltelli 2010), total (Jansen) and second order Sobol indices of the outputs Y of a Saltelli design
+    (same estimators as SALib.analyze.sobol), computed at once for all the columns of Y (e.g. GP realizations)
+    Y: outputs of the design, one row per sample of the design, optionally one column per realization
+    return: dictionary of S1 and ST (D, ...) and of S2 (D, D, ...) with NaN under its diagonal
+    """
+
+    Y = np.asarray(Y, dtype = float)
+    step = 2*D + 2 if calc_second_order else D + 2
+    Y = Y.reshape((len(Y)//step, step) + Y.shape[1:])
+    A, B = Y[:, 0], Y[:, -1]
+    AB = Y[:, 1:D+1]
+    var = np.var(np.concatenate([A, B]), axis = 0)
+
+    S1 = np.mean(B[:, None]*(AB - A[:, None]), axis = 0)/var
+    ST = 0.5*np.mean((A[:, None] - AB)**2, axis = 0)/var
+    Si = {'S1': S1, 'ST': ST}
+
+    if calc_second_order:
+        BA = Y[:, D+1:2*D+1]
+        S2 = np.full((D, D) + Y.shape[2:], np.nan)
+        for j in range(D):
+            for k in range(j+1, D):
+                Vjk = np.mean(BA[:, j]*AB[:, k] - A*B, axis = 0)/var
+                S2[j, k] = Vjk - S1[j] - S1[k]
+        Si['S2'] = S2
+    return Si
+
+
+class GPSurrogate:
+
+    """
+    Gaussian process emulator of a scalar output of the energy model, with the squared exponential covariance of
+    Predictions (cov_exp) and its hyperparameters fitted by fit_map on the inputs scaled to [0, 1] and the
+    standardized outputs (emulator only, with a nugget)
+    """
+
+    def __init__(self, X, y, lower, upper, restarts = 8, num_processors = None, seed = None):
+
+        """
+        X, y: inputs (one row per simulation) and outputs of the simulations
+        lower, upper: bounds of the inputs scaled to [0, 1]
+        """
+
+        self.lower = np.asarray(lower, dtype = float)
+        self.upper = np.asarray(upper, dtype = float)
+        self.X = self.unit(X)
+        y = np.asarray(y, dtype = float).ravel()
+        self.mean = y.mean()
+        self.scale = y.std() if y.std() > 0 else 1.0
+        self.z = (y - self.mean)/self.scale
+
+        fit = fit_map(None, self.X, None, self.z, restarts = restarts,
+                      num_processors = num_processors, seed = seed)
+        self.posterior = fit['posterior']
+        self.beta = self.posterior['beta_eta']
+        self.lambda_eta = self.posterior['lambda_eta']
+        self.lambda_sim = self.posterior.get('lambda_sim', np.inf)
+
+        # Covariance of the simulations, its Cholesky factor and sig_z^-1 z computed once
+        self.chol = sp.linalg.cho_factor(self._cov(self.X), lower = True)
+        self.alpha = sp.linalg.cho_solve(self.chol, self.z)
+
+
+    def unit(self, X):
+        return (np.asarray(X, dtype = float) - self.lower)/(self.upper - self.lower)
+
+
+    def _cov(self, X):
+        return cov_exp(beta = self.beta, l = self.lambda_eta, x1 = X) + np.eye(len(X))/self.lambda_sim
+
+
+    def _cross(self, X_unit):
+        return cov_exp(beta = self.beta, l = self.lambda_eta, x1 = self.X, x2 = X_unit)
+
+
+    def covariance(self, X1, X2):
+
+        """
+        Posterior covariance of the emulator between the points X1 and X2 (standardized output)
+        """
+
+        X1_unit, X2_unit = self.unit(X1), self.unit(X2)
+        return (cov_exp(beta = self.beta, l = self.lambda_eta, x1 = X1_unit, x2 = X2_unit)
+                - np.dot(self._cross(X1_unit).T, sp.linalg.cho_solve(self.chol, self._cross(X2_unit))))
+
+
+    def cross_validation(self):
+
+        """
+        Leave-one-out cross-validation of the emulator, in closed form from the inverse of the covariance
+        return: dictionary of the LOO residuals and standard deviations (output units), of the RMSE relative to
+                the standard deviation of the outputs and of the Q2 coefficient
+        """
+
+        inverse = sp.linalg.cho_solve(self.chol, np.eye(len(self.X)))
+        diag = np.diag(inverse)
+        residuals = self.alpha/diag
+        return {'residuals': residuals*self.scale, 'std': np.sqrt(1/diag)*self.scale,
+                'rmse': np.sqrt(np.mean(residuals**2)), 'q2': 1 - np.sum(residuals**2)/np.sum((self.z - self.z.mean())**2)}
+
+
+    def predict(self, X, chunk_size = 10000):
+
+        """
+        Posterior mean and variance of the emulator at the points X (output units), by chunks of points
+        """
+
+        X_unit = self.unit(X)
+        mean = np.empty(len(X_unit))
+        var = np.empty(len(X_unit))
+        for start in range(0, len(X_unit), chunk_size):
+            L = self._cross(X_unit[start:start+chunk_size])
+            mean[start:start+chunk_size] = np.dot(L.T, self.alpha)
+            var[start:start+chunk_size] = 1/self.lambda_eta - np.einsum('ij,ij->j', L, sp.linalg.cho_solve(self.chol, L))
+        return mean*self.scale + self.mean, np.maximum(var, 0)*self.scale**2
+
+
+    def realizations(self, X, size, aux_size = 200, rng = None, chunk_size = 10000):
+
+        """
+        Approximate realizations of the emulator at many points X (output units, one column per realization):
+        the emulator is drawn jointly at aux_size space-filling points, then each realization is the posterior mean
+        given the simulations and its draws at these points (conditional simulation by pseudo-data)
+        """
+
+        rng = np.random.default_rng(rng)
+        U = qmc.LatinHypercube(d = self.X.shape[1], seed = rng).random(aux_size)
+
+        # Joint draws at the auxiliary points, conditionally on the simulations
+        L = self._cross(U)
+        mean = np.dot(L.T, self.alpha)
+        cov = cov_exp(beta = self.beta, l = self.lambda_eta, x1 = U) - np.dot(L.T, sp.linalg.cho_solve(self.chol, L))
+        draws = mean[:, None] + np.dot(cholesky_jitter(cov), rng.standard_normal((aux_size, size)))
+
+        # Posterior means given the simulations and the pseudo-data of each realization, one factorization for all
+        X_aug = np.concatenate([self.X, U])
+        z_aug = np.concatenate([np.repeat(self.z[:, None], size, axis = 1), draws])
+        cov_aug = cov_exp(beta = self.beta, l = self.lambda_eta, x1 = X_aug)
+        cov_aug[:len(self.X), :len(self.X)] += np.eye(len(self.X))/self.lambda_sim
+        alpha = sp.linalg.cho_solve((cholesky_jitter(cov_aug), True), z_aug)
+
+        X_unit = self.unit(X)
+        Y = np.empty((len(X_unit), size))
+        for start in range(0, len(X_unit), chunk_size):
+            cross = cov_exp(beta = self.beta, l = self.lambda_eta, x1 = X_aug, x2 = X_unit[start:start+chunk_size])
+            Y[start:start+chunk_size] = np.dot(cross.T, alpha)
+        return Y*self.scale + self.mean
+
+
+def surrogate_sobol(problem, surrogate, X, calc_second_order = True, realizations = 50, num_resamples = 100,
+                    conf_level = 0.95, seed = None):
+
+    """
+    Sobol indices of the emulator from its predictions at the points of a large Saltelli design X (sample of
+    SALib.sample.sobol): indices of the posterior mean, with confidence intervals combining the Monte Carlo error
+    (bootstrap over the base samples) and the uncertainty of the emulator (spread over its realizations)
+    return: a ResultDict like SALib.analyze.sobol.analyze, with the two parts of the variance of the indices
+    """
+
+    D = problem['num_vars']
+    rng = np.random.default_rng(seed)
+    Y_mean = surrogate.predict(X)[0]
+    Si = sobol_estimates(Y_mean, D, calc_second_order)
+
+    # Uncertainty of the emulator: indices of each realization
+    Y_draws = surrogate.realizations(X, realizations, rng = rng)
+    draws = sobol_estimates(Y_draws, D, calc_second_order)
+    del Y_draws
+
+    # Monte Carlo error: bootstrap of the base samples of the design
+    step = 2*D + 2 if calc_second_order else D + 2
+    Y_rows = Y_mean.reshape(-1, step)
+    resamples = [sobol_estimates(Y_rows[rng.integers(len(Y_rows), size = len(Y_rows))].ravel(), D, calc_second_order)
+                 for _ in range(num_resamples)]
+
+    z = norm.ppf(0.5 + conf_level/2)
+    result = ResultDict()
+    for key in Si:
+        var_emulator = np.var(draws[key], axis = -1)
+        var_mc = np.var(np.stack([resample[key] for resample in resamples], axis = -1), axis = -1)
+        result[key] = Si[key]
+        result[key + '_conf'] = z*np.sqrt(var_emulator + var_mc)
+        result[key + '_var_emulator'] = var_emulator
+        result[key + '_var_mc'] = var_mc
+
+    result.problem = problem
+    result.to_df = MethodType(to_df, result)
+    return result
@@ -0,0 +1,259 @@
+import re
+import io
+import html
+import numpy as np
+
+
+# Tags of the EnergyPlus html summary reports used to locate and parse the tables
+TABLE_TAG = re.compile(r'<table\b', re.IGNORECASE)
+TABLE_END = re.compile(r'</table\s*>', re.IGNORECASE)
+ROW_TAG = re.compile(r'<tr\b[^>]*>(.*?)</tr\s*>', re.IGNORECASE | re.DOTALL)
+CELL_TAG = re.compile(r'<td\b[^>]*>(.*?)</td\s*>', re.IGNORECASE | re.DOTALL)
+BREAK_TAG = re.compile(r'<br\s*/?>', re.IGNORECASE)
+ANY_TAG = re.compile(r'<[^>]+>')
+
+# Markers of the texts preceding each table: its title (last <b> tag, as eppy titletable), the name of its
+# report (Report:<b> ...</b>) and the object it is reported for (For:<b> ...</b>)
+MARKERS = {'title': '<b>', 'report': 'Report:<b>', 'for': 'For:<b>'}
+
+
+def last_bold(text, position, marker = '<b>'):
+
+    """
+    Text of the last <b> tag starting with marker before position, None if there is none
+    """
+
+    start = text.rfind(marker, 0, position)
+    if start < 0:
+        return None
+    start += len(marker)
+    end = text.find('</b>', start)
+    return html.unescape(text[start:end if end >= 0 else len(text)]).strip()
+
+
+def table_title(text, position):
+
+    """
+    Title of the table starting at position: text of the last <b> tag before it (as eppy titletable)
+    """
+
+    return last_bold(text, position) or ''
+
+
+def cell_value(cell):
+
+    """
+    Value of a cell of a table: float when possible, stripped text otherwise
+    """
+
+    value = html.unescape(ANY_TAG.sub('', BREAK_TAG.sub('\n', cell))).strip()
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def parse_table(text, position = 0):
+
+    """
+    Rows of the table starting at position, as a list of lists of cell values
+    """
+
+    end = TABLE_END.search(text, position)
+    end = len(text) if end is None else end.start()
+    return [[cell_value(cell) for cell in CELL_TAG.findall(row)] for row in ROW_TAG.findall(text, position, end)]
+
+
+def iter_tables(file, block_size = 1 << 16):
+
+    """
+    Tables of a report read by blocks from a file object, without keeping the whole report in memory
+    return: generator of (context, offset, text) of the tables in order, context being the dictionary of the
+            title, report and for texts preceding the table and text the html of the table
+    """
+
+    context = dict.fromkeys(MARKERS, '')
+    buffer = ''
+    base = 0
+
+    def carry(cut):
+        # Texts of the markers found in the part of the buffer that is dropped
+        for key, marker in MARKERS.items():
+            value = last_bold(buffer, cut, marker)
+            if value is not None:
+                context[key] = value
+
+    for block in iter(lambda: file.read(block_size), ''):
+        buffer += block
+        position = 0
+        while True:
+            match = TABLE_TAG.search(buffer, position)
+            end = None if match is None else TABLE_END.search(buffer, match.end())
+            if end is None:
+                break
+            carry(match.start())
+            yield dict(context), base + match.start(), buffer[match.start():end.end()]
+            position = end.end()
+
+        # Everything before a table not yet complete, or before the last line that may be cut by the block
+        # (a marker and its text being on one line), is dropped
+        cut = match.start() if match is not None else max(position, buffer.rfind('\n', position) + 1)
+        carry(cut)
+        buffer = buffer[cut:]
+        base += cut
+
+
+def cell_specs(cells):
+
+    """
+    Requested cells as a plain list of [table, row, column], the tables and the labels being kept as they are
+    (no cast of titles to numbers or of ordinals to strings)
+    """
+
+    if isinstance(cells, np.ndarray):
+        cells = cells.tolist()
+    return [list(cell) for cell in cells]
+
+
+class TableExtractor:
+
+    """
+    Targeted extractor of cells of the EnergyPlus html summary reports: instead of parsing every table of
+    each file (eppy titletable), a locator index of the tables (title, occurrence of the title, offset) is built
+    from the first report of a campaign, and the other reports are streamed until the requested tables are found,
+    only these tables being parsed. The tables are found by their (title, occurrence) pair, the offset in the
+    reference report only checking that the layout of the report has not changed.
+    """
+
+    def __init__(self, cells, slack = 65536, block_size = 1 << 16):
+
+        """
+        cells: list of (table, row, column) where table is the title of the table, a (title, occurrence) pair for
+               repeated titles (occurrence being the rank of the table among the tables of this title, or the
+               object of the report "For: ..." or "report: for" when the tables are reported per object) or its
+               ordinal in the report, and row and column are indices or labels (first cell of the row, header
+               of the column)
+        slack: largest shift (characters) of a table with respect to its offset in the reference report
+        block_size: size (characters) of the blocks the reports are read by
+        """
+
+        self.cells = [tuple(cell) for cell in cells]
+        self.slack = slack
+        self.block_size = block_size
+        self.index = None
+
+
+    def build_index(self, text):
+
+        """
+        Locator index of a reference report (string or file object): list of (title, occurrence, offset, context)
+        of its tables, in order
+        """
+
+        file = io.StringIO(text) if isinstance(text, str) else text
+        self.index = []
+        counts = {}
+        for context, offset, table in iter_tables(file, self.block_size):
+            occurrence = counts.get(context['title'], 0)
+            counts[context['title']] = occurrence + 1
+            self.index.append((context['title'], occurrence, offset, context))
+
+        # (title, occurrence) of each requested table in the reference report
+        self.keys = [self._key(table) for table, row, column in self.cells]
+        return self.index
+
+
+    def _key(self, table):
+
+        # (title, occurrence) of a table given by its ordinal, its title or its (title, occurrence) pair
+        if isinstance(table, (int, np.integer)):
+            if not -len(self.index) <= table < len(self.index):
+                raise IndexError('No table {} in the summary report'.format(table))
+            title, occurrence = self.index[int(table)][:2]
+            return title, occurrence
+        title, occurrence = (table, 0) if isinstance(table, str) else table
+
+        if isinstance(occurrence, str):
+            # Table of the report for an object, which must be unique in the reference report
+            matches = [entry[1] for entry in self.index if entry[0] == title and occurrence in
+                       (entry[3]['for'], '{}: {}'.format(entry[3]['report'], entry[3]['for']))]
+            if len(matches) != 1:
+                raise KeyError('{} tables "{}" for "{}" in the summary report, one expected'.format(
+                               len(matches), title, occurrence))
+            return title, matches[0]
+
+        if not any(entry[0] == title and entry[1] == occurrence for entry in self.index):
+            raise KeyError('No table "{}" (occurrence {}) in the summary report'.format(title, occurrence))
+        return title, occurrence
+
+
+    def _reference(self, key):
+        return next(entry for entry in self.index if entry[:2] == key)
+
+
+    @staticmethod
+    def _cell(rows, row, column):
+
+        # Cell given by indices or by labels (first cell of the row, header of the column)
+        if isinstance(row, str):
+            row = [r[0] if r else '' for r in rows].index(row)
+        if isinstance(column, str):
+            column = rows[0].index(column)
+        return rows[row][column]
+
+
+    def extract_file(self, file):
+
+        """
+        Values of all the requested cells of a report given as a file object, read until the last requested
+        table is found
+        """
+
+        if self.index is None:
+            self.build_index(file)
+            file.seek(0)
+
+        wanted = set(self.keys)
+        tables = {}
+        counts = {}
+        for context, offset, table in iter_tables(file, self.block_size):
+            occurrence = counts.get(context['title'], 0)
+            counts[context['title']] = occurrence + 1
+            key = (context['title'], occurrence)
+            if key not in wanted:
+                continue
+
+            # The table found by its (title, occurrence) must be where the reference report has it, for the same object
+            title, occurrence, reference_offset, reference_context = self._reference(key)
+            if abs(offset - reference_offset) > self.slack or context['for'] != reference_context['for']:
+                raise ValueError('The table "{}" (occurrence {}) is at character {} for "{}" instead of {} for "{}" '
+                                 'in the reference report: the layout of the report has changed'.format(
+                                 title, occurrence, offset, context['for'], reference_offset, reference_context['for']))
+            tables[key] = parse_table(table)
+            if len(tables) == len(wanted):
+                break
+
+        missing = wanted - set(tables)
+        if missing:
+            raise KeyError('Tables {} not found in the summary report'.format(sorted(missing)))
+        return [self._cell(tables[key], row, column) for key, (table, row, column) in zip(self.keys, self.cells)]
+
+
+    def extract_text(self, text):
+
+        """
+        Values of all the requested cells of a report given as a string
+        """
+
+        return self.extract_file(io.StringIO(text))
+
+
+    def extract(self, html_file):
+
+        """
+        Values of the requested cells of a summary report file, as a numpy array (nan for non numeric cells)
+        """
+
+        with open(html_file, 'r', errors = 'replace') as file:
+            values = self.extract_file(file)
+        return np.array([value if isinstance(value, float) else np.nan for value in values])
@@ -0,0 +1,74 @@
+import re
+from itertools import chain
+
+
+# Parameter slot {{ name }} of an IDF template
+SLOT = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}')
+
+# Any other Jinja2 construct (expression with filters, statement, comment)
+JINJA = re.compile(r'\{\{|\{%|\{#')
+
+
+class CompiledTemplate:
+
+    """
+    IDF template split once into its static segments and its parameter slots {{ name }}, each sample being then
+    produced by joining the segments with the values of its parameters instead of a full Jinja2 render. The output
+    is the one of Jinja2 with the default options (newlines normalized, one trailing newline removed).
+    """
+
+    def __init__(self, text, name = None):
+
+        """
+        text: content of the IDF template
+        name: name of the template in the error messages
+        """
+
+        # Same normalization of the text as the Jinja2 lexer
+        text = re.sub(r'\r\n|\r', '\n', text)
+        if text.endswith('\n'):
+            text = text[:-1]
+
+        parts = SLOT.split(text)
+        self.segments = parts[0::2]
+        self.slots = parts[1::2]
+        self.names = set(self.slots)
+        self.name = name
+
+        for segment in self.segments:
+            if JINJA.search(segment):
+                raise ValueError("The template {} uses Jinja2 constructs other than {{{{ name }}}} slots".format(name))
+
+
+    @classmethod
+    def from_file(cls, idf_template_file):
+        with open(idf_template_file, 'r', encoding = 'utf-8') as template:
+            return cls(template.read(), idf_template_file)
+
+
+    def parts(self, params):
+
+        """
+        Segments and values of the parameters of a sample in the order of the *.idf file
+        """
+
+        values = [str(params[name]) for name in self.slots]
+        return chain(chain.from_iterable(zip(self.segments, values)), (self.segments[-1],))
+
+
+    def render(self, params):
+
+        """
+        Content of the *.idf file of one sample (dictionary of parameters), like the render of Jinja2
+        """
+
+        return ''.join(self.parts(params))
+
+
+    def missing(self, param_names):
+
+        """
+        Parameters that do not appear in any slot of the template
+        """
+
+        return [name for name in param_names if name not in self.names]
@@ -0,0 +1,482 @@
+import os
+import json
+import shutil
+import socket
+import sqlite3
+import hashlib
+import argparse
+import threading
+from time import time, sleep, perf_counter
+from uuid import uuid4
+from contextlib import closing
+from multiprocessing import Process
+from EppyUtility import write_model, _template, _run_idf
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch TEXT NOT NULL,
+    name TEXT NOT NULL,
+    template TEXT NOT NULL,
+    epw TEXT NOT NULL,
+    ep_version TEXT NOT NULL,
+    params TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker TEXT,
+    heartbeat REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    duration REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, status);
+"""
+
+
+class WorkQueue:
+
+    """
+    Queue of EnergyPlus jobs in a folder shared by the nodes: SQLite broker of the jobs (queue.sqlite), files of
+    the jobs stored once by hash (files/, templates and weather files) and outputs of the runs (results/{job}).
+    A job is a template with the parameters of one sample, rendered by the worker agent that runs it.
+    The SQLite locking needs a file system that supports it (local disk, or a network share with working locks).
+    """
+
+    def __init__(self, queue_folder, heartbeat_timeout = 300.0, max_attempts = 3):
+
+        """
+        queue_folder: folder of the queue, shared by the submitting process and the worker agents
+        heartbeat_timeout: seconds without heartbeat after which a running job is requeued (lost worker)
+        max_attempts: number of attempts of a job before it is marked as failed
+        """
+
+        self.queue_folder = queue_folder
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max_attempts
+        self.database = os.path.join(queue_folder, 'queue.sqlite')
+        self.files_folder = os.path.join(queue_folder, 'files')
+        self.results_folder = os.path.join(queue_folder, 'results')
+        os.makedirs(self.files_folder, exist_ok = True)
+        os.makedirs(self.results_folder, exist_ok = True)
+        with closing(self.connect()) as connection:
+            connection.executescript(SCHEMA)
+
+
+    def connect(self):
+
+        # Connection in autocommit mode, the transactions being opened explicitly
+        return sqlite3.connect(self.database, timeout = 60, isolation_level = None)
+
+
+    def put_file(self, path):
+
+        """
+        Copy a file (template, weather file) in the queue once, under the hash of its content
+        return: name of the file in the queue
+        """
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        name = digest.hexdigest() + os.path.splitext(path)[1]
+
+        target = os.path.join(self.files_folder, name)
+        if not os.path.exists(target):
+            tmp_path = target + '.{}.tmp'.format(uuid4().hex)
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, target)
+        return name
+
+
+    def submit(self, jobs, idf_template_file, epw_file, ep_version):
+
+        """
+        Queue a batch of jobs sharing the same template, weather file and EnergyPlus version
+        jobs: list of (name, dictionary of parameters), the name prefixing the outputs of the run (e.g. run-{i})
+        return: identifier of the batch
+        """
+
+        batch = uuid4().hex
+        template, epw = self.put_file(idf_template_file), self.put_file(epw_file)
+        self._insert([(batch, name, template, epw, str(ep_version), json.dumps(params, default = float))
+                      for name, params in jobs])
+        return batch
+
+
+    def submit_models(self, models, epw_file, ep_version):
+
+        """
+        Queue a batch of models already rendered by the submitting process (e.g. with the output objects of a
+        SeriesReader or restricted by a RunPeriodSlicer), stored in the folder files/{batch} of the queue
+        models: list of (name, content of the *.idf file)
+        return: identifier of the batch
+        """
+
+        batch = uuid4().hex
+        os.makedirs(os.path.join(self.files_folder, batch))
+        epw = self.put_file(epw_file)
+        rows = []
+        for name, content in models:
+            model = '{}/{}.idf'.format(batch, name)
+            with open(self.file(model), mode = 'w', encoding = 'utf-8') as idf:
+                idf.write(content)
+            rows.append((batch, name, model, epw, str(ep_version), json.dumps(None)))
+        self._insert(rows)
+        return batch
+
+
+    def remove_models(self, batch):
+
+        """
+        Delete the rendered models of a batch once it is finished
+        """
+
+        shutil.rmtree(os.path.join(self.files_folder, batch), ignore_errors = True)
+
+
+    def _insert(self, rows):
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.executemany('INSERT INTO jobs (batch, name, template, epw, ep_version, params) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)', rows)
+            connection.execute('COMMIT')
+
+
+    def claim(self, worker):
+
+        """
+        Take the oldest queued job for a worker agent
+        return: (id, name, template, epw, ep_version, params) of the job (params None for a rendered model),
+                None if the queue is empty
+        """
+
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            job = connection.execute("SELECT id, name, template, epw, ep_version, params FROM jobs "
+                                     "WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if job is not None:
+                connection.execute("UPDATE jobs SET status = 'running', worker = ?, heartbeat = ?, attempts = attempts + 1 "
+                                   "WHERE id = ?", (worker, time(), job[0]))
+            connection.execute('COMMIT')
+        if job is None:
+            return None
+        return job[:5] + (json.loads(job[5]),)
+
+
+    def beat(self, job_id, worker):
+
+        """
+        Heartbeat of a worker agent running a job
+        """
+
+        with closing(self.connect()) as connection:
+            connection.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                               (time(), job_id, worker))
+
+
+    def complete(self, job_id, worker, outputs_folder, duration):
+
+        """
+        Mark a job as done and copy the outputs of its run in the results of the queue, unless the job was
+        requeued in the meantime (the worker having been taken for lost)
+        """
+
+        # Outputs copied from the node before taking the lock, then renamed at once when the job is still the worker's
+        tmp_folder = os.path.join(self.results_folder, '{}.{}.tmp'.format(job_id, worker))
+        shutil.copytree(outputs_folder, tmp_folder)
+        shutil.rmtree(outputs_folder, ignore_errors = True)
+
+        with closing(self.connect()) as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            running = connection.execute("SELECT 1 FROM jobs WHERE id = ? AND worker = ? AND status = 'running'",
+                                         (job_id, worker)).fetchone()
+            if running is not None:
+                os.replace(tmp_folder, self.result(job_id))
+                connection.execute("UPDATE jobs SET status = 'done', duration = ?, error = NULL WHERE id = ?",
+                                   (duration, job_id))
+            connection.execute('COMMIT')
+        if running is None:
+            shutil.rmtree(tmp_folder, ignore_errors = True)
+
+
+    def fail(self, job_id, worker, error):
+
+        """
+        Requeue a failed job, or mark it as failed after max_attempts attempts
+        """
+
+        with closing(self.connect()) as connection:
+            connection.execute("UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, "
+                               "worker = NULL, error = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                               (self.max_attempts, error, job_id, worker))
+
+
+    def requeue_lost(self):
+
+        """
+        Requeue the running jobs whose worker agent has not sent any heartbeat for heartbeat_timeout seconds
+        return: number of jobs requeued or marked as failed
+        """
+
+        with closing(self.connect()) as connection:
+            cursor = connection.execute("UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, "
+                                        "worker = NULL, error = 'worker lost' WHERE status = 'running' AND heartbeat < ?",
+                                        (self.max_attempts, time() - self.heartbeat_timeout))
+            return cursor.rowcount
+
+
+    def counts(self, batch = None):
+
+        """
+        Number of jobs by status, of a batch or of the whole queue
+        """
+
+        query = 'SELECT status, COUNT(*) FROM jobs' + (' WHERE batch = ?' if batch is not None else '') + ' GROUP BY status'
+        with closing(self.connect()) as connection:
+            return dict(connection.execute(query, (batch,) if batch is not None else ()).fetchall())
+
+
+    def finished(self, batch):
+
+        """
+        Jobs of a batch that are done or failed: list of (id, name, status, error)
+        """
+
+        with closing(self.connect()) as connection:
+            return connection.execute("SELECT id, name, status, error FROM jobs WHERE batch = ? "
+                                      "AND status IN ('done', 'failed') ORDER BY id", (batch,)).fetchall()
+
+
+    def file(self, name):
+        return os.path.join(self.files_folder, name)
+
+
+    def result(self, job_id):
+        return os.path.join(self.results_folder, str(job_id))
+
+
+class QueueWorker:
+
+    """
+    Worker agent of a node: takes the jobs of the queue one at a time, renders and runs them in a local scratch
+    folder and moves their outputs to the queue, a heartbeat thread telling the queue that it is still alive
+    """
+
+    def __init__(self, queue, scratch_folder, heartbeat = 30.0, idle = 5.0, energyplus = None):
+
+        """
+        queue: WorkQueue (or folder of the queue)
+        scratch_folder: local folder of the runs and of the copies of the templates and weather files
+        heartbeat: seconds between two heartbeats, well below the heartbeat_timeout of the queue
+        idle: seconds between two looks at an empty queue
+        energyplus: EnergyPlus executable of the node launched directly (run of eppy by default)
+        """
+
+        self.queue = queue if isinstance(queue, WorkQueue) else WorkQueue(queue)
+        self.scratch_folder = scratch_folder
+        self.heartbeat = heartbeat
+        self.idle = idle
+        self.energyplus = energyplus
+        self.name = '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid4().hex[:8])
+        self.files_folder = os.path.join(scratch_folder, 'files')
+        os.makedirs(self.files_folder, exist_ok = True)
+
+
+    def fetch(self, name):
+
+        """
+        Local copy of a file of the queue, transferred once per node
+        """
+
+        local = os.path.join(self.files_folder, name)
+        if not os.path.exists(local):
+            tmp_path = local + '.{}.tmp'.format(uuid4().hex)
+            shutil.copyfile(self.queue.file(name), tmp_path)
+            os.replace(tmp_path, local)
+        return local
+
+
+    def _beat(self, job_id, stop):
+        while not stop.wait(self.heartbeat):
+            try:
+                self.queue.beat(job_id, self.name)
+            except sqlite3.Error:
+                continue
+
+
+    def run_job(self, job):
+
+        """
+        Render and run one job, then send its outputs back to the queue
+        """
+
+        job_id, name, template, epw, ep_version, params = job
+        stop = threading.Event()
+        beating = threading.Thread(target = self._beat, args = (job_id, stop), daemon = True)
+        beating.start()
+
+        outputs_folder = os.path.join(self.scratch_folder, 'job-{}-{}'.format(job_id, self.name))
+        start = perf_counter()
+        try:
+            shutil.rmtree(outputs_folder, ignore_errors = True)
+            os.makedirs(outputs_folder)
+            idf_file = os.path.join(outputs_folder, name + '.idf')
+            if params is None:
+                shutil.copyfile(self.queue.file(template), idf_file)
+            else:
+                write_model(idf_file, _template(self.fetch(template)), params)
+            _run_idf(idf_file, self.fetch(epw), ep_version, self.energyplus)
+        except Exception as error:
+            stop.set()
+            beating.join()
+            self.queue.fail(job_id, self.name, repr(error))
+            return False
+
+        stop.set()
+        beating.join()
+        self.queue.complete(job_id, self.name, outputs_folder, perf_counter() - start)
+        return True
+
+
+    def run(self, stop_when_empty = False):
+
+        """
+        Run the jobs of the queue until it is stopped, or until no job is queued or running if stop_when_empty
+        """
+
+        while True:
+            job = self.queue.claim(self.name)
+            if job is not None:
+                self.run_job(job)
+                continue
+
+            # Jobs of the lost workers of the other nodes put back in the queue while waiting
+            if self.queue.requeue_lost():
+                continue
+            counts = self.queue.counts()
+            if stop_when_empty and not counts.get('queued') and not counts.get('running'):
+                return
+            sleep(self.idle)
+
+
+def _serve(queue_folder, scratch_folder, stop_when_empty, energyplus):
+    QueueWorker(queue_folder, scratch_folder, energyplus = energyplus).run(stop_when_empty)
+
+
+def serve(queue_folder, scratch_folder, num_processors, stop_when_empty = False, energyplus = None):
+
+    """
+    Start num_processors worker agents on the node and wait for them
+    """
+
+    agents = [Process(target = _serve, args = (queue_folder, scratch_folder, stop_when_empty, energyplus)) for k in range(num_processors)]
+    for agent in agents:
+        agent.start()
+    for agent in agents:
+        agent.join()
+
+
+class QueueBackend:
+
+    """
+    Execution backend of EplusPy.run_models and EplusPy.evaluate sending the runs to a WorkQueue served by worker
+    agents on several nodes (see serve), the outputs of the runs being collected in the evaluation folder as they
+    come in
+    """
+
+    def __init__(self, queue, poll = 10.0):
+
+        """
+        queue: WorkQueue (or folder of the queue)
+        poll: seconds between two looks at the progress of the runs
+        """
+
+        self.queue = queue if isinstance(queue, WorkQueue) else WorkQueue(queue)
+        self.poll = poll
+
+
+    def collect(self, batch, eval_folder, collected):
+
+        """
+        Move the outputs of the runs of the batch done since the last call in the evaluation folder
+        return: (name, error) of the failed runs
+        """
+
+        failed = []
+        for job_id, name, status, error in self.queue.finished(batch):
+            if job_id in collected:
+                continue
+            collected.add(job_id)
+            if status == 'failed':
+                failed.append((name, error))
+                continue
+            result_folder = self.queue.result(job_id)
+            for output in os.listdir(result_folder):
+                shutil.move(os.path.join(result_folder, output), os.path.join(eval_folder, output))
+            os.rmdir(result_folder)
+        return failed
+
+
+    def run_models(self, eplus, param_names, X, eval_folder):
+
+        """
+        Run the samples X of eplus (EplusPy) on the worker agents, their outputs being written in eval_folder
+        like the outputs of the local runs (run-{i}-table.htm, ...)
+        """
+
+        eplus.check_parameters(param_names)
+        if eplus.run_period is not None:
+            raise ValueError("The runs of the worker agents cannot be restricted by a RunPeriodSlicer")
+        jobs = [("run-{}".format(i), dict(zip(param_names, values))) for i, values in enumerate(X)]
+        batch = self.queue.submit(jobs, eplus.get_idf_template_file(), eplus.get_epw_file(), eplus.ep_version)
+        self.wait(batch, eval_folder)
+
+
+    def run_contents(self, eplus, contents, eval_folder, indices):
+
+        """
+        Run the rendered models contents[i] of eplus (EplusPy) for the samples i in indices on the worker agents,
+        their outputs being written in eval_folder like the outputs of the local runs (run-{i}-table.htm, ...)
+        """
+
+        models = [("run-{}".format(i), contents[i]) for i in indices]
+        batch = self.queue.submit_models(models, eplus.get_epw_file(), eplus.ep_version)
+        try:
+            self.wait(batch, eval_folder)
+        finally:
+            self.queue.remove_models(batch)
+
+
+    def wait(self, batch, eval_folder):
+
+        """
+        Collect the outputs of the runs of a batch until none is queued or running
+        """
+
+        collected = set()
+        failed = []
+        while True:
+            self.queue.requeue_lost()
+            failed += self.collect(batch, eval_folder, collected)
+            counts = self.queue.counts(batch)
+            if not counts.get('queued') and not counts.get('running'):
+                failed += self.collect(batch, eval_folder, collected)
+                break
+            sleep(self.poll)
+
+        if failed:
+            raise RuntimeError("{} run(s) failed on the worker agents: {}".format(len(failed), failed))
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = "Worker agents of a node serving a queue of EnergyPlus jobs")
+    parser.add_argument('queue_folder', help = "folder of the queue, shared by the nodes")
+    parser.add_argument('scratch_folder', help = "local folder of the runs")
+    parser.add_argument('--processes', type = int, default = os.cpu_count(), help = "number of worker agents")
+    parser.add_argument('--energyplus', help = "EnergyPlus executable launched directly (run of eppy by default)")
+    parser.add_argument('--stop-when-empty', action = 'store_true', help = "stop once no job is queued or running")
+    arguments = parser.parse_args()
+    serve(arguments.queue_folder, arguments.scratch_folder, arguments.processes, arguments.stop_when_empty, arguments.energyplus)
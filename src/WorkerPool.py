@@ -0,0 +1,165 @@
+import os
+import math
+from time import time, perf_counter
+from functools import partial
+from multiprocessing import Pool
+
+
+def _timed(func, item):
+
+    # Run one task in a worker and return its result with its duration and the worker that ran it
+    start = perf_counter()
+    result = func(item)
+    return result, perf_counter() - start, os.getpid()
+
+
+class WorkerPool:
+
+    """
+    Long-lived pool of worker processes shared by the rendering of the *.idf files, the EnergyPlus runs and the
+    extraction of the outputs, so that the processes are started once per campaign instead of once per call.
+    The tasks are module-level functions (nothing but the function and the tasks is pickled), dispatched by chunks.
+    """
+
+    def __init__(self, num_processors = None, chunks_per_worker = 4):
+
+        """
+        num_processors: number of worker processes (all the processors by default)
+        chunks_per_worker: number of chunks per worker the tasks of a call are split into, when no chunksize is given
+        """
+
+        self.num_processors = num_processors or os.cpu_count()
+        self.chunks_per_worker = chunks_per_worker
+        self.pool = None
+
+        # Utilization of the workers: number of tasks, time spent in the tasks, time spent in the calls of the pool
+        self.tasks = 0
+        self.busy_time = 0.0
+        self.active_time = 0.0
+        self.tasks_per_worker = {}
+        self.start_time = None
+
+
+    def start(self):
+
+        """
+        Start the worker processes if they are not running yet
+        """
+
+        if self.pool is None:
+            self.pool = Pool(processes = self.num_processors)
+            self.start_time = time()
+        return self
+
+
+    def chunksize(self, num_tasks):
+
+        """
+        Number of tasks sent at once to a worker: a few chunks per worker balance the load while keeping
+        the number of messages between the processes small
+        """
+
+        return max(1, math.ceil(num_tasks / (self.num_processors*self.chunks_per_worker)))
+
+
+    def _record(self, duration, pid):
+        self.tasks += 1
+        self.busy_time += duration
+        self.tasks_per_worker[pid] = self.tasks_per_worker.get(pid, 0) + 1
+
+
+    def map(self, func, iterable, chunksize = None):
+
+        """
+        Ordered list of func(item) for all the items, func being a module-level function (or a partial of one)
+        """
+
+        return list(self.imap(func, iterable, chunksize, ordered = True))
+
+
+    def imap(self, func, iterable, chunksize = None, ordered = False):
+
+        """
+        Iterator over func(item) for all the items, in the order in which the tasks finish unless ordered
+        """
+
+        items = list(iterable)
+        if not items:
+            return
+        self.start()
+        chunksize = chunksize or self.chunksize(len(items))
+        imap = self.pool.imap if ordered else self.pool.imap_unordered
+
+        start = perf_counter()
+        try:
+            for result, duration, pid in imap(partial(_timed, func), items, chunksize):
+                self._record(duration, pid)
+                yield result
+        finally:
+            self.active_time += perf_counter() - start
+
+
+    def utilization(self):
+
+        """
+        Report of the utilization of the workers: fraction of the time spent in the calls of the pool during
+        which the workers were running tasks
+        """
+
+        capacity = self.active_time*self.num_processors
+        return {'processes': self.num_processors,
+                'tasks': self.tasks,
+                'busy_time': self.busy_time,
+                'active_time': self.active_time,
+                'utilization': self.busy_time/capacity if capacity > 0 else 0.0,
+                'tasks_per_worker': dict(self.tasks_per_worker)}
+
+
+    def report(self):
+
+        """
+        Print the utilization of the workers
+        """
+
+        report = self.utilization()
+        print("{} tasks run by {} workers in {:.1f} seconds: worker utilization of {:.1%} ({:.1f} busy seconds).".format(
+              report['tasks'], report['processes'], report['active_time'], report['utilization'], report['busy_time']))
+
+
+    def close(self):
+
+        """
+        Wait for the workers to finish and stop them
+        """
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+
+    def terminate(self):
+
+        """
+        Stop the workers immediately (e.g. after an error)
+        """
+
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+    def __enter__(self):
+        return self.start()
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+
+    def __getstate__(self):
+        raise TypeError('A WorkerPool cannot be sent to its own workers')
@@ -2,6 +2,11 @@ import os
 import shutil
 from time import time
 import sensivity_analysis
+from SimulationCache import SimulationCache
+from WorkerPool import WorkerPool
+from RunManifest import RunManifest
+from ResultsStore import ResultsStore
+from WorkQueue import QueueBackend
 
 def main():
     """main function"""
@@ -46,10 +51,69 @@ def main():
             }
     
     #Instantiate an object from the class SALib
-    sa = sensivity_analysis.SenAna(parameters, num_initial_samples)
+    sa = sensivity_analysis.SenAna(parameters, num_initial_samples, seed = 2024)
 
-    # Obtaining indeces of sensivity anlysis through Sobol method
-    Si = sa.evaluate(num_processors = 16)
+    # Cache of the E+ outputs shared by all the campaigns, so that the samples already simulated are skipped
+    cache = SimulationCache(os.path.join(os.path.abspath('./simulation'), 'cache'))
+
+    # Samples, outputs and indices of the campaigns in one columnar store, read by the notebooks without any *.csv
+    store = ResultsStore(os.path.join(os.path.abspath('./simulation'), "results.h5"))
+
+    # Manifest of the runs of the campaign: launching main again with the same number of samples resumes the
+    # campaign after a crash, only the missing and failed samples being run. The failed samples are retried twice,
+    # after 5 and 10 seconds, each retry being reported by a warning (retries and backoff of evaluate_resumable)
+    manifest = RunManifest(os.path.join(os.path.abspath('./simulation'), "manifest-n={}.jsonl".format(num_initial_samples)))
+
+    # Optional folder of a WorkQueue shared by several nodes, whose worker agents (python WorkQueue.py <folder>
+    # <scratch folder>) then run the simulations; the queue keeping the runs, the campaign goes without manifest
+    queue_folder = None
+    if queue_folder is not None:
+        sa.backend = QueueBackend(queue_folder)
+        manifest = None
+
+    # Progressive analysis: the number of samples entered is doubled until the confidence intervals of the indices
+    # are narrower than 0.1 or the ranking of the parameters is stable over 3 blocks, the cache keeping the blocks
+    # already simulated if the analysis is interrupted
+    progressive = False
+
+    # Optional Morris screening of r(p+1) runs before the Sobol analysis: the parameters with a negligible effect are
+    # pinned at the middle of their bounds, the runs and the indices of the screening being saved for auditing
+    screening = False
+
+    # Sobol indices computed on a Gaussian process emulator fitted on a few hundred simulations instead of the full
+    # Saltelli design, simulations being added until the leave-one-out Q2 of the emulator reaches 0.9
+    surrogate = False
+
+    # Obtaining indeces of sensivity anlysis through Sobol method, with workers started once for the whole analysis
+    with WorkerPool(num_processors = 16) as pool:
+        if screening:
+            sa.screen(num_processors = 16, trajectories = 10, threshold = 0.1,
+                      results_folder = os.path.join(os.path.abspath('./simulation'), 'screening'),
+                      cache = cache, streaming = True, pool = pool)
+
+        if surrogate:
+            Si = sa.evaluate_surrogate(num_processors = 16, target_q2 = 0.9, N = 2**14, cache = cache,
+                                       streaming = True, pool = pool)
+        elif progressive:
+            Si = sa.evaluate_progressive(num_processors = 16, max_samples = 64*num_initial_samples, ci_width = 0.1,
+                                         stable_rankings = 3, cache = cache, streaming = True, pool = pool)
+        else:
+            try:
+                Si = sa.evaluate(num_processors = 16, cache = cache, streaming = True, pool = pool, manifest = manifest,
+                                 store = store, campaign = "sobol-n={}".format(num_initial_samples))
+            finally:
+                # Partial results, to be looked at before the end of the campaign or after a failure
+                if manifest is not None:
+                    manifest.export(os.path.join(os.path.abspath('./simulation'), "partial-n={}.csv".format(num_initial_samples)),
+                                    len(sa.get_samples()))
+    
+    # Runs and indices of the progressive and surrogate analyses in the store (evaluate saves its own)
+    if surrogate or progressive:
+        campaign = "{}-n={}".format("surrogate" if surrogate else "progressive", num_initial_samples)
+        store.start(campaign, sa.problem['names'], ['Y'], overwrite = True, problem = sa.problem, seed = sa.seed,
+                    fixed = sa.fixed)
+        store.append(campaign, sa.X, sa.Y)
+        store.write_indices(campaign, Si)
     
     duration = time() - start_time
     print("§"*100)
@@ -61,7 +125,7 @@ def main():
     total_Si, first_Si, second_Si = Si.to_df()
     
     output_folder = os.path.join(os.path.abspath('./simulation'), "n={} and p={}".format(num_initial_samples,
-                                                                                  len(parameters['obj_id'])))
+                                                                                  sa.problem['num_vars']))
     if os.path.exists(output_folder) == True:
         shutil.rmtree(output_folder, ignore_errors = False)
     os.mkdir(output_folder)
@@ -6,8 +6,16 @@ import pandas as pd
 from abc import abstractmethod
 from SALib.sample.sobol import sample
 from SALib.analyze.sobol import analyze
-from eppy.results import readhtml
-from multiprocessing import Pool
+from SALib.sample.morris import sample as morris_sample
+from SALib.analyze.morris import analyze as morris_analyze
+from SALib.sample.latin import sample as latin_sample
+from functools import partial
+from contextlib import nullcontext
+from TableExtractor import TableExtractor
+from EppyUtility import read_summary_report
+from WorkerPool import WorkerPool
+from SurrogateSobol import GPSurrogate, surrogate_sobol
+from AdaptiveDesign import select_batch
 
 
 class SenAna:
@@ -16,7 +24,7 @@ class SenAna:
         related to sensivity analysis using SALib
     """
     
-    def __init__(self, parameters, num_initial_samples):
+    def __init__(self, parameters, num_initial_samples, seed = None):
 
         """
             Constructor of the class to set problem parameter according to the documentation of SALib
@@ -32,6 +40,7 @@ class SenAna:
                               ],
                     'dists': ['unif', 'lognorm', 'triang', 'norm', 'truncnorm', ...]
                 }
+            seed: seed of the Sobol sequence, needed to resume a campaign on the same samples
         """
         
         # Define the model inputs according the documentation of SALib
@@ -40,9 +49,29 @@ class SenAna:
                         'bounds': parameters['bounds'], 'dists': parameters['distributions']} 
 
         # Generate samples
-        self.X = sample(self.problem, self.num_initial_samples)
+        self.seed = seed
+        self.X = sample(self.problem, self.num_initial_samples, seed = seed)
         self.Y = np.zeros(self.X.shape[0])
         self.Si = None
+        
+        # Parameters pinned at their nominal value by a screening (see screen), not varied by the Sobol samples
+        self.fixed = {}
+        self.screening = None
+        
+        # Convergence of the indices after each block of a progressive analysis (see evaluate_progressive)
+        self.history = []
+        
+        # Gaussian process emulator of a surrogate analysis and its cross-validation (see evaluate_surrogate)
+        self.surrogate = None
+        self.cv = None
+        
+        # Optional execution backend of the simulations (e.g. QueueBackend running them on several nodes)
+        self.backend = None
+        
+        # Cells (table, row, column) of the output target in the summary reports, the table given by its title
+        # (Heating electricity of the End Uses table, see read_html_tables and TableExtractor)
+        self.outputs_indices = [("End Uses", "Heating", 1)]
+        self._extractor = None
       
     
     def get_samples(self):
@@ -66,42 +95,45 @@ class SenAna:
     
         output_folder = os.path.join(os.path.abspath('./'), 'simulation\\real_time_results')
         
+        # Only the targeted table is parsed in each report, (table title, row, column), a repeated title being
+        # completed by its occurrence or by the object of its report
+        # Time Not Comfortable Based on Simple ASHRAE 55-2004: ("Comfort and Setpoint Not Met Summary", 3, 1)
+        # Cooling: ("End Uses", "Cooling", 1)
+        # Heating: ("End Uses", "Heating", 1)
+        # Energy Per Total Building Area [kWh/m2]: ("Site and Source Energy", 2, 2)
+        # OccupantComfortDataSummaryMonthly_ For: PEOPLE RDC:TESLA
+        extractor = TableExtractor([(("Custom Monthly Report", "OccupantComfortDataSummaryMonthly: PEOPLE RDC:TESLA"), 14, 4)])
+        
         for i in range(len(self.Y)):
 
             output_file = os.path.join(output_folder, 'run-{}-table.htm'.format(i))
-            
-            # Access to output summary table
-            html_doc = open(output_file, 'r').read()  # file handle
-            htables = readhtml.titletable(html_doc) # reads the tables with their titles
-    
-            # [table_index][0: table_title, 1: table_content][row_index][column_index]          
-            # Time Not Comfortable Based on Simple ASHRAE 55-2004
-            # self.Y[i] = htables[11][1][3][1]
-            # Cooling
-            # self.Y[i] = htables[3][1][2][1]
-            # Heating
-            # self.Y[i] = htables[3][1][1][1]
-            # Energy Per Total Building Area [kWh/m2]
-            # self.Y[i] = htables[0][1][2][2]
-            # OccupantComfortDataSummaryMonthly_ For: PEOPLE RDC:TESLA
-            self.Y[i] = htables[75][-1][14][4]
+            self.Y[i] = extractor.extract(output_file)[0]
 
        
     
+    def extractor(self):
+        """
+            TableExtractor of the output target, whose locator index is built on the first report read and then
+            kept for all the reports of the campaign
+        """
+        if self._extractor is None or self._extractor.cells != [tuple(cell) for cell in self.outputs_indices]:
+            self._extractor = TableExtractor(self.outputs_indices)
+        return self._extractor
+    
+    
     def read_html_tables(self, filename):
         """
             read each html file and return the searched output in the summary report
         """
-        html_doc = open(filename, 'r').read()  # file handle
-        htables = readhtml.titletable(html_doc) # reads the tables with their titles
-        # Heating
-        return htables[3][1][1][1]
+        # Heating, only its table being parsed
+        return self.extractor().extract(filename)[0]
     
     
-    def read_results_in_parallel(self, num_processors):
+    def read_results_in_parallel(self, num_processors, pool = None):
         """
-            Profiting the parallel processing through Pool to read all the html summary reports
-            first filling out a list of all the html files in a list and then share it by pool between processors
+            Profiting the parallel processing through a WorkerPool to read all the html summary reports
+            first filling out a list of all the html files in a list and then share it by chunks between processors
+            param pool: shared WorkerPool of the campaign (a pool of num_processors workers closed at the end by default)
         """
         master_list = []
         # Getting the currently running script file (main.py)
@@ -111,15 +143,33 @@ class SenAna:
             output_file = os.path.join(output_folder, 'run-{}-table.htm'.format(i))
             master_list.append(output_file)
    
-        pool = Pool(processes=num_processors)
-        self.Y = np.array(pool.map(self.read_html_tables, master_list))
+        # Locator index of the tables built once on the first summary report and shared by all the processes
+        extractor = self.extractor()
+        if extractor.index is None and master_list:
+            with open(master_list[0], 'r', errors = 'replace') as html:
+                extractor.build_index(html)
+        
+        # Module-level reading function, so that the tasks do not carry the SenAna object (X, Y) with them
+        read_html = partial(read_summary_report, outputs_indices = self.outputs_indices, extractor = extractor)
+        if pool is None:
+            with WorkerPool(num_processors) as workers:
+                self.Y = np.array(workers.map(read_html, master_list)).ravel()
+        else:
+            self.Y = np.array(pool.map(read_html, master_list)).ravel()
 
     
 
-    def evaluate(self, num_processors):
+    def evaluate(self, num_processors, cache = None, streaming = False, pool = None, manifest = None, store = None,
+                 campaign = None):
         """
             Perform analysis
             param Y: A Numpy array containing the model outputs of dtype=float
+            param cache: an optional SimulationCache so that the samples already simulated are not run again
+            param streaming: render, run, read and clean each sample inside one worker to bound the disk usage
+            param pool: an optional WorkerPool shared by the rendering, the simulations and the reading of the outputs
+            param manifest: an optional RunManifest, so that the samples done by an interrupted campaign are not run again
+            param store: an optional ResultsStore where the samples, the outputs and the indices are saved under campaign,
+                         the runs being appended as they finish (with their index in the column sample)
             return: A dictionary of sensitivity indices containing the following entries.
                 - `Si` - the single effect of each parameter
                 - `ST` - The total eefect of each parameter
@@ -128,31 +178,43 @@ class SenAna:
 
         # Inititiating an object from class Eppy to run the energyPlus models for all samples 
         # and obtain parameter Y
-        eplus = eppy_utility.EplusPy(self.problem, self.X)
+        eplus = self.model(self.X, cache, pool)
+        
+        # Samples and outputs appended to the store as the runs finish, so that an interrupted campaign keeps them
+        appender = nullcontext()
+        if store is not None:
+            store.start(campaign, self.problem['names'], ['Y'], overwrite = True, problem = self.problem,
+                        num_initial_samples = self.num_initial_samples, seed = self.seed, fixed = self.fixed,
+                        outputs_indices = self.outputs_indices)
+            appender = store.appender(campaign)
         
+        # Run the samples and read the output target in all the summary reports, skipping the cached samples
         start_time = time()
-        eplus.run_models(num_processors)
+        with appender:
+            on_result = None if store is None else lambda i, Y_i: appender.add(self.X[i], np.ravel(Y_i), sample = i)
+            self.Y = eplus.evaluate(self.outputs_indices, num_processors, streaming = streaming, manifest = manifest,
+                                    on_result = on_result).ravel()
         duration = time() - start_time
         print("§"*100)
-        print("It took {} seconds ({} hours) to run all the {} E+ simulations.".format(duration, duration/3600,
-                                                    2*self.num_initial_samples*(self.problem['num_vars'] + 1)))    
-        print("§"*100)
-
-        # read the output target in the all summary reports
-        start_time = time()
-        # self.read_results()
-        self.read_results_in_parallel(num_processors)
-     
-        duration = time() - start_time
-        print("It took {} seconds ({} hours) to read all the {} tables of" 
-              " E+ model evaluations.".format(duration, duration/3600,
-              2*self.num_initial_samples*(self.problem['num_vars'] + 1)))    
+        print("It took {} seconds ({} hours) to run and read all the {} E+ simulations.".format(duration, duration/3600,
+                                                    2*self.num_initial_samples*(self.problem['num_vars'] + 1)))
+        if cache is not None:
+            print("{} simulations were taken from the cache.".format(cache.hits))
+        if manifest is not None:
+            manifest.report(len(self.X))
+        if pool is not None:
+            pool.report()
         print("§"*100)
         
+        if store is not None:
+            store.update_metadata(campaign, duration = duration)
+        
         # Running the analysis phase which is the last one
         start_time = time()
         self.Si = analyze(self.problem, self.Y, print_to_console=True, parallel=True, 
                           keep_resamples=True, n_processors=num_processors, seed=2024) 
+        if store is not None:
+            store.write_indices(campaign, self.Si)
         
         duration = time() - start_time
         print("§"*100)
@@ -161,5 +223,221 @@ class SenAna:
         return self.Si
 
 
+    def model(self, X, cache = None, pool = None):
+        """
+            Energy model evaluating the samples X of the parameters studied, the parameters dropped by the screening
+            being set at their nominal value in all the samples
+            return: an eppy_utility.EplusPy object
+        """
+        names = self.problem['names'] + list(self.fixed)
+        X = np.hstack([X, np.tile(list(self.fixed.values()), (len(X), 1))]) if self.fixed else X
+        return eppy_utility.EplusPy({'names': names}, X, cache = cache, pool = pool, backend = self.backend)
+
+
+    def screen(self, num_processors, trajectories = 10, num_levels = 4, threshold = 0.1, nominal = None,
+               results_folder = None, cache = None, streaming = False, pool = None):
+        """
+            Morris screening before the Sobol analysis: r(p+1) samples along r trajectories are evaluated like the
+            Sobol samples, the parameters whose mu* and sigma are both below threshold times the largest ones are
+            pinned at their nominal value in the template and the Sobol samples are drawn for the other parameters
+            param trajectories: number of trajectories r of the Morris design
+            param threshold: relative importance, in mu* or sigma, under which a parameter is dropped
+            param nominal: dictionary of the nominal values of the parameters (middle of the bounds by default)
+            param results_folder: folder where the samples, the outputs and the indices of the screening are saved
+            return: a data frame of mu*, its confidence interval, sigma and the decision for each parameter,
+                    ranked by mu*
+        """
+        names = self.problem['names']
+        nominal = dict(nominal or {})
+        for name, bounds, dist in zip(names, self.problem['bounds'], self.problem['dists']):
+            if name not in nominal:
+                if dist != 'unif':
+                    raise ValueError("The nominal value of the parameter {} ({} distribution) must be given".format(name, dist))
+                nominal[name] = (bounds[0] + bounds[1])/2
+        
+        # Morris design run through the same evaluation path as the Sobol samples
+        X = morris_sample(self.problem, trajectories, num_levels = num_levels, seed = self.seed)
+        start_time = time()
+        Y = self.model(X, cache, pool).evaluate(self.outputs_indices, num_processors, streaming = streaming).ravel()
+        duration = time() - start_time
+        Si = morris_analyze(self.problem, X, Y, num_levels = num_levels, print_to_console = False, seed = 2024)
+        
+        mu_star, sigma = np.asarray(Si['mu_star']), np.asarray(Si['sigma'])
+        relevance = np.maximum(mu_star/mu_star.max() if mu_star.max() > 0 else mu_star,
+                               sigma/sigma.max() if sigma.max() > 0 else sigma)
+        kept = relevance >= threshold
+        self.screening = pd.DataFrame({'mu_star': mu_star, 'mu_star_conf': np.asarray(Si['mu_star_conf']),
+                                       'sigma': sigma, 'mu_star/sigma': mu_star/np.where(sigma > 0, sigma, np.nan),
+                                       'relevance': relevance, 'kept': kept, 'nominal': [nominal[name] for name in names]},
+                                      index = pd.Index(names, name = 'parameter')).sort_values('mu_star', ascending = False)
+        print("§"*100)
+        print("It took {} seconds ({} hours) to run the {} E+ simulations of the screening.".format(duration, duration/3600, len(Y)))
+        print(self.screening)
+        print("§"*100)
+        
+        if results_folder is not None:
+            os.makedirs(results_folder, exist_ok = True)
+            pd.DataFrame(X, columns = names).assign(Y = Y).to_csv(os.path.join(results_folder, "morris_runs.csv"), index = False)
+            self.screening.to_csv(os.path.join(results_folder, "morris_indices.csv"))
+        
+        # Sobol samples of the parameters kept, the others being pinned
+        self.fixed.update({name: nominal[name] for name, keep in zip(names, kept) if not keep})
+        self.problem = {'num_vars': int(kept.sum()),
+                        'names': [name for name, keep in zip(names, kept) if keep],
+                        'bounds': [bounds for bounds, keep in zip(self.problem['bounds'], kept) if keep],
+                        'dists': [dist for dist, keep in zip(self.problem['dists'], kept) if keep]}
+        self.X = sample(self.problem, self.num_initial_samples, seed = self.seed)
+        self.Y = np.zeros(self.X.shape[0])
+        
+        return self.screening
+
+
+    def convergence(self, Si):
+        """
+            Convergence criteria of a set of indices
+            param Si: indices returned by analyze
+            return: the widest confidence interval of the S1, ST (and S2) indices and the ranking of the parameters by ST
+        """
+        conf = [Si['S1_conf'], Si['ST_conf']]
+        if 'S2_conf' in Si:
+            conf.append(Si['S2_conf'])
+        
+        # Confidence intervals of half-width conf around the indices
+        width = 2*max(np.nanmax(np.abs(c)) for c in conf)
+        return width, list(np.argsort(-np.asarray(Si['ST'])))
+
+
+    def evaluate_progressive(self, num_processors, max_samples, ci_width = None, stable_rankings = None, cache = None,
+                             streaming = False, pool = None):
+        """
+            Progressive analysis: the Sobol sequence is extended by powers of two from num_initial_samples, only the
+            new block of samples being simulated at each step, and the indices with their bootstrap confidence
+            intervals are updated after each block until they converge or max_samples is reached
+            param max_samples: maximum number of samples of the Sobol sequence (power of two)
+            param ci_width: the analysis stops once all the confidence intervals of S1, ST and S2 are narrower
+            param stable_rankings: the analysis stops once the ranking of the parameters by ST is the same after this
+                                   number of successive blocks
+            return: the dictionary of sensitivity indices of the last block (see evaluate)
+        """
+        
+        # The first rows of the Saltelli design of 2n samples are the design of n samples with the same seed
+        if self.seed is None:
+            raise ValueError("A progressive analysis needs the seed of the Sobol sequence to extend it")
+        
+        n = self.num_initial_samples
+        self.X = np.zeros((0, self.problem['num_vars']))
+        self.Y = np.zeros(0)
+        self.history = []
+        
+        while True:
+            X = sample(self.problem, n, seed = self.seed)
+            X_block = X[len(self.X):]
+            
+            # Simulation of the new block only
+            start_time = time()
+            eplus = self.model(X_block, cache, pool)
+            Y_block = eplus.evaluate(self.outputs_indices, num_processors, streaming = streaming).ravel()
+            self.X, self.Y = X, np.concatenate([self.Y, Y_block])
+            duration = time() - start_time
+            
+            self.Si = analyze(self.problem, self.Y, print_to_console=False, parallel=True,
+                              keep_resamples=True, n_processors=num_processors, seed=2024)
+            width, ranking = self.convergence(self.Si)
+            self.history.append({'samples': n, 'simulations': len(self.Y), 'ci_width': width, 'ranking': ranking,
+                                 'duration': duration})
+            print("n = {}: {} simulations ({} new ones in {} hours), widest confidence interval {:.4f}, ranking {}.".format(
+                  n, len(self.Y), len(Y_block), duration/3600, width, [self.problem['names'][k] for k in ranking]))
+            
+            # Convergence of the confidence intervals or of the ranking of the parameters
+            converged = ci_width is not None and width <= ci_width
+            if stable_rankings is not None and len(self.history) >= stable_rankings:
+                rankings = [step['ranking'] for step in self.history[-stable_rankings:]]
+                converged = converged or all(r == rankings[0] for r in rankings)
+            if converged or 2*n > max_samples:
+                break
+            n *= 2
+        
+        print("§"*100)
+        print("The analysis {} after {} E+ simulations (n = {}).".format("converged" if converged else "did not converge",
+                                                                         len(self.Y), n))
+        if cache is not None:
+            print("{} simulations were taken from the cache.".format(cache.hits))
+        if pool is not None:
+            pool.report()
+        print("§"*100)
+        
+        return self.Si
 
 
+    def evaluate_surrogate(self, num_processors, design_size = None, batch_size = None, max_simulations = None,
+                           target_q2 = 0.9, N = 2**14, realizations = 50, cache = None, streaming = False, pool = None):
+        """
+            Surrogate analysis: a Latin hypercube design of a few simulations per parameter is run, a Gaussian process
+            emulator (kernel and hyperparameters of Predictions) is fitted on it and the Sobol indices are computed on
+            the emulator over a Saltelli design of N base samples, their confidence intervals including the
+            uncertainty of the emulator. While the leave-one-out Q2 of the emulator is below target_q2, batches of
+            simulations are added where the emulator is the most uncertain (see AdaptiveDesign.select_batch).
+            param design_size: number of simulations of the initial design (10 per parameter by default)
+            param batch_size: number of simulations added at each enrichment of the design (one per parameter by default)
+            param max_simulations: maximum number of simulations (4 times the initial design by default)
+            param N: number of base samples of the Saltelli design evaluated by the emulator
+            param realizations: number of realizations of the emulator propagated to the confidence intervals
+            return: the dictionary of sensitivity indices (see evaluate), with the emulator and Monte Carlo parts
+                    of the variance of each index
+        """
+        p = self.problem['num_vars']
+        design_size = design_size or 10*p
+        batch_size = batch_size or p
+        max_simulations = max_simulations or 4*design_size
+        seed = 2024 if self.seed is None else self.seed
+        
+        # Saltelli design evaluated by the emulator, the bounds of the emulator inputs being the bounds of the
+        # uniform parameters and the range of the design for the other distributions
+        X_sobol = sample(self.problem, N, seed = seed)
+        lower = [b[0] if dist == 'unif' else X_sobol[:, k].min() for k, (b, dist)
+                 in enumerate(zip(self.problem['bounds'], self.problem['dists']))]
+        upper = [b[1] if dist == 'unif' else X_sobol[:, k].max() for k, (b, dist)
+                 in enumerate(zip(self.problem['bounds'], self.problem['dists']))]
+        
+        start_time = time()
+        X = latin_sample(self.problem, design_size, seed = seed)
+        Y = self.model(X, cache, pool).evaluate(self.outputs_indices, num_processors, streaming = streaming).ravel()
+        
+        batch = 0
+        while True:
+            self.surrogate = GPSurrogate(X, Y, lower, upper, num_processors = num_processors, seed = seed)
+            self.cv = self.surrogate.cross_validation()
+            print("{} simulations: leave-one-out Q2 {:.4f}, RMSE {:.4f} (standardized output).".format(
+                  len(Y), self.cv['q2'], self.cv['rmse']))
+            if self.cv['q2'] >= target_q2 or len(Y) + batch_size > max_simulations:
+                break
+            
+            # New simulations where the emulator is the most uncertain, spread out over the candidates
+            batch += 1
+            candidates = latin_sample(self.problem, 50*batch_size, seed = seed + batch)
+            X_new = select_batch(self.surrogate, candidates, batch_size)
+            Y_new = self.model(X_new, cache, pool).evaluate(self.outputs_indices, num_processors, streaming = streaming).ravel()
+            X, Y = np.vstack([X, X_new]), np.concatenate([Y, Y_new])
+        
+        self.X, self.Y = X, Y
+        duration = time() - start_time
+        print("§"*100)
+        print("It took {} seconds ({} hours) to run the {} E+ simulations of the emulator.".format(duration, duration/3600, len(Y)))
+        if self.cv['q2'] < target_q2:
+            print("The emulator did not reach the target Q2 of {} within {} simulations.".format(target_q2, max_simulations))
+        if cache is not None:
+            print("{} simulations were taken from the cache.".format(cache.hits))
+        if pool is not None:
+            pool.report()
+        print("§"*100)
+        
+        # Indices of the emulator
+        start_time = time()
+        self.Si = surrogate_sobol(self.problem, self.surrogate, X_sobol, realizations = realizations, seed = seed)
+        duration = time() - start_time
+        print(self.Si.to_df())
+        print("§"*100)
+        print("It took {} seconds ({} hours) to conduct analysis of sensivity on {} emulator evaluations.".format(
+              duration, duration/3600, len(X_sobol)))
+        
+        return self.Si
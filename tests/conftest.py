@@ -0,0 +1,62 @@
+import os
+import sys
+import stat
+import pytest
+
+
+# Stand-in for the EnergyPlus executable, with the same command line: it writes a summary report whose only cell is
+# the sum of the numbers of the *.idf file, and the arguments it was called with; a model containing FAIL makes it
+# exit with an error on stderr, as does the first run after the file named by STUB_FAIL_ONCE is created
+STUB = '''#!{python}
+import os
+import re
+import sys
+
+args = sys.argv[1:]
+idf_file = args[-1]
+value = lambda flag: args[args.index(flag) + 1]
+with open(idf_file) as idf:
+    content = idf.read()
+
+marker = os.environ.get('STUB_FAIL_ONCE')
+try:
+    os.remove(marker)
+    transient = True
+except (TypeError, OSError):
+    transient = False
+if 'FAIL' in content or transient:
+    sys.stderr.write('**  Fatal  ** stub failure on {{}}\\n'.format(os.path.basename(idf_file)))
+    sys.exit(3)
+
+prefix = os.path.join(value('--output-directory'), value('--output-prefix'))
+total = sum(float(number) for number in re.findall(r'-?\\d+(?:\\.\\d+)?', content))
+with open(prefix + '-table.htm', 'w') as report:
+    report.write('<p>Report:<b> Annual Building Utility Performance Summary</b></p>\\n<b>End Uses</b><br><br>\\n'
+                 '<table border="1">\\n<tr><td></td><td align="right">Electricity [kWh]</td></tr>\\n'
+                 '<tr><td align="right">Heating</td><td align="right">{{:.4f}}</td></tr>\\n</table>\\n'.format(total))
+with open(prefix + '-args.txt', 'w') as arguments:
+    arguments.write('\\n'.join(args))
+'''
+
+TEMPLATE = 'Output:Stub,\n  {{ a }},    !- a\n  {{ b }};    !- b\n'
+
+
+@pytest.fixture
+def energyplus(tmp_path):
+
+    # Path of the stub executable
+    path = tmp_path / 'energyplus'
+    path.write_text(STUB.format(python = sys.executable))
+    path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return str(path)
+
+
+@pytest.fixture
+def model_files(tmp_path):
+
+    # IDF template with the parameters a and b, and a weather file
+    template = tmp_path / 'template.idf'
+    template.write_text(TEMPLATE)
+    epw = tmp_path / 'weather.epw'
+    epw.write_text('LOCATION,Stub\n')
+    return str(template), str(epw)
@@ -0,0 +1,67 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from EppyUtility import EplusPy, eplaunch_options, launch_energyplus
+from SimulationCache import SimulationCache
+
+
+def test_launch_energyplus_passes_the_options(tmp_path, model_files, energyplus):
+    idf_file = tmp_path / 'run-0.idf'
+    idf_file.write_text('Output:Stub, 1.5, 2;')
+    launch_energyplus(str(idf_file), model_files[1], eplaunch_options(str(idf_file), '9-4-0'), energyplus)
+    args = (tmp_path / 'run-0-args.txt').read_text().split('\n')
+    assert args == ['--weather', model_files[1], '--output-directory', str(tmp_path), '--output-prefix', 'run-0',
+                    '--output-suffix', 'D', '--readvars', '--expandobjects', str(idf_file)]
+
+    options = dict(eplaunch_options(str(idf_file), '9-4-0'), readvars = False, expandobjects = False)
+    launch_energyplus(str(idf_file), model_files[1], options, energyplus)
+    assert '--readvars' not in (tmp_path / 'run-0-args.txt').read_text()
+
+
+def test_launch_energyplus_reports_the_failures(tmp_path, model_files, energyplus):
+    idf_file = tmp_path / 'run-1.idf'
+    idf_file.write_text('Output:Stub, FAIL;')
+    with pytest.raises(RuntimeError, match = r'exit code 3.*stub failure on run-1\.idf'):
+        launch_energyplus(str(idf_file), model_files[1], eplaunch_options(str(idf_file), '9-4-0'), energyplus)
+    assert not (tmp_path / 'run-1-table.htm').exists()
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_evaluate_round_trip(tmp_path, model_files, energyplus, streaming):
+    cache = SimulationCache(str(tmp_path / 'cache'))
+    eplus = EplusPy(None, model_files[1], model_files[0], energyplus = energyplus, cache = cache)
+    X = np.array([[1.0, 2.0], [3.0, 4.5], [0.5, 0.25]])
+    outputs = [('End Uses', 'Heating', 'Electricity [kWh]')]
+    Y = eplus.evaluate(['a', 'b'], X, str(tmp_path / 'eval'), outputs, 2, streaming = streaming)
+    np.testing.assert_allclose(Y.ravel(), X.sum(axis = 1))
+
+    # The samples already simulated are taken from the cache, only the new one is run
+    X_new = np.vstack([X, [[2.0, 2.0]]])
+    results = {}
+    Y_new = eplus.evaluate(['a', 'b'], X_new, str(tmp_path / 'eval'), outputs, 2, streaming = streaming,
+                           on_result = lambda i, Y_i: results.setdefault(i, float(np.ravel(Y_i)[0])))
+    np.testing.assert_allclose(Y_new.ravel(), X_new.sum(axis = 1))
+    assert cache.hits == 3
+    assert list(results) == [0, 1, 2, 3] and np.allclose([results[i] for i in range(4)], X_new.sum(axis = 1))
+
+
+def test_worker_caches_keep_the_most_recently_used_entries(tmp_path, model_files, monkeypatch):
+    import EppyUtility
+    monkeypatch.setattr(EppyUtility, '_TEMPLATES', {})
+    monkeypatch.setattr(EppyUtility, '_PIPELINE', {})
+    templates = []
+    for k in range(2*EppyUtility.WORKER_CACHE_SIZE):
+        template = tmp_path / 'template-{}.idf'.format(k)
+        template.write_text('Output:Stub, {{ a }}, %d;' % k)
+        templates.append(str(template))
+        EppyUtility._template(templates[0])
+        assert EppyUtility._template(str(template)).render({'a': 1}) == 'Output:Stub, 1, %d;' % k
+        config = {'token': k, 'idf_template_file': str(template), 'outputs_indices': [('End Uses', 'Heating', 1)]}
+        assert EppyUtility._pipeline_config(config) is EppyUtility._pipeline_config(dict(config))
+    # The template used at each step stays, the others are evicted from the oldest
+    assert set(EppyUtility._TEMPLATES) == {templates[0]} | set(templates[-EppyUtility.WORKER_CACHE_SIZE + 1:])
+    assert list(EppyUtility._PIPELINE) == list(range(EppyUtility.WORKER_CACHE_SIZE, 2*EppyUtility.WORKER_CACHE_SIZE))
@@ -0,0 +1,33 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from EPWReader import HEADER_LINES, aggregate, header_lines, read_epw
+
+
+HEADER = ['LOCATION,Stub,-,FRA,IWEC,071500,48.88,2.20,1.0,50.0', 'DESIGN CONDITIONS,0', 'TYPICAL/EXTREME PERIODS,0',
+          'GROUND TEMPERATURES,0', 'HOLIDAYS/DAYLIGHT SAVINGS,No,0,0,0', 'COMMENTS 1,stub', 'COMMENTS 2,stub',
+          'DATA PERIODS,1,1,Data,Sunday, 1/ 1,12/31']
+
+
+def records(hours = 48):
+
+    # Hourly records of January 2021 whose dry bulb temperature (field 6) is the index of the hour
+    return ['2021,1,{},{},60,*,{:.1f},2.0,80'.format(1 + k//24, 1 + k%24, float(k)) for k in range(hours)]
+
+
+@pytest.mark.parametrize('header', [True, False])
+def test_header_is_skipped_only_when_present(tmp_path, header):
+    epw_file = tmp_path / 'weather.epw'
+    epw_file.write_text('\n'.join((HEADER if header else []) + records()) + '\n')
+    assert header_lines(str(epw_file)) == (HEADER_LINES if header else 0)
+
+    for cache_folder in (None, str(tmp_path / 'cache'), str(tmp_path / 'cache')):
+        data = read_epw(str(epw_file), [6], cache_folder = cache_folder)
+        assert len(data) == 48
+        np.testing.assert_array_equal(data[6].to_numpy(), np.arange(48.0))
+        assert str(data.index[0]) == '2021-01-01 00:00:00'
+    np.testing.assert_allclose(aggregate(data, 'D')[(6, 'mean')].to_numpy(), [11.5, 35.5])
@@ -0,0 +1,98 @@
+import os
+import sys
+import tracemalloc
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from Predictions import DistanceCache, PosteriorPredictor, eta_pred, fit_map, log_marginal_likelihood, predict_draws
+
+
+def koh_data(seed = 0):
+
+    # Small Kennedy & O'Hagan data set with pairs of close simulations: without nugget, part of the Laplace
+    # samples around the mode give a covariance of z that is not positive definite
+    rng = np.random.default_rng(seed)
+    xf = np.linspace(0, 1, 6)[:, None]
+    zf = np.sin(3*xf[:, 0]) + 0.3 + 0.01*rng.standard_normal(len(xf))
+    xc = np.repeat(rng.uniform(0, 1, (10, 1)), 2, axis = 0) + 1e-2*rng.standard_normal((20, 1))
+    tc = np.repeat(rng.uniform(0, 1, (10, 1)), 2, axis = 0)
+    zc = np.sin(3*xc[:, 0]) + tc[:, 0]
+    return xf, xc, tc, np.concatenate([zf, zc])
+
+
+def draw_list(draws):
+    return [{name: values[k] for name, values in draws.items()} for k in range(len(draws['lambda_eta']))]
+
+
+def test_laplace_draws_have_positive_definite_covariance():
+    xf, xc, tc, z = koh_data()
+    for nugget in (True, False):
+        fit = fit_map(xf, xc, tc, z, restarts = 2, num_processors = 1, laplace = True, n_draws = 50,
+                      seed = 1, nugget = nugget)
+        assert len(fit['draws']['lambda_eta']) == 50
+        if nugget is False:
+            assert fit['rejected'] > 0
+        for draw in draw_list(fit['draws']):
+            assert np.isfinite(log_marginal_likelihood(draw, xf, xc, tc, z))
+    assert 'lambda_sim' not in fit_map(xf, xc, tc, z, restarts = 1, laplace = True, n_draws = 5, seed = 1)['posterior']
+
+
+def test_laplace_draws_can_be_predicted():
+    xf, xc, tc, z = koh_data()
+    fit = fit_map(xf, xc, tc, z, restarts = 2, num_processors = 1, laplace = True, n_draws = 20, seed = 2)
+    x_star = np.linspace(0, 1, 5)[:, None]
+    out, skipped = predict_draws(fit['draws'], x_star, xf, xc, tc, z, num_processors = 1, seed = 3,
+                                 return_skipped = True)
+    assert skipped == []
+    assert np.all(np.isfinite(out))
+
+
+
+def test_emulator_fit_plugs_into_predictors():
+    xf, xc, tc, z = koh_data()
+    zc = np.sin(3*xc[:, 0])
+    fit = fit_map(None, xc, None, zc, restarts = 2, num_processors = 1, laplace = True, n_draws = 10, seed = 7)
+    assert fit['posterior']['tf'].shape == (0,) and 'lambda_sim' in fit['posterior']
+    empty = np.empty((0, 1))
+    x_star = np.linspace(0, 1, 5)[:, None]
+    mu, var = PosteriorPredictor(fit['posterior'], empty, xc, np.empty((len(xc), 0)), zc).mean_var(x_star, 'eta')['eta']
+    np.testing.assert_allclose(mu, np.sin(3*x_star[:, 0]), atol = 0.05)
+    assert np.all(np.isfinite(eta_pred(fit['posterior'], x_star, empty, xc, np.empty((len(xc), 0)), zc)))
+    out = predict_draws(fit['draws'], x_star, empty, xc, np.empty((len(xc), 0)), zc, target = 'eta', num_processors = 1)
+    assert out.shape == (10, 5) and np.all(np.isfinite(out))
+
+def test_mean_var_is_chunked_with_distance_cache():
+    xf, xc, tc, z = koh_data()
+    fit = fit_map(xf, xc, tc, z, restarts = 1, num_processors = 1, seed = 4)
+    x_star = np.linspace(0, 1, 11)[:, None]
+    predictor = PosteriorPredictor(fit['posterior'], xf, xc, tc, z)
+    cached = PosteriorPredictor(fit['posterior'], xf, xc, tc, z, cache = DistanceCache(xf, xc, tc, x_star))
+    expected = {target: (mu, np.diag(cov)) for target, (mu, cov) in predictor.mean_cov(x_star).items()}
+    for chunk_size in (1, 4, len(x_star), 1000):
+        for model in (predictor, cached):
+            result = model.mean_var(x_star, chunk_size = chunk_size)
+            for target, (mu, var) in expected.items():
+                np.testing.assert_allclose(result[target][0], mu, rtol = 1e-4)
+                np.testing.assert_allclose(result[target][1], var, rtol = 1e-4, atol = 1e-8)
+
+    # By chunks, the peak memory no longer grows with the number of points to predict
+    x_star = np.linspace(0, 1, 4000)[:, None]
+    peaks = []
+    for chunk_size in (len(x_star), 50):
+        tracemalloc.start()
+        predictor.mean_var(x_star, chunk_size = chunk_size)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    assert peaks[1] < peaks[0]/4
+
+
+def test_pool_reads_distance_cache_from_shared_memory():
+    xf, xc, tc, z = koh_data()
+    fit = fit_map(xf, xc, tc, z, restarts = 2, num_processors = 1, laplace = True, n_draws = 6, seed = 5)
+    x_star = np.linspace(0, 1, 5)[:, None]
+    cache = DistanceCache(xf, xc, tc, x_star)
+    serial = predict_draws(fit['draws'], x_star, xf, xc, tc, z, num_processors = 1, seed = 6, cache = cache)
+    pooled = predict_draws(fit['draws'], x_star, xf, xc, tc, z, num_processors = 2, seed = 6, cache = cache)
+    np.testing.assert_allclose(pooled, serial, rtol = 1e-10)
+    assert set(cache.blocks) == {'train_x', 'train_t', 'star_x', 'star_star_x'}
@@ -0,0 +1,59 @@
+import os
+import sys
+import json
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from EppyUtility import EplusPy
+from RunManifest import RunManifest, campaign_key
+
+OUTPUTS = [('End Uses', 'Heating', 'Electricity [kWh]')]
+
+
+def test_truncated_last_line_is_skipped(tmp_path):
+    manifest_file = str(tmp_path / 'manifest.jsonl')
+    manifest = RunManifest(manifest_file)
+    manifest.start('campaign')
+    manifest.record(0, 'done', [1.0], duration = 2.0)
+    manifest.record(1, 'failed', duration = 1.0, error = 'RuntimeError()')
+
+    # Crash while the record of sample 1 was written
+    with open(manifest_file, 'a') as file:
+        file.write(json.dumps({'sample': 1, 'status': 'done', 'attempt': 2, 'Y': [2.0]})[:25])
+    resumed = RunManifest(manifest_file)
+    assert resumed.campaign == 'campaign' and list(resumed.done()) == [0] and resumed.failed() == [1]
+
+    # The next record is not lost in the cut line
+    resumed.record(1, 'done', [3.0], duration = 1.0)
+    reloaded = RunManifest(manifest_file)
+    assert sorted(reloaded.done()) == [0, 1] and reloaded.attempts[1] == 2
+    np.testing.assert_array_equal(reloaded.outputs(3), [[1.0], [3.0], [np.nan]])
+    with pytest.raises(ValueError):
+        reloaded.start('other campaign')
+
+
+def test_resumed_campaign_runs_only_the_missing_samples(tmp_path, model_files, energyplus, monkeypatch):
+    eplus = EplusPy(None, model_files[1], model_files[0], energyplus = energyplus)
+    X = np.array([[1.0, 2.0], [3.0, 4.5], [0.5, 0.25], [2.0, 2.0]])
+    manifest_file = str(tmp_path / 'manifest.jsonl')
+
+    # Samples 0 and 2 done by an interrupted run of the campaign, with outputs the stub would not give
+    manifest = RunManifest(manifest_file)
+    manifest.start(campaign_key(['a', 'b'], X, model_files[0], model_files[1], '9-4-0', [list(OUTPUTS[0])]))
+    manifest.record(0, 'done', [-1.0], duration = 1.0)
+    manifest.record(2, 'done', [-2.0], duration = 1.0)
+
+    # One transient failure, retried after a warning
+    marker = tmp_path / 'fail-once'
+    marker.touch()
+    monkeypatch.setenv('STUB_FAIL_ONCE', str(marker))
+    with pytest.warns(UserWarning, match = r'Retrying 1 failed simulation\(s\) in 0.0 seconds \(attempt 2 of 3\)'):
+        Y = eplus.evaluate_resumable(['a', 'b'], X, str(tmp_path / 'eval'), [list(OUTPUTS[0])], 2,
+                                     RunManifest(manifest_file), backoff = 0.0)
+    np.testing.assert_allclose(Y.ravel(), [-1.0, 7.5, -2.0, 4.0])
+
+    resumed = RunManifest(manifest_file)
+    assert sorted(resumed.done()) == [0, 1, 2, 3] and sorted(resumed.attempts.values()) == [1, 1, 1, 2]
+    assert not any(os.path.exists(os.path.join(tmp_path, 'eval', 'run-{}'.format(i))) for i in (0, 2))
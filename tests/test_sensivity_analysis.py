@@ -0,0 +1,84 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from EppyUtility import launch_energyplus, eplaunch_options
+from ResultsStore import ResultsStore
+from sensivity_analysis import SenAna
+
+
+PARAMETERS = {'bounds': [[0.0, 1.0], [0.0, 2.0]], 'obj_id': ['a', 'b'], 'distributions': ['unif', 'unif']}
+
+
+def reports(tmp_path, model_files, energyplus, values):
+
+    # Summary reports of the stub executable for models whose numbers sum to each value
+    files = []
+    for i, value in enumerate(values):
+        idf_file = tmp_path / 'run-{}.idf'.format(i)
+        idf_file.write_text('Output:Stub, {};'.format(value))
+        launch_energyplus(str(idf_file), model_files[1], eplaunch_options(str(idf_file), '9-4-0'), energyplus)
+        files.append(str(tmp_path / 'run-{}-table.htm'.format(i)))
+    return files
+
+
+def test_reports_share_one_locator_index(tmp_path, model_files, energyplus):
+    sa = SenAna(PARAMETERS, 4, seed = 1)
+    sa.outputs_indices = [('End Uses', 'Heating', 'Electricity [kWh]')]
+    files = reports(tmp_path, model_files, energyplus, [1.5, 2.5, 4.0])
+    assert [sa.read_html_tables(file) for file in files] == [1.5, 2.5, 4.0]
+    extractor = sa.extractor()
+    assert extractor.index is not None and sa.read_html_tables(files[0]) == 1.5 and sa.extractor() is extractor
+
+    # A new output target gets a new extractor
+    sa.outputs_indices = [('End Uses', 1, 1)]
+    assert sa.extractor() is not extractor and np.isclose(sa.read_html_tables(files[2]), 4.0)
+
+
+class Model:
+
+    # Stand-in for the energy model of the samples X, with an analytic output, interrupted after fail_after runs
+    def __init__(self, X, fail_after = None):
+        self.X = X
+        self.fail_after = fail_after
+
+    def evaluate(self, outputs_indices, num_processors, streaming = False, manifest = None, on_result = None):
+        Y = self.X[:, 0] + 0.2*np.sin(3*self.X[:, 1])
+        for i in range(len(Y)):
+            if i == self.fail_after:
+                raise KeyboardInterrupt
+            if on_result is not None:
+                on_result(i, Y[i:i+1])
+        return Y
+
+
+def test_surrogate_indices_are_reproducible_without_seed():
+    indices = []
+    for k in range(2):
+        sa = SenAna(PARAMETERS, 4)
+        sa.model = lambda X, cache = None, pool = None: Model(X)
+        Si = sa.evaluate_surrogate(1, design_size = 12, N = 2**5, realizations = 4)
+        indices.append(np.concatenate([Si['S1'], Si['ST'], Si['S1_conf']]))
+    np.testing.assert_array_equal(indices[0], indices[1])
+
+
+def test_runs_are_stored_as_they_finish(tmp_path):
+    store = ResultsStore(str(tmp_path / 'Results.h5'))
+    sa = SenAna(PARAMETERS, 4, seed = 1)
+    sa.model = lambda X, cache = None, pool = None: Model(X, fail_after = 10)
+    try:
+        sa.evaluate(1, store = store, campaign = 'sobol')
+    except KeyboardInterrupt:
+        pass
+    runs = store.read('sobol')
+    assert runs['sample'].tolist() == list(range(10))
+    np.testing.assert_allclose(runs[['a', 'b']].to_numpy(), sa.X[:10])
+
+    sa.model = lambda X, cache = None, pool = None: Model(X)
+    sa.evaluate(1, store = store, campaign = 'sobol')
+    runs = store.read('sobol')
+    assert runs['sample'].tolist() == list(range(len(sa.X)))
+    np.testing.assert_allclose(runs['Y'].to_numpy(), sa.Y)
+    assert 'duration' in store.metadata('sobol') and 'S1' in store.indices('sobol')[1]
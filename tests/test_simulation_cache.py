@@ -0,0 +1,42 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from SimulationCache import SimulationCache
+
+
+def test_overwritten_entries_are_counted_once(tmp_path):
+    cache = SimulationCache(str(tmp_path / 'cache'))
+    cache.put('ab01', np.arange(3.0))
+    size = cache.size
+    for k in range(5):
+        cache.put('ab01', np.arange(3.0) + k)
+    assert (cache.count, cache.size) == (1, size)
+    cache.put('ab01', np.arange(10.0))
+    assert cache.size == size + 7*8
+    np.testing.assert_array_equal(cache.get('ab01'), np.arange(10.0))
+
+    # The accounting matches the entries on disk, so that the limits are not reached early
+    reopened = SimulationCache(str(tmp_path / 'cache'))
+    assert (reopened.count, reopened.size) == (cache.count, cache.size)
+
+
+def test_eviction_of_the_least_recently_used_entries(tmp_path):
+    cache = SimulationCache(str(tmp_path / 'cache'), max_entries = 2)
+    for k, key in enumerate(['aa00', 'bb00', 'aa00', 'cc00']):
+        cache.put(key, np.full(2, k))
+        os.utime(cache._path(key), (k, k))
+    assert cache.count == 2 and cache.get('bb00') is None and cache.get('aa00') is not None
+
+
+def test_key_depends_on_the_executable(tmp_path):
+    epw = tmp_path / 'weather.epw'
+    epw.write_text('LOCATION,Stub\n')
+    cache = SimulationCache(str(tmp_path / 'cache'))
+    key = cache.key('Output:Stub, 1;', str(epw), '9-4-0', [('End Uses', 'Heating', 1)])
+    assert key == cache.key('Output:Stub, 1;', str(epw), '9-4-0', [('End Uses', 'Heating', 1)], None)
+    stub = cache.key('Output:Stub, 1;', str(epw), '9-4-0', [('End Uses', 'Heating', 1)], str(tmp_path / 'energyplus'))
+    real = cache.key('Output:Stub, 1;', str(epw), '9-4-0', [('End Uses', 'Heating', 1)], '/usr/local/EnergyPlus-9-4-0/energyplus')
+    assert len({key, stub, real}) == 3
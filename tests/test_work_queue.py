@@ -0,0 +1,70 @@
+import os
+import sys
+import threading
+import numpy as np
+import pytest
+from time import sleep
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, 'src'))
+
+from EppyUtility import EplusPy
+from WorkQueue import QueueBackend, QueueWorker, WorkQueue
+
+
+def test_jobs_are_claimed_requeued_and_failed(tmp_path, model_files):
+    queue = WorkQueue(str(tmp_path / 'queue'), heartbeat_timeout = 0.2, max_attempts = 2)
+    batch = queue.submit([('run-0', {'a': 1.0, 'b': 2.0}), ('run-1', {'a': 3.0, 'b': 4.0})], *model_files, '9-4-0')
+    assert queue.counts(batch) == {'queued': 2}
+
+    job_id, name, template, epw, ep_version, params = queue.claim('lost')
+    assert (name, ep_version, params) == ('run-0', '9-4-0', {'a': 1.0, 'b': 2.0})
+    assert os.path.exists(queue.file(template)) and os.path.exists(queue.file(epw))
+    assert queue.requeue_lost() == 0
+
+    # Without heartbeat, the job is put back in the queue and claimed again first
+    sleep(0.3)
+    assert queue.requeue_lost() == 1
+    assert queue.counts(batch) == {'queued': 2}
+    assert queue.claim('worker')[0] == job_id
+
+    # Second failed attempt out of max_attempts: the job is failed, its late result is discarded
+    queue.fail(job_id, 'worker', 'RuntimeError()')
+    assert queue.finished(batch) == [(job_id, 'run-0', 'failed', 'RuntimeError()')]
+    outputs = tmp_path / 'late'
+    outputs.mkdir()
+    queue.complete(job_id, 'lost', str(outputs), 1.0)
+    assert not os.path.exists(queue.result(job_id))
+    assert queue.counts(batch) == {'failed': 1, 'queued': 1}
+
+
+def test_worker_results_are_collected(tmp_path, model_files, energyplus):
+    queue = WorkQueue(str(tmp_path / 'queue'))
+    batch = queue.submit([('run-0', {'a': 1.0, 'b': 2.0}), ('run-1', {'a': 3.0, 'b': 'FAIL'})], *model_files, '9-4-0')
+    QueueWorker(queue, str(tmp_path / 'scratch'), energyplus = energyplus).run(stop_when_empty = True)
+    assert queue.counts(batch) == {'done': 1, 'failed': 1}
+
+    eval_folder = tmp_path / 'eval'
+    eval_folder.mkdir()
+    collected = set()
+    failed = QueueBackend(queue).collect(batch, str(eval_folder), collected)
+    assert len(collected) == 2
+    assert [name for name, error in failed] == ['run-1'] and 'stub failure' in failed[0][1]
+    assert (eval_folder / 'run-0-table.htm').exists()
+    assert QueueBackend(queue).collect(batch, str(eval_folder), collected) == []
+
+
+def test_evaluate_runs_on_the_backend(tmp_path, model_files, energyplus):
+    queue = WorkQueue(str(tmp_path / 'queue'))
+    agent = QueueWorker(queue, str(tmp_path / 'scratch'), energyplus = energyplus, idle = 0.05)
+    threading.Thread(target = agent.run, daemon = True).start()
+
+    eplus = EplusPy(None, model_files[1], model_files[0], backend = QueueBackend(queue, poll = 0.05))
+    X = np.array([[1.0, 2.0], [3.0, 4.5], [0.5, 0.25]])
+    Y = eplus.evaluate(['a', 'b'], X, str(tmp_path / 'eval'), [('End Uses', 'Heating', 'Electricity [kWh]')], 1,
+                       streaming = True)
+    np.testing.assert_allclose(Y.ravel(), X.sum(axis = 1))
+    assert queue.counts() == {'done': 3}
+    assert os.listdir(queue.files_folder) and not any(os.path.isdir(os.path.join(queue.files_folder, name))
+                                                      for name in os.listdir(queue.files_folder))
+    with pytest.raises(ValueError):
+        eplus.evaluate(['a', 'b'], X, str(tmp_path / 'eval'), [('End Uses', 'Heating', 1)], 1, manifest = object())